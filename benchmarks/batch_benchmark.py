@@ -0,0 +1,66 @@
+#!/usr/bin/python
+#
+# batch_benchmark.py
+#
+# times decoding a batch of QPIGS responses (the test response with varying values)
+# - live: a request per frame (setResponse then getResponseDict(typed=True)), as the library does when polling
+# - batch: mppbatch.mppBatchDecoder (numpy columns)
+# needs numpy
+#
+# python benchmarks/batch_benchmark.py
+# python benchmarks/batch_benchmark.py -n 100000
+#
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mppsolar.mppcommand import get_full_command  # noqa: E402
+from mppsolar.mppregistry import getCommandRegistry  # noqa: E402
+
+
+def makeFrames(count):
+    """
+    Returns count valid QPIGS responses
+    """
+    frames = []
+    for _ in range(count):
+        values = (random.uniform(200, 250), random.uniform(49, 51), random.randint(0, 5000), random.uniform(44, 58),
+                  random.randint(0, 100), ''.join(random.choice('01') for _ in range(8)))
+        frames.append(get_full_command(
+            '({:05.1f} {:04.1f} 230.0 49.9 0161 {:04d} 003 460 {:05.2f} 012 {:03d} 0069 0014 103.8 57.45 00000 {} '
+            '00 00 00856 010'.format(*values)))
+    return frames
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark decoding a batch of responses')
+    parser.add_argument('-n', '--count', type=int, help='Frames in the batch', default=20000)
+    args = parser.parse_args()
+
+    from mppsolar.mppbatch import mppBatchDecoder
+
+    command, _ = getCommandRegistry().find('QPIGS')
+    frames = makeFrames(args.count)
+
+    start = time.time()
+    for frame in frames:
+        request = command.createRequest()
+        request.setResponse(frame)
+        request.getResponseDict(typed=True)
+    live = time.time() - start
+
+    start = time.time()
+    valid, columns = mppBatchDecoder(command).decode(frames)
+    batch = time.time() - start
+
+    print('{} frames ({} valid), {} columns'.format(len(frames), valid.sum(), len(columns)))
+    print('{:<8} {:>10.3f} s {:>10.2f} us/frame'.format('live', live, live * 1e6 / len(frames)))
+    print('{:<8} {:>10.3f} s {:>10.2f} us/frame'.format('batch', batch, batch * 1e6 / len(frames)))
+
+
+if __name__ == '__main__':
+    main()
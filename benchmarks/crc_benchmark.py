@@ -0,0 +1,69 @@
+#!/usr/bin/python
+#
+# crc_benchmark.py
+#
+# compares the CRC implementations on typical frames
+# - nibble: the previous implementation (16 entry table, ctypes to truncate to a byte)
+# - table: the pure python 256 entry table (mppcrc.crc16_table)
+# - hqx: binascii.crc_hqx (mppcrc.crc16, what the library uses)
+#
+# python benchmarks/crc_benchmark.py
+# python benchmarks/crc_benchmark.py -n 20000
+#
+import ctypes
+import os
+import sys
+import timeit
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mppsolar import mppcrc  # noqa: E402
+
+# (name, frame data the CRC is calculated over)
+FRAMES = [
+    ('QPIGS command', b'QPIGS'),
+    ('QPIGS response', b'(000.0 00.0 230.0 49.9 0161 0119 003 460 57.50 012 100 0069 0014 103.8 57.45 00000 00110110 00 00 00856 010'),
+    ('QPIRI response', b'(230.0 21.7 230.0 50.0 21.7 5000 4000 48.0 46.0 42.0 56.4 54.0 0 10 010 1 0 0 6 01 0 0 54.0 0 1'),
+]
+
+NIBBLE_TABLE = [0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50a5, 0x60c6, 0x70e7,
+                0x8108, 0x9129, 0xa14a, 0xb16b, 0xc18c, 0xd1ad, 0xe1ce, 0xf1ef]
+
+
+def nibble_crc16(data):
+    crc = 0
+    for c in bytearray(data):
+        da = ctypes.c_uint8(crc >> 8).value >> 4
+        crc <<= 4
+        crc ^= NIBBLE_TABLE[da ^ (c >> 4)]
+        da = ctypes.c_uint8(crc >> 8).value >> 4
+        crc <<= 4
+        crc ^= NIBBLE_TABLE[da ^ (c & 0x0f)]
+    return ctypes.c_uint16(crc).value
+
+
+IMPLEMENTATIONS = [('nibble', nibble_crc16), ('table', mppcrc.crc16_table), ('hqx', mppcrc.crc16)]
+
+
+def main():
+    parser = ArgumentParser(description='Compare the CRC implementations')
+    parser.add_argument('-n', '--number', type=int, help='CRCs per timing', default=5000)
+    parser.add_argument('-r', '--repeat', type=int, help='Timings per implementation (the best is used)', default=5)
+    args = parser.parse_args()
+
+    print('{:<16} {:>6} {}'.format('frame', 'bytes', ' '.join('{:>10}'.format(name + ' us') for name, _ in IMPLEMENTATIONS)))
+    for label, data in FRAMES:
+        results = set(function(data) for _, function in IMPLEMENTATIONS)
+        if len(results) != 1:
+            print('FAIL: implementations disagree on {}'.format(label))
+            sys.exit(1)
+        timings = []
+        for _, function in IMPLEMENTATIONS:
+            best = min(timeit.repeat(lambda: function(data), number=args.number, repeat=args.repeat))
+            timings.append(best / args.number * 1e6)
+        print('{:<16} {:>6} {}'.format(label, len(data), ' '.join('{:>10.2f}'.format(t) for t in timings)))
+
+
+if __name__ == '__main__':
+    main()
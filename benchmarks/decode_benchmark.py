@@ -0,0 +1,72 @@
+#!/usr/bin/python
+#
+# decode_benchmark.py
+#
+# times decoding the test response of each command into a sample and into its response dict,
+# and receiving it (checking the frame, as for every command sent, and decoding it to a sample)
+# and prints the memory held by one sample and by one response dict
+# - responses are the bytes a connection returns
+# - commands whose test response is not valid are skipped
+#
+# python benchmarks/decode_benchmark.py -n 10000
+#
+import os
+import sys
+import timeit
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+COMMANDS = ['QPIGS', 'QPIRI', 'QPGS0', 'QFLAG', 'QPIWS', 'QMOD', 'QID']
+
+
+def receiveSample(command, response):
+    request = command.createRequest()
+    request.setResponse(response)
+    return request.getSample()
+
+
+def sampleSize(sample):
+    # the schema is shared by every sample of the command, so is not counted
+    return sys.getsizeof(sample) + sys.getsizeof(sample.values)
+
+
+def dictSize(response_dict):
+    return sys.getsizeof(response_dict) + sum(sys.getsizeof(item) for item in response_dict.values())
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark decoding responses')
+    parser.add_argument('-n', '--count', type=int, help='Decodes of each response', default=10000)
+    args = parser.parse_args()
+
+    from mppsolar.mppcommand import toFrame
+    from mppsolar.mppregistry import getCommandRegistry
+
+    registry = getCommandRegistry()
+    total = [0.0, 0.0, 0.0]
+    columns = ('sample us', 'decode us', 'receive us', 'sample bytes', 'dict bytes')
+    print('{:<15} {:>11} {:>11} {:>11} {:>13} {:>11}'.format('', *columns))
+    for cmd in COMMANDS:
+        command, _ = registry.find(cmd)
+        if command is None or not command.test_responses:
+            continue
+        response = toFrame(command.test_responses[0])
+        if not command.isResponseValid(response):
+            print('{:<15} (test response is not valid)'.format(cmd + ':'))
+            continue
+        sample = timeit.timeit(lambda: command.decodeSample(response), number=args.count)
+        decode = timeit.timeit(lambda: command.decodeResponse(response), number=args.count)
+        receive = timeit.timeit(lambda: receiveSample(command, response), number=args.count)
+        timings = [sample, decode, receive]
+        for i, timing in enumerate(timings):
+            total[i] += timing
+        micros = [timing * 1e6 / args.count for timing in timings]
+        sizes = [sampleSize(command.decodeSample(response)), dictSize(command.decodeResponse(response))]
+        print('{:<15} {:>11.2f} {:>11.2f} {:>11.2f} {:>13} {:>11}'.format(cmd + ':', *(micros + sizes)))
+    print('{:<15} {:>11.2f} {:>11.2f} {:>11.2f}'.format('total', *[timing * 1e6 / args.count for timing in total]))
+
+
+if __name__ == '__main__':
+    main()
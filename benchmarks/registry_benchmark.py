@@ -0,0 +1,42 @@
+#!/usr/bin/python
+#
+# registry_benchmark.py
+#
+# times creating inverters and looking up commands (including parameterised setters)
+#
+# python benchmarks/registry_benchmark.py -n 10000
+#
+import os
+import sys
+import timeit
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+COMMANDS = ['QPIGS', 'QMOD', 'Q1', 'QPIWS', 'PCP01', 'POP02', 'PBFT58.0', 'QPGS1', 'V123', 'INVALID99']
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the command registry')
+    parser.add_argument('-n', '--count', type=int, help='Lookups of each command', default=10000)
+    parser.add_argument('-i', '--inverters', type=int, help='Inverters to create', default=100)
+    args = parser.parse_args()
+
+    from mppsolar.mppinverter import mppInverter
+    from mppsolar.mppregistry import getCommandRegistry, loadCommandRegistry, getCacheFile
+
+    print('load definitions:  {:.3f} ms'.format(timeit.timeit(lambda: loadCommandRegistry(False), number=10) * 100))
+    loadCommandRegistry()
+    print('load from cache:   {:.3f} ms ({})'.format(timeit.timeit(loadCommandRegistry, number=10) * 100, getCacheFile()))
+    getCommandRegistry()
+    elapsed = timeit.timeit(lambda: mppInverter('TEST'), number=args.inverters)
+    print('create inverter:   {:.3f} ms'.format(elapsed * 1000 / args.inverters))
+    registry = getCommandRegistry()
+    for cmd in COMMANDS:
+        elapsed = timeit.timeit(lambda: registry.find(cmd), number=args.count)
+        print('find {:<12} {:.3f} us'.format(cmd + ':', elapsed * 1e6 / args.count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+#
+# startup_benchmark.py
+#
+# measures the cold start of the command line entry points (python 3.7+, uses -X importtime)
+# - reports the import time of each module (self and cumulative, best of several runs)
+# - exits 1 if a mode imports a module it should not need or takes longer than its budget
+#   (the budgets suit a desktop, pass --budget on slower boards)
+#
+# python benchmarks/startup_benchmark.py
+# python benchmarks/startup_benchmark.py -m mpp-solar-l --budget 40 --top 30
+#
+import os
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# mode: (code run in a fresh interpreter, modules the mode must not import, import budget in ms)
+MODES = {
+    'mpp-solar-h': ("from mppsolar import main; sys.argv = ['mpp-solar', '-h']; main()",
+                    ['serial', 'paho', 'concurrent.futures', 'mppsolar.mppinverter', 'mppsolar.mppregistry',
+                     'mppsolar.one_to_one_codec'], 50),
+    'mpp-info-pub-h': ("from mppsolar.mpp_info_pub import main; sys.argv = ['mpp-info-pub', '-h']; main()",
+                       ['serial', 'paho', 'concurrent.futures', 'mppsolar.mppinverter', 'mppsolar.mppregistry',
+                        'mppsolar.one_to_one_codec'], 50),
+    'mpp-solar-l': ("from mppsolar import main; sys.argv = ['mpp-solar', '-l']; main()",
+                    ['serial', 'paho', 'concurrent.futures', 'mppsolar.mppinverter', 'mppsolar.one_to_one_codec'], 55),
+}
+
+
+def measure(code, python=sys.executable):
+    """
+    Runs code in a fresh interpreter, returns {module: (self us, cumulative us)}
+    """
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(HERE))
+    result = subprocess.run([python, '-X', 'importtime', '-c', 'import sys; ' + code],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, universal_newlines=True)
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(own), int(cumulative))
+    return modules
+
+
+def best(runs):
+    """
+    Returns the best (lowest) self and cumulative time of each module over the runs
+    """
+    modules = {}
+    for run in runs:
+        for name, (own, cumulative) in run.items():
+            if name in modules:
+                own = min(own, modules[name][0])
+                cumulative = min(cumulative, modules[name][1])
+            modules[name] = (own, cumulative)
+    return modules
+
+
+def main():
+    parser = ArgumentParser(description='Measure the cold start import time of the entry points')
+    parser.add_argument('-m', '--mode', choices=sorted(MODES), action='append', help='Mode(s) to measure (default: all)')
+    parser.add_argument('-n', '--runs', type=int, help='Runs per mode (the best time of each module is used)', default=5)
+    parser.add_argument('-t', '--top', type=int, help='Modules to list per mode (by cumulative time)', default=15)
+    parser.add_argument('--budget', type=float, help='Override the import budget (ms) of every mode')
+    args = parser.parse_args()
+
+    failed = False
+    for mode in args.mode or sorted(MODES):
+        code, forbidden, budget = MODES[mode]
+        if args.budget is not None:
+            budget = args.budget
+        modules = best([measure(code) for _ in range(args.runs)])
+        total = sum(own for own, _ in modules.values()) / 1000.0
+        print('=== {}: {} modules, {:.1f} ms importing (budget {} ms)'.format(mode, len(modules), total, budget))
+        print('{:>10} {:>10}  {}'.format('self (ms)', 'cum (ms)', 'module'))
+        ranked = sorted(modules.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (own, cumulative) in ranked[:args.top]:
+            print('{:>10.2f} {:>10.2f}  {}'.format(own / 1000.0, cumulative / 1000.0, name))
+        unwanted = sorted(name for name in modules
+                          if any(name == f or name.startswith(f + '.') for f in forbidden))
+        if unwanted:
+            print('FAIL: {} imported {}'.format(mode, ', '.join(unwanted)))
+            failed = True
+        if total > budget:
+            print('FAIL: {} took {:.1f} ms importing, over its {} ms budget'.format(mode, total, budget))
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+#
+# transport_benchmark.py
+#
+# times commands through the real serial, socket and hidraw transport code
+# against the simulated inverter (no hardware needed)
+#
+# python benchmarks/transport_benchmark.py -n 50 -Q Q1,QPIGS,QMOD,QPIWS --baud 2400
+#
+import os
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mppsolar.mppsimulator import mppSimulator  # noqa: E402
+from mppsolar.mppinverter import mppInverter  # noqa: E402
+
+
+def benchmark(device, queries, count, pacing):
+    inverter = mppInverter(device, pacing=pacing)
+    timings = []
+    failed = 0
+    try:
+        for _ in range(count):
+            start = time.time()
+            for command in inverter.executeMany(queries):
+                if command is None or not command.valid_response:
+                    failed += 1
+            timings.append(time.time() - start)
+    finally:
+        inverter.close()
+    timings.sort()
+    return timings, failed
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark the inverter transports against the simulator')
+    parser.add_argument('-n', '--count', type=int, help='Poll cycles per transport', default=20)
+    parser.add_argument('-Q', '--queries', type=str, help='Queries per cycle in CSV format', default='Q1,QPIGS')
+    parser.add_argument('-b', '--baud', type=int, help='Emulated line speed (default: as fast as possible)')
+    parser.add_argument('-l', '--latency', type=float, help='Simulated inverter latency (s)', default=0.0)
+    parser.add_argument('-c', '--corrupt', type=float, help='Chance each answer byte is corrupted', default=0.0)
+    parser.add_argument('--pacing', type=str, help='Write pacing for the hidraw transport', default='fixed')
+    args = parser.parse_args()
+
+    queries = args.queries.split(',')
+    simulator = mppSimulator(latency=args.latency, baud_rate=args.baud, corrupt_rate=args.corrupt,
+                             port=0, link='/tmp/mppsolar-benchmark-hidraw0')
+    with simulator:
+        devices = [('serial', simulator.device),
+                   ('socket', 'socket://127.0.0.1:{}'.format(simulator.port)),
+                   ('hidraw', simulator.link)]
+        print("{:<8} {:>10} {:>10} {:>10} {:>8}".format('', 'min (s)', 'median (s)', 'max (s)', 'failed'))
+        for name, device in devices:
+            timings, failed = benchmark(device, queries, args.count, args.pacing)
+            print("{:<8} {:>10.4f} {:>10.4f} {:>10.4f} {:>8}".format(name, timings[0], timings[len(timings) // 2],
+                                                                     timings[-1], failed))
+
+
+if __name__ == '__main__':
+    main()
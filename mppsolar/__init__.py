@@ -1,13 +1,29 @@
 # !/usr/bin/python
 import logging
+import sys
 from argparse import ArgumentParser
 
-# import mppcommands
-from .mpputils import mppUtils
+# The inverter libraries are only imported once the arguments show they are needed
+# (startup time is measured by benchmarks/startup_benchmark.py)
+from .mppconnection import PACING_MODES, PACING_FIXED, DEFAULT_TIMEOUT
+from .mppcapture import REPLAY_ORIGINAL_SPEED
 
 log = logging.getLogger('MPP-Solar')
 
 
+if sys.version_info < (3, 7):
+    # module __getattr__ (below) needs python 3.7+, older versions import mppUtils with the package
+    from . import mpputils
+    mppUtils = mpputils.mppUtils
+else:
+    def __getattr__(name):
+        # mppsolar.mppUtils is loaded on first use
+        if name == 'mppUtils':
+            from .mpputils import mppUtils
+            return mppUtils
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+
+
 def main():
     print('bla')
     parser = ArgumentParser(description='MPP Solar Command Utility')
@@ -15,6 +31,11 @@ def main():
     parser.add_argument('-D', '--enableDebug', action='store_true', help='Enable Debug')
     parser.add_argument('-d', '--device', type=str, help='Serial device to communicate with', default='/dev/hidraw0')
     parser.add_argument('-b', '--baud', type=int, help='Baud rate for serial communications', default=2400)
+    parser.add_argument('--pacing', choices=PACING_MODES, help='Write pacing for direct USB (hidraw) devices', default=PACING_FIXED)
+    parser.add_argument('--timeout', type=float, help='Seconds to wait for a response from the inverter', default=DEFAULT_TIMEOUT)
+    parser.add_argument('--record', type=str, help='Record the frames exchanged with the inverter to this capture file')
+    parser.add_argument('--replay-speed', type=float, help='Speed up a replay:CAPTURE device by this factor (0 for no delays)',
+                        default=REPLAY_ORIGINAL_SPEED)
     parser.add_argument('-l', '--listknown', action='store_true', help='List known commands')
     parser.add_argument('-s', '--getStatus', action='store_true', help='Get Inverter Status')
     parser.add_argument('-t', '--getSettings', action='store_true', help='Get Inverter Settings')
@@ -35,13 +56,19 @@ def main():
     log.debug('command %s', args.command)
     log.debug('Serial device used: %s, baud rate: %d', args.device, args.baud)
 
-    # mp = mppcommands.mppCommands(args.device, args.baud)
-    mp = mppUtils(args.device, args.baud)
-
     if(args.listknown):
-        for line in mp.getKnownCommands():
+        # the known commands do not need the inverter
+        from .mppregistry import getCommandRegistry
+        for line in getCommandRegistry().commands:
             print(line)
-    elif(args.getStatus):
+        return
+
+    # mp = mppcommands.mppCommands(args.device, args.baud)
+    from .mpputils import mppUtils
+    mp = mppUtils(args.device, args.baud, pacing=args.pacing, timeout=args.timeout,
+                  record=args.record, replay_speed=args.replay_speed)
+
+    if(args.getStatus):
         fullStatus = mp.getFullStatus()
         print("================ Status ==================")
         print("{:<30}\t{:<15} {}".format('Parameter', 'Value', 'Unit'))
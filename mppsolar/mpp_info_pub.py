@@ -12,13 +12,22 @@
 import json
 import logging
 import sys
-import paho.mqtt.publish as publish
-import paho.mqtt.client as mqtt
+import threading
 
-from .mppinverter import getCommandsFromJson
-from .mpputils import mppUtils, log
+# paho and the inverter libraries are only imported once the arguments have been parsed
+# (startup time is measured by benchmarks/startup_benchmark.py)
+from .mppconnection import PACING_MODES, PACING_FIXED, DEFAULT_TIMEOUT
+from .mppcapture import REPLAY_ORIGINAL_SPEED
+from .mpppublish import DEFAULT_HEARTBEAT, DEFAULT_QUEUE_SIZE, DOCUMENT_FORMATS, getDocumentEncoder, parseDeadbands
 import time
 
+log = logging.getLogger('MPP-Solar')
+
+# Seconds a once-off run waits for its messages to reach the broker
+ONCEOFF_FLUSH_TIMEOUT = 10
+# QoS of the queued messages: the broker acknowledges each one
+PUBLISH_QOS = 1
+
 
 def is_py3():
     if sys.version_info[0] < 3:
@@ -26,9 +35,9 @@ def is_py3():
 
     return True
 
-from .one_to_one_codec import init_custom_codec
-if is_py3():
-    init_custom_codec()
+
+# decoded text is unicode in python 2, str in python 3
+TEXT_TYPES = (str, type(u''))
 
 grab_settings = False
 
@@ -40,6 +49,12 @@ def main():
     parser.add_argument('-d', '--device', type=str, help='Serial device(s) to communicate with [comma separated]',
                         default='/dev/hidraw0')
     parser.add_argument('-b', '--baud', type=int, help='Baud rate for serial communications', default=2400)
+    parser.add_argument('--pacing', choices=PACING_MODES, help='Write pacing for direct USB (hidraw) devices', default=PACING_FIXED)
+    parser.add_argument('--timeout', type=float, help='Seconds to wait for a response from the inverter', default=DEFAULT_TIMEOUT)
+    parser.add_argument('--record', type=str,
+                        help='Record the frames exchanged with each device to a capture file [comma separated, one per device]')
+    parser.add_argument('--replay-speed', type=float, help='Speed up replay:CAPTURE devices by this factor (0 for no delays)',
+                        default=REPLAY_ORIGINAL_SPEED)
     parser.add_argument('-q', '--broker', type=str, help='MQTT Broker hostname', default='mqtt_broker')
     parser.add_argument('-o', '--brokerport', type=int, help='MQTT Broker port', default=1883)
     parser.add_argument('-u', '--username', type=str, help='MQTT Broker username', default='cooluser')
@@ -54,7 +69,34 @@ def main():
                         help='Disable publishing of Home Assistant auto config discovery.')
     parser.add_argument('-R', '--disable_ha_config_retain', action='store_true',
                         help='Disable retain on HA auto config')
+    parser.add_argument('-A', '--asyncio', action='store_true',
+                        help='Poll all devices concurrently from one asyncio event loop (python3 only)')
+    parser.add_argument('-C', '--changes-only', action='store_true',
+                        help='Only publish values that changed (see --deadband and --heartbeat)')
+    parser.add_argument('--deadband', type=str,
+                        help='Changes ignored with --changes-only, field=change or field=change%% [comma separated, * for all numbers]')
+    parser.add_argument('--heartbeat', type=int, help='Seconds before an unchanged value is published again with --changes-only (0 for never)',
+                        default=DEFAULT_HEARTBEAT)
+    parser.add_argument('-J', '--document', choices=sorted(DOCUMENT_FORMATS),
+                        help='Also publish all the values of each device every cycle as one document (to /prefix/serial/telemetry)')
+    parser.add_argument('--no-fields', action='store_true', help='With --document, do not publish each value to its own topic')
+    parser.add_argument('--queue-size', type=int, help='Messages held in memory while the broker is slow or unreachable',
+                        default=DEFAULT_QUEUE_SIZE)
+    parser.add_argument('--spool', type=str,
+                        help='File for the messages that do not fit in the queue, sent in order once the broker is back')
     args = parser.parse_args()
+    try:
+        parseDeadbands(args.deadband)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.no_fields and not args.document:
+        parser.error('--no-fields needs --document')
+    if args.document:
+        try:
+            getDocumentEncoder(args.document)
+        except ImportError:
+            parser.error('--document {} needs the {} module (pip install {})'.format(
+                args.document, DOCUMENT_FORMATS[args.document], DOCUMENT_FORMATS[args.document]))
 
     #
     # Turn on debug if needed
@@ -79,41 +121,135 @@ class MPPSolarMain:
     mqttConnected = False
     devs = []
     commands = None
+    loop = None
+    publishFilter = None
+    encodeDocument = None
+    publishQueue = None
+    enflagKeys = frozenset()
 
     def __init__(self, someArgs):
         self.args = someArgs
         ports = self.args.device.split(',')
 
-        for usb_port in ports:
-            mp = mppUtils(serial_device=usb_port, baud_rate=self.args.baud)
+        from .mpputils import mppUtils
+        from .mppregistry import getCommandRegistry
+        utils = mppUtils
+        if self.args.asyncio:
+            # python3 only
+            import asyncio
+            from .mppasync import AsyncMppUtils, gatherSerialNumbers
+            # the loop runs on its own thread, coroutines are handed to it (runAsync, handleMessage)
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            loopThread = threading.Thread(target=self.loop.run_forever, name='mpp-asyncio')
+            loopThread.daemon = True
+            loopThread.start()
+            utils = AsyncMppUtils
+
+        records = self.args.record.split(',') if self.args.record else []
+        for index, usb_port in enumerate(ports):
+            record = records[index] if index < len(records) else None
+            mp = utils(serial_device=usb_port, baud_rate=self.args.baud, pacing=self.args.pacing, timeout=self.args.timeout,
+                       record=record, replay_speed=self.args.replay_speed)
             self.devs.append(mp)
 
-        self.commands = getCommandsFromJson()
-
-    def doSettingsPublish(self, mp=None):
+        if self.loop is not None:
+            self.runAsync(gatherSerialNumbers(self.devs))
+
+        self.commands = getCommandRegistry().commands
+        # enflags (e.g. the QFLAG settings) are published as enabled / disabled, as they were before values were typed
+        self.enflagKeys = frozenset(key for command in self.commands for key in command.decoder.enflagKeys())
+
+        if self.args.changes_only:
+            from .mpppublish import mppPublishFilter
+            self.publishFilter = mppPublishFilter(parseDeadbands(self.args.deadband), heartbeat=self.args.heartbeat)
+        if self.args.document:
+            self.encodeDocument = getDocumentEncoder(self.args.document)
+
+        # polling never waits for the broker: messages are queued and sent by a background thread
+        from .mpppublish import mppPublishQueue, mppSpool
+        spool = mppSpool(self.args.spool) if self.args.spool else None
+        # a value dropped by the queue is published again in the next cycle, even when publishing changes only
+        on_drop = self.publishFilter.forget if self.publishFilter is not None else None
+        self.publishQueue = mppPublishQueue(self.sendMessage, maxsize=self.args.queue_size, spool=spool, on_drop=on_drop)
+
+    def submitAsync(self, coro):
+        """
+        Hands a coroutine to the event loop thread that drives the asyncio devices, returns its (concurrent) Future
+        """
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def runAsync(self, coro):
+        """
+        Runs a coroutine on the event loop thread and waits for its result
+        """
+        return self.submitAsync(coro).result()
+
+    def doSettingsPublish(self, mp=None, settings=None):
         # Collect Inverter Settings and publish
         if self.args.settings and mp is not None:
-            settings = mp.getSettings()
+            if settings is None:
+                settings = mp.getSettings(typed=True)
 
             for setting in settings:
                 topic = '/{}/{}/settings/{}/{}'.format(self.args.prefix, mp.serial_number, setting, 'value')
-                self.mq.publish(topic, payload='{}'.format(settings[setting]['value']))
+                self.publishValue(topic, setting, settings[setting]['value'])
+
+    def publishValue(self, topic, field, value, conform=False):
+        """
+        Publishes a (typed) value, unless publishing changes only and it has not changed enough
+        """
+        if self.publishFilter is not None and not self.publishFilter.changed(topic, field, value):
+            return
+        if self.publishQueue.put(topic, self.toPayload(value, field in self.enflagKeys, conform)) \
+                and self.publishFilter is not None:
+            self.publishFilter.record(topic, value)
+
+    def sendMessage(self, topic, payload, timestamp):
+        """
+        Sends a queued message to the broker (on the publish thread), returns False if paho did not take it
+        - otherwise returns paho's MQTTMessageInfo, the queue checks it (is_published) to count the message as sent;
+          paho keeps the message until the broker acknowledges it and sends it again after reconnecting
+          (also when it was taken while disconnected), the queue never sends it again
+        """
+        import paho.mqtt.client as mqtt
+        if time.time() - timestamp > self.args.interval:
+            log.debug('Sending %s queued at %s', topic, time.ctime(timestamp))
+        info = self.mq.publish(topic, payload=payload, qos=PUBLISH_QOS)
+        if info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+            return False
+        return info
+
+    def publishDocument(self, mp, timestamp, status, settings=None):
+        """
+        Publishes all the values of a device for this cycle as one document
+        """
+        from .mpppublish import buildDocument
+        document = buildDocument(mp.serial_number, timestamp, status, settings)
+        self.publishQueue.put('/{}/{}/telemetry'.format(self.args.prefix, mp.serial_number), self.encodeDocument(document),
+                              timestamp / 1000.0)
 
     @staticmethod
-    def conformNumber(number):
-        try:
-            if number.isdigit() and '.' in number:
-                return float(number)
-            elif number.isdigit():
-                return int(number)
-            elif str(number).find("\t- ") > 0:
-                number = str(number)
-                number = number[number.find("- ") + 2:]
-                return number
-            else:
-                return number
-        except:
-            return number
+    def toPayload(value, enflag=False, conform=False):
+        """
+        Returns the MQTT payload for a (typed) value
+        - numbers are published as decoded from their field type (e.g. 057.50 as 57.5)
+        - flags are published as 1 / 0
+        - enflags (enflag True) as enabled, disabled or unknown
+        - with conform True (status values) text that is all digits is published as a number (e.g. 01 as 1),
+          as status values were published before values were typed
+        """
+        if enflag:
+            from .mppdecoder import ENFLAGS_TEXT
+            return ENFLAGS_TEXT.get(value, value)
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        if value is None:
+            return ''
+        if conform and isinstance(value, TEXT_TYPES) and value.isdigit():
+            return '{}'.format(int(value))
+        return '{}'.format(value)
 
     @staticmethod
     def getTime():
@@ -121,31 +257,36 @@ class MPPSolarMain:
 
     def run(self):
         self.initialise_client()
+        self.publishQueue.start()
 
-        while True:
-            if not self.mqttConnected:
-                time.sleep(1)
-                continue
-
-            if (self.getTime() - self.lastPubRun) > self.args.interval * 1000:
-                self.publishTelemetry()
-                self.lastPubRun = self.getTime()
-
-            self.mq.loop()
-            if self.args.onceoff:
-                return
-            time.sleep(0.01)
+        try:
+            while True:
+                # poll whether or not the broker is connected (the queue holds the messages)
+                if (self.getTime() - self.lastPubRun) > self.args.interval * 1000:
+                    self.publishTelemetry()
+                    self.lastPubRun = self.getTime()
+
+                if self.args.onceoff:
+                    self.publishQueue.flush(ONCEOFF_FLUSH_TIMEOUT)
+                    return
+                time.sleep(0.01)
+        finally:
+            # messages not sent yet go to the spool (if there is one)
+            self.publishQueue.stop()
 
     def initialise_client(self):
+        import paho.mqtt.client as mqtt
         self.mq = mqtt.Client(clean_session=True, userdata=None, transport="tcp")
         self.mq.username_pw_set(username=self.args.username, password=self.args.password)
         self.mq.will_set('/{}/lwt'.format(self.args.prefix), payload="offline")
         self.mq.on_disconnect = self.handleDisconnect
         self.mq.on_message = self.handleMessage
         self.mq.on_connect = self.handleConnect
-        self.mq.connect(self.args.broker,
-                        port=self.args.brokerport,
-                        keepalive=30)
+        # the network thread (loop_start) connects, and reconnects whenever the connection is lost
+        self.mq.reconnect_delay_set(min_delay=1, max_delay=60)
+        self.mq.connect_async(self.args.broker,
+                              port=self.args.brokerport,
+                              keepalive=30)
         # self.mq.loop_forever()
         self.mq.loop_start()
 
@@ -159,9 +300,13 @@ class MPPSolarMain:
         try:
             for dev in self.devs:
                 if dev.serial_number == serialNumber:
+                    if self.loop is not None:
+                        # runs between (or alongside) the polls, paho's network thread does not wait for it
+                        future = self.submitAsync(dev.getResponse(command))
+                        future.add_done_callback(lambda future: self.publishAsyncResponse(serialNumber, future))
+                        return
                     resp = dev.getResponse(command)
-                    log.debug("Command response: {}".format(json.dumps(resp)))
-                    self.mq.publish("/{}/{}/response".format(self.args.prefix, serialNumber), resp)
+                    self.publishResponse(serialNumber, resp)
 
                     return
         except:
@@ -169,14 +314,31 @@ class MPPSolarMain:
 
         log.debug("Target device for specified serial number and command not found.")
 
+    def publishResponse(self, serialNumber, resp):
+        log.debug("Command response: {}".format(json.dumps(resp)))
+        self.mq.publish("/{}/{}/response".format(self.args.prefix, serialNumber), resp)
+
+    def publishAsyncResponse(self, serialNumber, future):
+        """
+        Publishes the response of a command run on the event loop (called once it is done)
+        """
+        try:
+            self.publishResponse(serialNumber, future.result())
+        except Exception as e:
+            log.error('Command for %s failed: %s', serialNumber, e)
+
     def handleDisconnect(self, client, userdata, rc):
         log.debug(["got disconnected", client, userdata, rc])
         self.mqttConnected = False
-
-        self.initialiseClient()
+        # queued messages wait, paho reconnects
+        self.publishQueue.setConnected(False)
 
     def handleConnect(self, client, userdata, flags, rc, properties=None):
         self.mqttConnected = True
+        self.publishQueue.setConnected(rc == 0)
+        if self.publishFilter is not None:
+            # publish everything again after (re)connecting
+            self.publishFilter.clear()
         for dev in self.devs:
             self.mq.subscribe('/{}/{}/settings/#'.format(self.args.prefix, dev.serial_number))
 
@@ -187,24 +349,47 @@ class MPPSolarMain:
 
     def publishTelemetry(self):
         try:
+            if self.loop is not None:
+                # Poll all devices concurrently
+                from .mppasync import gatherFullStatus, gatherSettings
+                all_status = self.runAsync(gatherFullStatus(self.devs, queries=self.args.queries, typed=True))
+                all_settings = [None] * len(self.devs)
+                if self.args.settings:
+                    all_settings = self.runAsync(gatherSettings(self.devs, typed=True))
+            else:
+                all_status = None
             # Process / loop through all supplied devices
-            for dev in self.devs:
+            for i, dev in enumerate(self.devs):
                 # Collect Inverter Status data and publish
-                status_data = dev.getFullStatus(queries=self.args.queries, extraFlagData=True)
-                for status_line in status_data:
-                    # 92931509101901/status/total_output_active_power/value 1250
-                    # 92931509101901/status/total_output_active_power/unit W
-                    topic = '/{}/{}/status/{}/{}'.format(self.args.prefix,
-                                                         dev.serial_number,
-                                                         status_line,
-                                                         'value')
-                    payload = '{}'.format(self.conformNumber(status_data[status_line]['value']))
-                    self.mq.publish(topic,
-                                    payload=payload)
+                if all_status is not None:
+                    status_data = all_status[i]
+                else:
+                    status_data = dev.getFullStatus(queries=self.args.queries, extraFlagData=True, typed=True)
+                timestamp = self.getTime()
+                if not self.args.no_fields:
+                    for status_line in status_data:
+                        # 92931509101901/status/total_output_active_power/value 1250
+                        # 92931509101901/status/total_output_active_power/unit W
+                        topic = '/{}/{}/status/{}/{}'.format(self.args.prefix,
+                                                             dev.serial_number,
+                                                             status_line,
+                                                             'value')
+                        self.publishValue(topic, status_line, status_data[status_line]['value'], conform=True)
                 log.debug(status_data)
 
-                self.doSettingsPublish(mp=dev)
-
+                if all_status is not None:
+                    settings = all_settings[i]
+                elif self.args.settings:
+                    settings = dev.getSettings(typed=True)
+                else:
+                    settings = None
+                if not self.args.no_fields:
+                    self.doSettingsPublish(mp=dev, settings=settings)
+                if self.encodeDocument is not None:
+                    self.publishDocument(dev, timestamp, status_data, settings)
+
+            if self.publishFilter is not None:
+                log.debug('Published %d values, %d unchanged', self.publishFilter.published, self.publishFilter.suppressed)
         except:
             log.error(sys.exc_info()[0])
 
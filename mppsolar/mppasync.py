@@ -0,0 +1,575 @@
+"""
+MPP Solar Inverter Command Library
+asyncio variants of the inverter and utility libraries (python3 only)
+- lets one event loop drive many inverters concurrently
+mppasync.py
+"""
+import asyncio
+import errno
+import logging
+import os
+
+import serial
+
+from .mppcommand import isCrcValid
+from .mppconnection import DEFAULT_TIMEOUT, SERIAL_ATTEMPT_TIMEOUT, PACING_FIXED, \
+    mppSerialConnection, mppMuxConnection, getWritePacer, isMuxDevice, isCompleteFrame, monotonic
+from .mppframe import mppFrameParser
+from .mppcapture import mppCaptureWriter, mppReplayConnection, isReplayDevice, REPLAY_PREFIX, REPLAY_ORIGINAL_SPEED, \
+    FRAME_SENT, FRAME_RECEIVED
+from .mppinverter import NoDeviceError, describeInverter, getDefaultRetryPolicy, isDirectUsbDevice, isTestDevice
+from .mppregistry import getCommandRegistry
+from .mppretry import mppRetryPolicy, mppCircuitBreaker
+from .mpputils import buildSampleStatus, buildSettings
+
+log = logging.getLogger('MPP-Solar')
+
+
+class asyncFdConnection(object):
+    """
+    Base for connections that are read via the event loop (add_reader) on a file descriptor
+    - bytes are split into frames (mppFrameParser) as they arrive and a waiting read is woken once a frame is complete
+    """
+
+    def __init__(self, serial_device, timeout=DEFAULT_TIMEOUT):
+        self._serial_device = serial_device
+        self._timeout = timeout
+        self._fd = None
+        self._loop = None
+        self._parser = mppFrameParser()
+        self._waiter = None
+        self._expected_length = None
+
+    def isOpen(self):
+        return self._fd is not None
+
+    def _openFd(self):
+        # a device node read and written directly (e.g. hidraw), opened non-blocking
+        log.debug('Opening device %s', self._serial_device)
+        return os.open(self._serial_device, os.O_RDWR | os.O_NONBLOCK)
+
+    def _closeFd(self):
+        os.close(self._fd)
+
+    def open(self):
+        """
+        Opens the device (if not already open) and starts watching it for data
+        """
+        loop = asyncio.get_event_loop()
+        if self._fd is not None and self._loop is not loop:
+            # opened from another (probably finished) event loop
+            self.close()
+        if self._fd is None:
+            self._fd = self._openFd()
+            self._loop = loop
+            self._loop.add_reader(self._fd, self._onReadable)
+        return self._fd
+
+    def close(self):
+        """
+        Stops watching and closes the device, it will be reopened by the next command
+        """
+        if self._fd is None:
+            return
+        log.debug('Closing %s', self._serial_device)
+        try:
+            self._loop.remove_reader(self._fd)
+            self._closeFd()
+        except (OSError, serial.SerialException):
+            log.debug('Error closing %s', self._serial_device, exc_info=True)
+        self._fd = None
+        self._wake(OSError(errno.EBADF, 'Connection closed'))
+
+    def _wake(self, exc=None):
+        if self._waiter is None or self._waiter.done():
+            return
+        if exc is None:
+            self._waiter.set_result(None)
+        else:
+            self._waiter.set_exception(exc)
+
+    def _isComplete(self):
+        if len(self._parser):
+            return True
+        return self._expected_length is not None and self._parser.pending() >= self._expected_length
+
+    def _onReadable(self):
+        try:
+            data = os.read(self._fd, 256)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self._loop.remove_reader(self._fd)
+            self._wake(e)
+            return
+        self._parser.feed(data)
+        if self._isComplete():
+            self._wake()
+
+    def _discard(self):
+        self._parser.clear()
+
+    async def _readResponse(self, timeout, expected_length=None, partial=True):
+        """
+        Waits (up to timeout seconds) for a complete frame and returns it
+        - returns the incomplete response (or None) on timeout,
+          unless partial is False (the bytes are then kept for the next read)
+        """
+        self._expected_length = expected_length
+        if not self._isComplete():
+            self._waiter = self._loop.create_future()
+            try:
+                await asyncio.wait_for(self._waiter, max(timeout, 0))
+            except asyncio.TimeoutError:
+                log.debug('Read from %s timed out after %ss', self._serial_device, timeout)
+            finally:
+                self._waiter = None
+        response = self._parser.nextFrame()
+        if response is None and (partial or self._isComplete()):
+            response = self._parser.takePartial(expected_length)
+        return response or None
+
+    async def _writeAll(self, data):
+        """
+        Writes all the data, waiting for the device to accept more if needed
+        """
+        while data:
+            try:
+                written = os.write(self._fd, data)
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                written = 0
+            data = data[written:]
+            if data:
+                writable = self._loop.create_future()
+                self._loop.add_writer(self._fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    self._loop.remove_writer(self._fd)
+
+    def reportResponse(self, valid):
+        pass
+
+
+class asyncSerialConnection(asyncFdConnection):
+    """
+    Non-blocking persistent serial connection
+    - same retry and deadline behaviour as mppSerialConnection
+    """
+
+    def __init__(self, serial_device, baud_rate=2400, timeout=DEFAULT_TIMEOUT):
+        super(asyncSerialConnection, self).__init__(serial_device, timeout)
+        self._baud_rate = baud_rate
+        self._port = None
+
+    def __str__(self):
+        return "serial port {} at {} baud (asyncio)".format(self._serial_device, self._baud_rate)
+
+    def _openFd(self):
+        log.debug('Opening port %s, baudrate %s', self._serial_device, self._baud_rate)
+        self._port = serial.serial_for_url(self._serial_device, self._baud_rate, timeout=0)
+        fd = self._port.fileno()
+        os.set_blocking(fd, False)
+        return fd
+
+    def _closeFd(self):
+        self._port.close()
+        self._port = None
+
+    async def query(self, full_command, expected_length=None):
+        """
+        Sends the full command (bytes, including CRC and CR) and returns the response line (bytes)
+        - resends the command only if an attempt times out, until the overall timeout is used up
+          (a late answer to an earlier attempt is still accepted)
+        - returns the incomplete response (if any) once the timeout is used up
+        - on an I/O error the port is closed (so the next query reopens it) and None returned
+        """
+        deadline = monotonic() + self._timeout
+        attempt = 0
+        try:
+            self.open()
+            self._discard()
+            while True:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                attempt += 1
+                log.debug('Command execution attempt %d...', attempt)
+                await self._writeAll(full_command)
+                response_line = await self._readResponse(min(SERIAL_ATTEMPT_TIMEOUT * attempt, remaining),
+                                                         expected_length, partial=False)
+                log.debug('serial response was: %s', response_line)
+                if response_line is not None:
+                    return response_line
+        except (serial.SerialException, OSError) as e:
+            log.debug('Serial I/O error on %s: %s', self._serial_device, e)
+            self.close()
+            return None
+        return self._parser.takePartial() or None
+
+
+class asyncHidrawConnection(asyncFdConnection):
+    """
+    Non-blocking persistent direct USB (hidraw) connection
+    - uses the same (remembered) write pacing as mppHidrawConnection
+    """
+
+    def __init__(self, serial_device, timeout=DEFAULT_TIMEOUT, pacing=PACING_FIXED):
+        super(asyncHidrawConnection, self).__init__(serial_device, timeout)
+        self._pacer = getWritePacer(serial_device, pacing)
+
+    def __str__(self):
+        return "direct USB device {} (asyncio)".format(self._serial_device)
+
+    async def query(self, full_command, expected_length=None):
+        """
+        Sends the full command (bytes) in 8 byte reports and returns the response line (bytes)
+        - on an I/O error the device is closed (so the next query reopens it) and None returned
+        """
+        to_send = memoryview(full_command)
+        try:
+            self.open()
+            self._discard()
+            first = True
+            while to_send:
+                if not first or self._pacer.mode == PACING_FIXED:
+                    await asyncio.sleep(self._pacer.delay)
+                first = False
+                send, to_send = to_send[:8], to_send[8:]
+                await self._writeAll(send)
+            response_line = await self._readResponse(self._timeout, expected_length)
+        except OSError as e:
+            log.debug('USB I/O error on %s: %s', self._serial_device, e)
+            self.close()
+            return None
+        log.debug('usb response was: %s', response_line)
+        return response_line
+
+    def reportResponse(self, valid):
+        if valid:
+            self._pacer.success()
+        else:
+            self._pacer.backoff('invalid response')
+
+
+class asyncExecutorConnection(object):
+    """
+    Runs a blocking connection in the default executor
+    - used for pyserial URLs (socket://, rfc2217://, loop://), captures and the multiplexer
+    """
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __str__(self):
+        return "{} (executor)".format(self._connection)
+
+    def isOpen(self):
+        return self._connection.isOpen()
+
+    def close(self):
+        self._connection.close()
+
+    async def query(self, full_command, expected_length=None):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self._connection.query, full_command, expected_length)
+
+    def reportResponse(self, valid):
+        pass
+
+
+class asyncRecordingConnection(object):
+    """
+    Wraps an asyncio connection, recording every command sent and response received to a capture file
+    - same capture format as mppRecordingConnection
+    """
+
+    def __init__(self, connection, capture_file):
+        self._connection = connection
+        self._writer = mppCaptureWriter(capture_file)
+
+    def __str__(self):
+        return "{} (recording to {})".format(self._connection, self._writer.capture_file)
+
+    def isOpen(self):
+        return self._connection.isOpen()
+
+    def close(self):
+        self._connection.close()
+        self._writer.close()
+
+    async def query(self, full_command, expected_length=None):
+        self._writer.write(FRAME_SENT, full_command)
+        response_line = await self._connection.query(full_command, expected_length)
+        self._writer.write(FRAME_RECEIVED, response_line)
+        return response_line
+
+    def reportResponse(self, valid):
+        self._connection.reportResponse(valid)
+
+
+class AsyncMppInverter(object):
+    """
+    asyncio variant of mppInverter
+    - execute is a coroutine, commands to one inverter are serialised by a lock
+    """
+
+    def __init__(self, serial_device=None, baud_rate=2400, pacing=PACING_FIXED, timeout=DEFAULT_TIMEOUT,
+                 retry_policy=None, circuit_breaker=None, record=None, replay_speed=REPLAY_ORIGINAL_SPEED):
+        if not serial_device:
+            raise NoDeviceError("A device to communicate by must be supplied, e.g. /dev/ttyUSB0")
+        # the command definitions are shared with the blocking inverters
+        self._registry = getCommandRegistry()
+        self._serial_device = serial_device
+        self._serial_number = None
+        # created on first use, in the loop running the commands (see _getLock)
+        self._lock = None
+        self._lock_loop = None
+        self._retry_policy = retry_policy or getDefaultRetryPolicy(serial_device)
+        self._circuit_breaker = circuit_breaker or mppCircuitBreaker()
+        self._connection = None
+        if isReplayDevice(serial_device):
+            self._connection = asyncExecutorConnection(
+                mppReplayConnection(serial_device[len(REPLAY_PREFIX):], speed=replay_speed))
+        elif isMuxDevice(serial_device):
+            self._connection = asyncExecutorConnection(mppMuxConnection(serial_device))
+        elif isDirectUsbDevice(serial_device):
+            self._connection = asyncHidrawConnection(serial_device, timeout=timeout, pacing=pacing)
+        elif isTestDevice(serial_device):
+            self._connection = None
+        elif '://' in serial_device:
+            self._connection = asyncExecutorConnection(mppSerialConnection(serial_device, baud_rate, timeout=timeout))
+        else:
+            self._connection = asyncSerialConnection(serial_device, baud_rate, timeout=timeout)
+        if record and self._connection is not None:
+            self._connection = asyncRecordingConnection(self._connection, record)
+
+    def __str__(self):
+        return describeInverter(self._serial_device, self._connection, self._registry.commands)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        """
+        Closes any open connection to the inverter
+        """
+        if self._connection is not None:
+            self._connection.close()
+
+    def getAllCommands(self):
+        return self._registry.commands
+
+    def isDown(self):
+        """
+        True if the inverter has stopped responding
+        """
+        return self._circuit_breaker.isOpen()
+
+    async def getSerialNumber(self):
+        if self._serial_number is None:
+            command = await self.execute("QID")
+            response = command.getResponseDict() if command else None
+            if response:
+                self._serial_number = response["serial_number"][0]
+        return self._serial_number
+
+    async def _doCommand(self, command):
+        command.clearResponse()
+        if self._connection is None:
+            log.debug('TEST connection: executing %s', command)
+            command.setResponse(command.getTestResponse())
+            return command
+        log.debug('%s: executing %s', self._connection, command)
+        response_line = await self._connection.query(command.full_command, command.getExpectedResponseLength())
+        if isCompleteFrame(response_line):
+            self._connection.reportResponse(isCrcValid(response_line))
+        if response_line is None:
+            log.info('Command execution failed')
+            return command
+        command.setResponse(response_line)
+        return command
+
+    async def execute(self, cmd):
+        """
+        Sends a command (as supplied) to inverter and returns the command (with response)
+        - retries as set by the retry policy
+        - once the device has been marked down commands fail straight away, except that
+          every probe interval one command is sent (once) to check if it is back
+        """
+        async with self._getLock():
+            return await self._execute(cmd, self._registry.find(cmd))
+
+    def _getLock(self):
+        """
+        Returns the lock serialising the commands, for the running event loop
+        - before python 3.10 a lock belongs to the loop current when it is created, inverters are often
+          created outside the loop that runs their commands (asyncio.run, the loop thread of mpp-info-pub)
+        """
+        loop = asyncio.get_event_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    async def executeMany(self, cmds):
+        """
+        Sends several commands (as supplied) one after another and returns the list of executed commands
+        - all the commands are looked up before anything is sent
+        - the lock is taken for each command, so a command waiting for this inverter
+          (e.g. a setter) runs before the rest of them
+        """
+        found = [self._registry.find(cmd) for cmd in cmds]
+        results = []
+        for cmd, f in zip(cmds, found):
+            async with self._getLock():
+                results.append(await self._execute(cmd, f))
+        return results
+
+    async def _execute(self, cmd, found):
+        """
+        Sends the (already looked up) command, must be called holding the lock
+        """
+        command, value = found
+        if command is None:
+            log.critical("Command not found")
+            return None
+        command = command.createRequest(value)
+        policy = self._retry_policy
+        if self._circuit_breaker.isOpen():
+            if not self._circuit_breaker.isProbeDue():
+                log.info('%s is not responding (%s), not sending %s', self._serial_device, self._circuit_breaker, cmd)
+                command.clearResponse()
+                return command
+            log.debug('Probing %s with %s', self._serial_device, cmd)
+            policy = mppRetryPolicy(max_attempts=1)
+
+        started = monotonic()
+        attempt = 0
+        answered = False
+        while True:
+            attempt += 1
+            try:
+                await self._doCommand(command)
+            except Exception as err:
+                log.error(err)
+                command.clearResponse()
+            if command.valid_response:
+                self._circuit_breaker.recordSuccess()
+                return command
+            # any frame (even one failing its CRC) means the device is there
+            responded = bool(command.response)
+            answered = answered or responded
+            delay = policy.getDelay(attempt, responded)
+            if not policy.shouldRetry(attempt, started, delay):
+                break
+            log.debug("Received %s response. Retrying attempt %d of %d in %.2fs...",
+                      "invalid" if responded else "no", attempt + 1, policy.max_attempts, delay)
+            await asyncio.sleep(delay)
+
+        if answered:
+            self._circuit_breaker.recordSuccess()
+        else:
+            self._circuit_breaker.recordFailure()
+        return command
+
+
+class AsyncMppUtils(object):
+    """
+    asyncio variant of mppUtils
+    - unlike mppUtils the serial number is fetched on first use (getSerialNumber)
+    """
+
+    serial_number = None
+
+    def __init__(self, serial_device=None, baud_rate=2400, pacing=PACING_FIXED, timeout=DEFAULT_TIMEOUT,
+                 record=None, replay_speed=REPLAY_ORIGINAL_SPEED):
+        if (serial_device is None):
+            raise NoDeviceError("A serial device must be supplied, e.g. /dev/ttyUSB0")
+        self.inverter = AsyncMppInverter(serial_device, baud_rate, pacing=pacing, timeout=timeout,
+                                         record=record, replay_speed=replay_speed)
+
+    def close(self):
+        self.inverter.close()
+
+    def getKnownCommands(self):
+        return self.inverter.getAllCommands()
+
+    async def getResponseDict(self, cmd, typed=False):
+        command = await self.inverter.execute(cmd)
+        if command is None:
+            return {}
+        return command.getResponseDict(typed)
+
+    async def getResponse(self, cmd):
+        command = await self.inverter.execute(cmd)
+        if command is None:
+            return None
+        return command.getResponse()
+
+    async def executeMany(self, cmds, typed=False):
+        """
+        Runs several commands one after another and returns {cmd: response dict} for all of them
+        - typed returns the values as int, float or bool rather than as sent
+        """
+        results = {}
+        for cmd, command in zip(cmds, await self.inverter.executeMany(cmds)):
+            if command is None:
+                results[cmd] = {}
+            else:
+                results[cmd] = command.getResponseDict(typed)
+        return results
+
+    async def getSamples(self, cmds, typed=False):
+        """
+        Runs several commands one after another and returns {cmd: mppSample} for all of them (None if there was no valid response)
+        """
+        commands = await self.inverter.executeMany(cmds)
+        return dict((cmd, None if command is None else command.getSample(typed)) for cmd, command in zip(cmds, commands))
+
+    async def getSerialNumber(self):
+        if self.serial_number is None:
+            self.serial_number = await self.inverter.getSerialNumber()
+
+        return self.serial_number
+
+    async def getFullStatus(self, queries="Q1,QPIGS", extraFlagData=False, typed=False):
+        """
+        Helper function that returns all the status data
+        """
+        cmds = queries.split(",")
+        samples = await self.getSamples(cmds, typed)
+        return buildSampleStatus(samples[i] for i in cmds)
+
+    async def getSettings(self, typed=False):
+        """
+        Query inverter for all current settings
+        """
+        results = await self.executeMany(["QDI", "QPIRI", "QFLAG"], typed)
+        return buildSettings(results["QDI"], results["QPIRI"], results["QFLAG"])
+
+
+async def gatherSerialNumbers(utils):
+    """
+    Fetches the serial numbers of all the supplied AsyncMppUtils concurrently
+    """
+    return await asyncio.gather(*[mp.getSerialNumber() for mp in utils])
+
+
+async def gatherFullStatus(utils, queries="Q1,QPIGS", typed=False):
+    """
+    Fetches the full status of all the supplied AsyncMppUtils concurrently
+    """
+    return await asyncio.gather(*[mp.getFullStatus(queries=queries, extraFlagData=True, typed=typed) for mp in utils])
+
+
+async def gatherSettings(utils, typed=False):
+    """
+    Fetches the settings of all the supplied AsyncMppUtils concurrently
+    """
+    return await asyncio.gather(*[mp.getSettings(typed) for mp in utils])
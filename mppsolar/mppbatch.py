@@ -0,0 +1,229 @@
+"""
+MPP Solar Inverter Command Library
+decodes many responses to one command at once into numpy columns (e.g. months of captured QPIGS or QPGSn responses)
+- the frames are laid out in one padded byte array, the CRC of every frame is worked out together (a step per byte position)
+- the values of all the valid frames are split in one go and converted a column at a time
+- the columns come from the command's compiled decoder (mppdecoder), so they always match the live decoding
+  (typed values: float and int fields as numbers, flags as one bool column per flag, other fields as strings)
+- needs numpy, which the rest of the library does not use
+mppbatch.py
+"""
+import logging
+
+import numpy as np
+
+from . import mppcrc
+from .mppcommand import toFrame
+from .mppdecoder import ENCODING, _cast, _decodeFlags, _decodeStatFlags
+from .mppsample import MISSING
+
+log = logging.getLogger('MPP-Solar')
+
+# CRC_TABLE as an array (indexed by a column of bytes at a time)
+CRC_TABLE = np.array(mppcrc.CRC_TABLE, dtype=np.uint16)
+# Bytes the inverter does not allow in a CRC
+CRC_RESERVED = np.array(mppcrc.CRC_RESERVED, dtype=np.uint16)
+# CRC (2 bytes) and CR at the end of every frame
+FRAME_TRAILER = 3
+# Separates the values of a response
+SEPARATOR = ord(' ')
+# Flag that is set
+FLAG_SET = ord('1')
+# Characters of a number
+ZERO = ord('0')
+NINE = ord('9')
+POINT = ord('.')
+MINUS = ord('-')
+# Digits of a number parsed directly (so it is exact as a float)
+MAX_DIGITS = 15
+
+
+def padFrames(frames):
+    """
+    Returns the frames as rows of a (frames x longest frame) uint8 array (padded with 0) and their lengths
+    """
+    frames = [toFrame(frame) for frame in frames]
+    lengths = np.array([len(frame) for frame in frames], dtype=np.int64)
+    width = int(lengths.max()) if len(frames) else 0
+    data = np.zeros((len(frames), width), dtype=np.uint8)
+    data[np.arange(width) < lengths[:, None]] = np.frombuffer(b''.join(frames), dtype=np.uint8)
+    return data, lengths
+
+
+def crcValid(data, lengths):
+    """
+    Returns which of the (padded) frames end with a valid CRC and CR
+    """
+    rows = np.arange(len(lengths))
+    crc_lengths = lengths - FRAME_TRAILER
+    crc = np.zeros(len(lengths), dtype=np.uint16)
+    for position in range(int(crc_lengths.max()) if len(lengths) else 0):
+        # same step as mppcrc.crc16_table, for every frame still this long
+        step = (crc << 8) ^ CRC_TABLE[(crc >> 8) ^ data[:, position]]
+        crc = np.where(position < crc_lengths, step, crc)
+    high = crc >> 8
+    low = crc & 0xff
+    high += np.isin(high, CRC_RESERVED)
+    low += np.isin(low, CRC_RESERVED)
+    # frames too short for a CRC are checked at position 0 (and rejected)
+    crc_at = np.maximum(crc_lengths, 0)
+    valid = crc_lengths > 0
+    valid &= data[rows, crc_at] == high
+    valid &= data[rows, np.minimum(crc_at + 1, data.shape[1] - 1)] == low
+    valid &= data[rows, np.maximum(lengths - 1, 0)] == 0x0d
+    return valid
+
+
+def _mapUnique(column, convert):
+    """
+    Converts each distinct value of a column once (with the live decoder's code) and spreads the results
+    """
+    unique, inverse = np.unique(column, return_inverse=True)
+    converted = [convert(value) for value in unique]
+    converted = [None if value is MISSING else value for value in converted]
+    if len(set(type(value) for value in converted)) == 1 and converted[0] is not None:
+        mapped = np.array(converted)
+    else:
+        # mixed types (e.g. enflags True, False and None) are kept as objects
+        mapped = np.empty(len(converted), dtype=object)
+        mapped[:] = converted
+    return mapped[inverse.reshape(-1)]
+
+
+def _numberColumn(chars, cast):
+    """
+    Returns a column of float or int values parsed from a field's chars (values x width)
+    - digits are accumulated into an integer, floats are that integer divided by 10 ** (digits after the point),
+      which rounds the same as float() does
+    - if a value is not a number (e.g. '---') the column is float, with nan for those values
+    """
+    mantissa = np.zeros(len(chars), dtype=np.int64)
+    digits = np.zeros(len(chars), dtype=np.int64)
+    decimals = np.zeros(len(chars), dtype=np.int64)
+    after_point = np.zeros(len(chars), dtype=bool)
+    numbers = np.ones(len(chars), dtype=bool)
+    for position in range(chars.shape[1]):
+        char = chars[:, position]
+        digit = (char >= ZERO) & (char <= NINE)
+        point = char == POINT
+        mantissa = np.where(digit, mantissa * 10 + (char - ZERO), mantissa)
+        digits += digit
+        decimals += digit & after_point
+        numbers &= digit | (point & ~after_point) | (char == 0) | ((position == 0) & (char == MINUS))
+        after_point |= point
+    # anything else (e.g. '1e3', or too many digits to be exact) is left to float() / int()
+    numbers &= (digits > 0) & (digits <= MAX_DIGITS)
+    if cast is int:
+        numbers &= ~after_point
+    mantissa = np.where(chars[:, 0] == MINUS, -mantissa, mantissa)
+    if cast is int and numbers.all():
+        return mantissa
+    values = mantissa / np.power(10.0, decimals)
+    if not numbers.all():
+        values[~numbers] = [_toNumber(cast, value) for value in _values(chars[~numbers])]
+    return values
+
+
+def _toNumber(cast, value):
+    result = _cast(cast, value)
+    return float(result) if isinstance(result, (int, float)) else float('nan')
+
+
+def _values(chars):
+    """
+    Returns a field's chars (values x width) as a bytes array
+    """
+    return np.ascontiguousarray(chars).view('S{}'.format(chars.shape[1])).reshape(-1)
+
+
+def _flagColumns(chars, slots):
+    """
+    Returns the bool array (values x flags) of a flags (or stat_flags) field
+    """
+    width = len(slots)
+    if chars.shape[1] < width:
+        chars = np.pad(chars, ((0, 0), (0, width - chars.shape[1])))
+    return chars[:, :width] == FLAG_SET
+
+
+def _field(data, starts, ends):
+    """
+    Returns the bytes from starts to ends of each row as a (rows x longest) uint8 array, padded with 0
+    """
+    width = max(int((ends - starts).max()) if len(data) else 0, 1)
+    index = starts[:, None] + np.arange(width)
+    chars = np.take_along_axis(data, np.minimum(index, data.shape[1] - 1), axis=1)
+    chars[index >= ends[:, None]] = 0
+    return chars
+
+
+class mppBatchDecoder(object):
+    """
+    Decodes a batch of responses (bytes or text frames) to one command
+    - decode(frames) returns (valid, columns): which frames were valid and {key: array} with a row per valid frame
+    """
+
+    def __init__(self, command):
+        self.name = command.name
+        self.decoder = command.decoder
+        self.schema = command.decoder.schema
+
+    def __str__(self):
+        return 'mppBatchDecoder({})'.format(self.name)
+
+    def split(self, data, lengths, valid):
+        """
+        Returns the values of the valid frames, a (frames x longest value) uint8 array per field
+        - frames with fewer values than the definition are marked not valid, values past the definition are dropped
+        """
+        count = len(self.decoder)
+        positions = np.arange(data.shape[1])
+        values_end = lengths - FRAME_TRAILER
+        separators = (data == SEPARATOR) & (positions >= 1) & (positions < values_end[:, None])
+        valid &= separators.sum(axis=1) >= count - 1
+        data = data[valid]
+        separators = separators[valid]
+        # bounds of the values: the '(', the separators, then the end of the values (or the separator after the last field)
+        bounds = np.empty((len(data), count + 1), dtype=np.int64)
+        bounds[:, 0] = 0
+        bounds[:, count] = values_end[valid]
+        ranks = np.cumsum(separators, axis=1, dtype=np.int16)
+        rows, columns = np.nonzero(separators & (ranks <= count))
+        bounds[rows, ranks[rows, columns]] = columns
+        return [_field(data, bounds[:, i] + 1, bounds[:, i + 1]) for i in range(count)]
+
+    def decode(self, frames):
+        """
+        Returns (valid, columns) for the frames
+        - valid: a bool per frame, True if its CRC and number of values are right
+        - columns: {key: array} in the order of the definition, each with a row per valid frame
+        """
+        data, lengths = padFrames(frames)
+        valid = crcValid(data, lengths)
+        cells = self.split(data, lengths, valid)
+        log.debug('%s: %d of %d frames valid', self, valid.sum(), len(lengths))
+        keys = self.schema.keys
+        columns = {}
+        for i, (convert, slot, argument, cast) in enumerate(self.decoder.fields):
+            chars = cells[i]
+            if cast is not None:
+                columns[keys[slot]] = _numberColumn(chars, cast)
+            elif convert is None:
+                columns[keys[slot]] = np.char.decode(_values(chars), ENCODING)
+            elif convert is _decodeFlags or convert is _decodeStatFlags:
+                flags = _flagColumns(chars, argument)
+                for j, flag_slot in enumerate(argument):
+                    columns[keys[flag_slot]] = flags[:, j]
+            else:
+                # options, keyed values and enflags: the live converter on each distinct value
+                slots = [slot] if slot is not None else list(argument.values())
+                for column_slot in slots:
+                    columns[keys[column_slot]] = _mapUnique(_values(chars), self._converter(convert, column_slot, argument))
+        return valid, dict((key, columns[key]) for key in keys if key in columns)
+
+    def _converter(self, convert, slot, argument):
+        def converter(value):
+            values = self.schema.newValues()
+            convert(values, slot, argument, value.decode(ENCODING), True)
+            return values[slot]
+        return converter
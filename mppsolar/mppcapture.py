@@ -0,0 +1,189 @@
+"""
+MPP Solar Inverter Command Library
+wire-level record and replay of the frames exchanged with an inverter
+- a recording connection wraps any connection and writes every frame sent and received
+  (with monotonic timestamps) to a capture file
+- a replay connection serves a capture back, at the original or an accelerated speed
+mppcapture.py
+"""
+import logging
+import struct
+import time
+
+from .mppconnection import monotonic
+
+log = logging.getLogger('MPP-Solar')
+
+# Devices named replay:<capture file> are served from a capture
+REPLAY_PREFIX = 'replay:'
+# Replay with the gaps between frames as recorded
+REPLAY_ORIGINAL_SPEED = 1.0
+
+# Capture file layout: CAPTURE_MAGIC then one record per frame,
+# a RECORD header (direction, seconds since the capture started, frame length) followed by the frame
+CAPTURE_MAGIC = b'MPPCAP1\n'
+RECORD = struct.Struct('<BdH')
+FRAME_SENT = 0
+FRAME_RECEIVED = 1
+
+
+def isReplayDevice(serial_device):
+    """
+    Determine if this instance is replaying a capture
+    """
+    return str(serial_device).startswith(REPLAY_PREFIX)
+
+
+def readCapture(capture_file):
+    """
+    Returns the list of (direction, seconds since the capture started, frame bytes) in the capture file
+    - a received frame of no bytes records a command that got no response
+    """
+    frames = []
+    with open(capture_file, 'rb') as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError('{} is not an mpp-solar capture file'.format(capture_file))
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                # a capture cut short (e.g. by a crash) keeps its complete records
+                break
+            direction, offset, length = RECORD.unpack(header)
+            frame = f.read(length)
+            if len(frame) < length:
+                break
+            frames.append((direction, offset, frame))
+    return frames
+
+
+class mppCaptureWriter(object):
+    """
+    Appends frames to a (new) capture file, timestamped relative to when the capture started
+    - once closed, the next frame reopens the file (connections are reopened by a later command)
+    """
+
+    def __init__(self, capture_file):
+        self.capture_file = capture_file
+        self._file = open(capture_file, 'wb')
+        self._file.write(CAPTURE_MAGIC)
+        self._started = monotonic()
+
+    def write(self, direction, frame):
+        if self._file is None:
+            self._file = open(self.capture_file, 'ab')
+        frame = frame or b''
+        self._file.write(RECORD.pack(direction, monotonic() - self._started, len(frame)))
+        self._file.write(frame)
+        # keep what has been captured if the process dies
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class mppRecordingConnection(object):
+    """
+    Wraps a connection, recording every command sent and response received to a capture file
+    """
+
+    def __init__(self, connection, capture_file):
+        self._connection = connection
+        self._writer = mppCaptureWriter(capture_file)
+
+    def __str__(self):
+        return "{} (recording to {})".format(self._connection, self._writer.capture_file)
+
+    def isOpen(self):
+        return self._connection.isOpen()
+
+    def close(self):
+        self._connection.close()
+        self._writer.close()
+
+    def query(self, full_command, *args):
+        self._writer.write(FRAME_SENT, full_command)
+        response_line = self._connection.query(full_command, *args)
+        self._writer.write(FRAME_RECEIVED, response_line)
+        return response_line
+
+    def reportResponse(self, valid):
+        self._connection.reportResponse(valid)
+
+
+class mppReplayConnection(object):
+    """
+    Serves the responses in a capture file as if they came from the inverter
+    - each command gets the response recorded for the next matching command in the capture
+      (recorded commands that are not asked for are skipped, a command not found does not move the replay on)
+    - responses are returned with the recorded timing divided by speed (0 replays as fast as possible)
+    - once the capture runs out there is no response
+    """
+
+    def __init__(self, capture_file, speed=REPLAY_ORIGINAL_SPEED):
+        self._capture_file = capture_file
+        self._speed = speed
+        self._exchanges = self._pairFrames(readCapture(capture_file))
+        self._position = 0
+        self._started = None
+        self._first_offset = None
+
+    def __str__(self):
+        return "replay of {} at {}x".format(self._capture_file, self._speed or 'full')
+
+    @staticmethod
+    def _pairFrames(frames):
+        """
+        Returns the list of (command, response, response offset) exchanges in the frames
+        """
+        exchanges = []
+        command = None
+        for direction, offset, frame in frames:
+            if direction == FRAME_SENT:
+                command = frame
+            elif command is not None:
+                exchanges.append((command, frame or None, offset))
+                command = None
+        return exchanges
+
+    def isOpen(self):
+        return True
+
+    def close(self):
+        pass
+
+    def remaining(self):
+        """
+        Number of exchanges left in the capture
+        """
+        return len(self._exchanges) - self._position
+
+    def _wait(self, offset):
+        """
+        Sleeps until the recorded time of the response (scaled by speed) since the replay started
+        """
+        if self._started is None:
+            self._started = monotonic()
+            self._first_offset = offset
+        if not self._speed:
+            return
+        delay = self._started + (offset - self._first_offset) / self._speed - monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def query(self, full_command, *args):
+        for position in range(self._position, len(self._exchanges)):
+            recorded, response, offset = self._exchanges[position]
+            if recorded != full_command:
+                continue
+            if position > self._position:
+                log.debug('Replay skipped %d recorded exchanges', position - self._position)
+            self._position = position + 1
+            self._wait(offset)
+            return response or None
+        log.info('Replay of %s has no (more) responses to %s', self._capture_file, full_command)
+        return None
+
+    def reportResponse(self, valid):
+        pass
@@ -3,12 +3,17 @@ MPP Solar Inverter Command Library
 reference library of serial commands (and responses) for PIP-4048MS inverters
 mppcommand.py
 """
-import ctypes
 import logging
 import random
 import sys
 
-ENCODING = 'onetoone'
+from . import mppcrc
+from .mppdecoder import ENCODING, mppResponseDecoder
+
+# Responses to SETTER commands
+SETTER_ACK = '(ACK9 \r'
+SETTER_NAK = '(NAKss\r'
+SETTER_RESPONSES = (SETTER_ACK.encode(ENCODING), SETTER_NAK.encode(ENCODING))
 
 log = logging.getLogger('MPP-Solar')
 
@@ -20,161 +25,120 @@ def is_py3():
     return True
 
 
-def crc(cmd):
-    if is_py3():
-        return py3_crc(cmd)
-
-    return py2_crc(cmd)
+def toFrame(data):
+    """
+    Returns the bytes of a frame supplied as bytes or text (e.g. the test responses)
+    """
+    if isinstance(data, (bytes, bytearray)):
+        return data
+    return data.encode(ENCODING)
 
 
-def py2_crc(cmd):
+def toText(frame):
     """
-    Calculates CRC for supplied text
+    Returns a frame as text (one character per byte)
     """
-    log.info('Calculating CRC for %s', cmd)
-
-    crc = 0
-    da = 0
-    crc_ta = [0x0000, 0x1021, 0x2042, 0x3063,
-              0x4084, 0x50a5, 0x60c6, 0x70e7,
-              0x8108, 0x9129, 0xa14a, 0xb16b,
-              0xc18c, 0xd1ad, 0xe1ce, 0xf1ef]
-
-    for c in cmd:
-        # log.debug('Encoding %s', c)
-        t_da = ctypes.c_uint8(crc >> 8)
-        da = t_da.value >> 4
-        crc <<= 4
-        index = da ^ (ord(c) >> 4)
-        crc ^= crc_ta[index]
-        t_da = ctypes.c_uint8(crc >> 8)
-        da = t_da.value >> 4
-        crc <<= 4
-        index = da ^ (ord(c) & 0x0f)
-        crc ^= crc_ta[index]
-
-    crc_low = ctypes.c_uint8(crc).value
-    crc_high = ctypes.c_uint8(crc >> 8).value
-
-    if (crc_low == 0x28 or crc_low == 0x0d or crc_low == 0x0a):
-        crc_low += 1
-    if (crc_high == 0x28 or crc_high == 0x0d or crc_high == 0x0a):
-        crc_high += 1
-
-    crc = crc_high << 8
-    crc += crc_low
-
-    log.debug('Generated CRC %x %x %x', crc_high, crc_low, crc)
-    return [crc_high, crc_low]
-
-
-def py3_crc(cmd):
+    if frame is None or not is_py3():
+        return frame
+    return frame.decode(ENCODING)
+
+
+def crc(cmd):
     """
-    Calculates CRC for supplied text
+    Calculates CRC for supplied text (or bytes), returns [high, low]
     """
-    log.info('Calculating CRC for %s', cmd)
-
-    crc = 0
-    da = 0
-    crc_ta = [0x0000, 0x1021, 0x2042, 0x3063,
-              0x4084, 0x50a5, 0x60c6, 0x70e7,
-              0x8108, 0x9129, 0xa14a, 0xb16b,
-              0xc18c, 0xd1ad, 0xe1ce, 0xf1ef]
-
-    if type(cmd) == type('string'):
-        cmd = cmd.encode(ENCODING)
-
-    for c in cmd:
-        # log.debug('Encoding %s', c)
-        t_da = ctypes.c_uint8(crc >> 8)
-        da = t_da.value >> 4
-        crc <<= 4
-        index = da ^ (c >> 4)
-        crc ^= crc_ta[index]
-        t_da = ctypes.c_uint8(crc >> 8)
-        da = t_da.value >> 4
-        crc <<= 4
-        index = da ^ (c & 0x0f)
-        crc ^= crc_ta[index]
-
-    crc_low = ctypes.c_uint8(crc).value
-    crc_high = ctypes.c_uint8(crc >> 8).value
-
-    if crc_low == 0x28 or crc_low == 0x0d or crc_low == 0x0a:
-        crc_low += 1
-    if crc_high == 0x28 or crc_high == 0x0d or crc_high == 0x0a:
-        crc_high += 1
-
-    crc = crc_high << 8
-    crc += crc_low
-
-    log.debug('Generated CRC %x %x %x', crc_high, crc_low, crc)
-    return [crc_high, crc_low]
+    return mppcrc.crc(cmd, ENCODING)
 
 
 def get_full_command(cmd):
     """
-    Generates a full command including CRC and CR
+    Generates a full command including CRC and CR (as bytes)
     """
-    log.debug('Generate full command for %s', cmd)
-    crc_high, crc_low = crc(cmd)
-    full_command = '{}{}{}\x0d'.format(cmd, chr(crc_high), chr(crc_low))
+    cmd = toFrame(cmd)
+    crc_high, crc_low = mppcrc.adjust(mppcrc.crc16(cmd))
+    full_command = cmd + bytes(bytearray((crc_high, crc_low, 0x0d)))
     log.debug('Full command: %s', full_command)
     return full_command
 
 
+def isCrcValid(response):
+    """
+    Checks the response (bytes) is long enough and its CRC matches the data
+    """
+    response = toFrame(response)
+    if len(response) < 3:
+        log.debug('Response invalid as too short')
+        return False
+    # Check we got a CRC response that matches the data
+    resp_crc = list(bytearray(response[-3:-1]))
+    calc_crc = mppcrc.adjust(mppcrc.crc16(response[:-3]))
+    if resp_crc == calc_crc:
+        return True
+    log.debug('Response invalid as calculated CRC does not match response CRC: %s vs %s', calc_crc, resp_crc)
+    return False
+
+
 class mppCommand(object):
     """
     Base Class for MPP Inverter Commands
     Each command (as stored in a <command>.json file) will be an instance of this class
+    - commands are immutable definitions shared by all inverters (and threads),
+      each execution gets its own mppCommandRequest (see createRequest)
     """
 
     def __str__(self):
-        """ String representation of the command (including response) """
-        if (self.response is None or len(self.response) < 3):
-            response = ""
-            response_dict = ""
-        else:
-            response = self.response[:-3]
-            response_dict = self.response_dict
-        result = "{}\n{}\n{}\n{}\n{}".format(self.name, self.description, self.help, response, response_dict)
+        """ String representation of the command """
+        result = "{}\n{}\n{}\n{}\n{}".format(self.name, self.description, self.help, "", "")
         return result
 
-    def __init__(self, name, description, command_type, response_definition, test_responses=[], regex="", value=None,
-                 help=""):
+    def __init__(self, name, description, command_type, response_definition, test_responses=[], regex="", help=""):
         """ Return a command object """
         self.name = name
         self.description = description
         self.help = help
         self.command_type = command_type
         self.response_definition = response_definition
-        self.response = None
-        self.response_dict = None
         self.test_responses = test_responses
         self.regex = regex
-        self.value = value
+        self.full_command = get_full_command(self.name)
+        # the response definition compiled into a decoder
+        self.decoder = mppResponseDecoder(name, command_type, response_definition)
+        # full commands already built for values of this command (e.g. PCP01)
+        self._full_commands = {}
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("Command definitions are shared and cannot be changed, use createRequest()")
+        object.__setattr__(self, name, value)
+
+    def getFullCommand(self, value=None):
+        """
+        Returns the full command (including CRC and CR) for the value (if any)
+        - built once per value
+        """
         if value is None:
-            cmd_str = self.name
-        else:
-            cmd_str = "{}{}".format(self.name, self.value)
-        self.full_command = get_full_command(cmd_str)
-        self.valid_response = False
-
-    def setValue(self, value):
-        self.value = value
-        self.full_command = get_full_command("{}{}".format(self.name, self.value))
-
-    def clearResponse(self):
-        self.response = None
-
-    def setResponse(self, response):
-        self.response = response
-        self.valid_response = self.isResponseValid(response)
-        if self.valid_response:
-            self.response_dict = self.getResponseDict()
+            return self.full_command
+        full_command = self._full_commands.get(value)
+        if full_command is None:
+            full_command = get_full_command("{}{}".format(self.name, value))
+            self._full_commands[value] = full_command
+        return full_command
+
+    def createRequest(self, value=None):
+        """
+        Returns a new request to execute this command (with the value, if any)
+        """
+        return mppCommandRequest(self, value)
 
-    def getResponse(self):
-        return self.response
+    def getExpectedResponseLength(self):
+        """
+        Return the length of a complete response (if known from the definition)
+        - setters always answer (ACK or (NAK plus CRC and CR
+        """
+        if self.command_type == 'SETTER':
+            return len(SETTER_ACK)
+        return None
 
     def getTestResponse(self):
         """
@@ -190,129 +154,141 @@ class mppCommand(object):
             - check that the response if the correct length
             - check CRC is correct
         """
-        # Check length of response
-        log.debug("IS RESP VALID {}".format(response))
-        if is_py3():
-            response = response.encode(ENCODING)
-        log.debug('Response length: %d', len(response))
-        if len(response) < 3:
-            log.debug('Response invalid as too short')
-            return False
-        # Check we got a CRC response that matches the data
-        resp = response[:-3]
-        resp_crc = response[-3:-1]
-        if is_py3():
-            log.debug('CRC resp\t%x %x', resp_crc[0], resp_crc[1])
-        else:
-            log.debug('CRC resp py2\t%x %x', ord(resp_crc[0]), ord(resp_crc[1]))
-        calc_crc_h, calc_crc_l = crc(resp)
-
-        log.debug('CRC calc\t%x %x', calc_crc_h, calc_crc_l)
-
-        if (is_py3() and (resp_crc[0] == calc_crc_h) and (resp_crc[1] == calc_crc_l)) \
-                or (not is_py3() and (ord(resp_crc[0]) == calc_crc_h) and (ord(resp_crc[1]) == calc_crc_l)):
-            log.debug('CRCs match')
-        else:
-            log.debug('Response invalid as calculated CRC does not' +
-                      ' match response CRC: .{}. .{}. vs .{}. .{}.'.format(resp_crc[0],
-                                                                           calc_crc_h,
-                                                                           resp_crc[1],
-                                                                           calc_crc_l))
+        response = toFrame(response)
+        if not isCrcValid(response):
             return False
         # Check if this is a query or set command
         if self.command_type == 'SETTER':
-            if response == '(ACK9 \r':
-                log.debug('Response valid as setter with ACK resp')
-                return True
-            if response == '(NAKss\r':
-                log.debug('Response valid as setter with NAK resp')
+            if response in SETTER_RESPONSES:
+                log.debug('Response valid as setter with ACK or NAK resp')
                 return True
             return False
         # Check if valid response is defined for this command
         if self.response_definition is None:
             log.debug('Response invalid as no RESPONSE defined for %s', self.name)
             return False
-        # Check we got the expected number of responses
-        responses = None
-        if is_py3():
-            responses = response.decode(ENCODING).split(" ")
-        else:
-            responses = response.split(" ")
-
-        if len(responses) < len(self.response_definition):
+        # Check we got the expected number of responses (counted without splitting the frame)
+        # - only in the values, a CRC byte can be a space
+        count = response.count(b' ', 0, len(response) - 3) + 1
+        if count < len(self.response_definition):
             log.error("Response invalid as insufficient number of elements in response. Got %d, expected as least %d",
-                      len(responses), len(self.response_definition))
+                      count, len(self.response_definition))
             return False
         log.debug('Response valid as no invalid situations found')
         return True
 
-    def getResponseDict(self):
+    def decodeSample(self, response, typed=False):
+        """
+        Returns the (valid) response (bytes or text) as an mppSample (None if there is no response definition)
+        - typed returns the values as int, float or bool (see mppResponseDecoder.decodeSample)
+        """
+        if self.response_definition is None:
+            log.info('No response definition')
+            return None
+        return self.decoder.decodeSample(toFrame(response), typed)
+
+    def decodeResponse(self, response, typed=False):
+        """
+        Returns the (valid) response (bytes or text) in a dict (with value, unit array)
+        - typed returns the values as int, float or bool (see mppResponseDecoder.decodeSample)
+        """
+        sample = self.decodeSample(response, typed)
+        if sample is None:
+            return {}
+        return sample.toDict()
+
+
+class mppCommandRequest(object):
+    """
+    One execution of a command
+    - carries the value, full command and response, the definition is shared (request.command)
+    - attributes of the definition (name, command_type...) can be read from the request
+    - the full command and response are bytes, getResponse and the response dict are text
+    """
+
+    __slots__ = ('command', 'value', 'full_command', 'response', 'valid_response', '_samples')
+
+    def __init__(self, command, value=None):
+        self.command = command
+        self.value = value
+        self.full_command = command.getFullCommand(value)
+        self.response = None
+        self.valid_response = False
+        # decoded samples (untyped, typed), filled on first use
+        self._samples = [None, None]
+
+    def __getattr__(self, name):
+        # only called for names that are not slots, i.e. the definition's attributes
+        if name == 'command':
+            raise AttributeError(name)
+        return getattr(self.command, name)
+
+    def __str__(self):
+        """ String representation of the command (including response) """
+        if (self.response is None or len(self.response) < 3):
+            response = ""
+            response_dict = ""
+        else:
+            response = toText(self.response[:-3])
+            response_dict = self.response_dict
+        command = self.command
+        result = "{}\n{}\n{}\n{}\n{}".format(command.name, command.description, command.help, response, response_dict)
+        return result
+
+    @property
+    def response_dict(self):
+        """
+        The (untyped) response dict, None if the response is not valid
+        """
+        if not self.valid_response:
+            return None
+        return self.getResponseDict()
+
+    def clearResponse(self):
+        self.response = None
+        self.valid_response = False
+        self._samples = [None, None]
+
+    def setResponse(self, response):
+        self.response = toFrame(response)
+        self.valid_response = self.command.isResponseValid(response)
+        self._samples = [None, None]
+
+    def getResponse(self):
+        """
+        Returns the response as text (the response attribute holds the bytes received)
+        """
+        return toText(self.response)
+
+    def getResponseDict(self, typed=False):
         """
         Returns the response in a dict (with value, unit array)
+        - typed returns the values as int, float or bool rather than as sent
         """
-        msgs = {}
+        sample = self.getSample(typed)
+        if sample is None:
+            return {}
+        return sample.toDict()
 
+    def getSample(self, typed=False):
+        """
+        Returns the response as an mppSample (None if there is no valid response, or it could not be decoded)
+        - the sample is decoded once per request (and typed)
+        - a decoding error only loses this command's values (it is logged, not raised)
+        """
         if self.response is None:
             log.info('No response')
-            return msgs
+            return None
         if not self.valid_response:
             log.info('Invalid response')
-            return msgs
-        if self.response_definition is None:
-            log.info('No response definition')
-            return msgs
-
-        responses = self.response[1:-3].split(" ")
-        for i, result in enumerate(responses):
-            # Check if we are past the 'known' responses
-            if (i >= len(self.response_definition)):
-                resp_format = ['string', 'Unknown value in response', '']
-            else:
-                resp_format = self.response_definition[i]
-
-            key = '{}'.format(resp_format[1]).lower().replace(" ", "_")
-            # Process results
-            if (resp_format[0] == 'float') or (resp_format[0] == 'int') or (resp_format[0] == 'string'):
-                msgs[key] = [result, resp_format[2]]
-            # eg. ['option', 'Output source priority', ['Utility first', 'Solar first', 'SBU first']],
-            elif (resp_format[0] == 'option'):
-                if len(resp_format[2]) > int(result):
-                    msgs[key] = [resp_format[2][int(result)], '']
-                else:
-                    msgs[key] = [result, '']
-
-            # eg. ['keyed', 'Machine type', {'00': 'Grid tie', '01': 'Off Grid', '10': 'Hybrid'}],
-            elif (resp_format[0] == 'keyed'):
-                msgs[key] = [resp_format[2][result], '']
-            # eg. ['flags', 'Device status', [ 'is_load_on', 'is_charging_on' ...
-            elif (resp_format[0] == 'flags'):
-                for j, flag in enumerate(result):
-                    msgs[resp_format[2][j]] = [int(flag), 'True - 1/False - 0']
-            # eg. ['stat_flags', 'Warning status', ['Reserved', 'Inver...
-            elif (resp_format[0] == 'stat_flags'):
-                output = ''
-                for j, flag in enumerate(result):
-                    if (flag == '1'):
-                        output = '{}'.format(resp_format[2][j]).lower().replace(" ", "_")
-                        msgs[output] = ['1', '']
-            # eg. ['enflags', 'Device Status', {'a': {'name': 'Buzzer', 'state': 'disabled'},
-            elif (resp_format[0] == 'enflags'):
-                # output = {}
-                status = 'unknown'
-                for item in result:
-                    if (item == 'E'):
-                        status = 'enabled'
-                    elif (item == 'D'):
-                        status = 'disabled'
-                    else:
-                        try:
-                            # output[resp_format[2][item]['name']] = status
-                            msgs[resp_format[2][item]['name']] = [status, '']
-                        except:
-                            pass
-                # msgs[key] = [output, '']
-            elif self.command_type == 'SETTER':
-                msgs[self.name] = [result, '']
-            else:
-                msgs[i] = [result, '']
-        return msgs
+            return None
+        typed = bool(typed)
+        sample = self._samples[typed]
+        if sample is None:
+            try:
+                sample = self.command.decodeSample(self.response, typed)
+            except Exception:
+                log.error('Could not decode the response to %s: %s', self.command.name, self.response, exc_info=True)
+                return None
+            self._samples[typed] = sample
+        return sample
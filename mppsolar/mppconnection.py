@@ -0,0 +1,576 @@
+"""
+MPP Solar Inverter Command Library
+connections (transports) used to talk to MPP Solar inverters
+mppconnection.py
+"""
+import errno
+import logging
+import os
+import select
+import time
+
+from .mppcommand import ENCODING
+from .mppframe import mppFrameParser, FRAME_END
+from .mppretry import monotonic
+
+# serial, socket and json are imported by the connections that use them,
+# so commands that never open a connection (e.g. mpp-solar -h) start quickly
+
+log = logging.getLogger('MPP-Solar')
+
+# Seconds to wait for a complete response (over all attempts)
+DEFAULT_TIMEOUT = 5
+# Seconds allowed for the first attempt of a serial command, each retry gets one more
+SERIAL_ATTEMPT_TIMEOUT = 1
+
+# Write pacing for direct USB (hidraw) connections
+PACING_FIXED = 'fixed'
+PACING_ADAPTIVE = 'adaptive'
+PACING_MODES = [PACING_FIXED, PACING_ADAPTIVE]
+# Seconds between 8 byte HID report writes, known to work with all devices
+FIXED_CHUNK_DELAY = 0.35
+# Adaptive pacing starts this aggressive and backs off towards FIXED_CHUNK_DELAY
+ADAPTIVE_INITIAL_DELAY = 0.005
+ADAPTIVE_BACKOFF_STEP = 0.01
+# Number of good commands in a row before adaptive pacing speeds up again
+ADAPTIVE_SPEEDUP_AFTER = 20
+# Number of good commands in a row before the slowest failed delay is forgotten (halved)
+ADAPTIVE_FLOOR_DECAY_AFTER = 100
+# Attempts to write a single report before giving up
+MAX_WRITE_ATTEMPTS = 5
+# File (in the mpp-solar cache directory) the adaptive pacing learned for each device is kept in
+PACING_FILE_NAME = 'pacing.json'
+
+# Devices named mux:<device>[@<address>] are reached through the daemon
+MUX_PREFIX = 'mux:'
+# Where the daemon listens (and clients connect) unless an address is given
+MUX_SOCKET = '/tmp/mpp-solar-mux.sock'
+# Seconds a client waits for the daemon, which queues and retries commands itself
+MUX_TIMEOUT = 30
+
+
+def isMuxDevice(serial_device):
+    """
+    Determine if this instance is using the device multiplexer
+    """
+    return str(serial_device).startswith(MUX_PREFIX)
+
+
+def parseMuxDevice(serial_device):
+    """
+    Returns the (device, address) of a mux:<device>[@<address>] name
+    - an address containing a / is a UNIX socket path, otherwise host:port
+    """
+    device = serial_device[len(MUX_PREFIX):]
+    address = MUX_SOCKET
+    if '@' in device:
+        device, address = device.rsplit('@', 1)
+    return device, parseAddress(address)
+
+
+def parseAddress(address):
+    """
+    Returns a UNIX socket path or a (host, port) tuple
+    """
+    if '/' in address:
+        return address
+    host, port = address.rsplit(':', 1)
+    return (host or 'localhost', int(port))
+
+
+def toJsonFrame(frame):
+    # JSON strings are unicode, frames are bytes
+    if frame is not None:
+        return frame.decode(ENCODING)
+    return frame
+
+
+def fromJsonFrame(frame):
+    if frame is not None:
+        return frame.encode(ENCODING)
+    return frame
+
+
+class mppSerialConnection(object):
+    """
+    Persistent serial connection to an inverter
+    - the port is opened on first use and kept open across commands
+    - the port is only reopened after an I/O error
+    - what is read is split into frames by an mppFrameParser
+    - reads wait for data with select on the port's descriptor (setting the port's timeout reconfigures it),
+      ports without one (e.g. loop://) wait with their timeout
+    """
+
+    def __init__(self, serial_device, baud_rate=2400, timeout=DEFAULT_TIMEOUT):
+        self._serial_device = serial_device
+        self._baud_rate = baud_rate
+        self._timeout = timeout
+        self._port = None
+        self._fileno = None
+        self._parser = mppFrameParser()
+
+    def __str__(self):
+        return "serial port {} at {} baud".format(self._serial_device, self._baud_rate)
+
+    def isOpen(self):
+        return self._port is not None
+
+    def open(self):
+        """
+        Opens the serial port (if not already open) and returns it
+        """
+        if self._port is None:
+            import serial
+            log.debug('Opening port %s, baudrate %s', self._serial_device, self._baud_rate)
+            self._port = serial.serial_for_url(self._serial_device, self._baud_rate, timeout=0)
+            try:
+                self._fileno = self._port.fileno()
+            except (AttributeError, ValueError, IOError):
+                # e.g. loop:// (io.UnsupportedOperation)
+                self._fileno = None
+        return self._port
+
+    def close(self):
+        """
+        Closes the serial port, it will be reopened by the next command
+        """
+        if self._port is None:
+            return
+        log.debug('Closing port %s', self._serial_device)
+        try:
+            self._port.close()
+        except Exception:
+            log.debug('Error closing port %s', self._serial_device, exc_info=True)
+        self._port = None
+        self._fileno = None
+        self._parser.clear()
+
+    def _discardStale(self, s):
+        """
+        Discards anything received before the command is sent (e.g. the late answer to an earlier command)
+        """
+        waiting = s.in_waiting
+        if waiting:
+            self._parser.feed(s.read(waiting))
+        self._parser.clear()
+
+    def _readFrame(self, s, deadline, expected_length=None):
+        """
+        Reads until a frame is complete (or expected_length bytes of one arrive) or the deadline passes
+        """
+        parser = self._parser
+        while True:
+            frame = parser.nextFrame()
+            if frame is not None:
+                return frame
+            if expected_length and parser.pending() >= expected_length:
+                return parser.takePartial(expected_length)
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return None
+            if self._fileno is None:
+                s.timeout = remaining
+            elif not select.select([self._fileno], [], [], remaining)[0]:
+                continue
+            data = s.read(max(1, s.in_waiting))
+            if data:
+                parser.feed(data)
+
+    def query(self, full_command, expected_length=None):
+        """
+        Sends the full command (bytes, including CRC and CR) and returns the response line (bytes)
+        - reads until a frame is complete (or expected_length bytes arrive without the \r terminator)
+        - resends the command only if an attempt times out, allowing each retry more time,
+          until the overall timeout is used up (a late answer to an earlier attempt is still accepted)
+        - returns the incomplete response (if any) once the timeout is used up
+        - on an I/O error the port is closed (so the next query reopens it) and None returned
+        """
+        deadline = monotonic() + self._timeout
+        attempt = 0
+        try:
+            s = self.open()
+            self._discardStale(s)
+            while True:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                attempt += 1
+                log.debug('Command execution attempt %d...', attempt)
+                attempt_timeout = min(SERIAL_ATTEMPT_TIMEOUT * attempt, remaining)
+                s.write_timeout = attempt_timeout
+                s.write(full_command)
+                response_line = self._readFrame(s, monotonic() + attempt_timeout, expected_length)
+                log.debug('serial response was: %s', response_line)
+                if response_line is not None:
+                    return response_line
+                log.debug('Serial read timed out after %ss', attempt_timeout)
+        except (IOError, OSError) as e:
+            # serial.SerialException is an IOError
+            log.debug('Serial I/O error on %s: %s', self._serial_device, e)
+            self.close()
+            return None
+        return self._parser.takePartial() or None
+
+
+def getPacingFile():
+    """
+    Returns the default file for the learned write pacing (next to the command registry cache)
+    """
+    from .mppregistry import getCacheDir
+    return os.path.join(getCacheDir(), PACING_FILE_NAME)
+
+
+def isCompleteFrame(response_line):
+    """
+    True if a whole frame (up to its CR) came back, only then does its CRC say anything about write pacing
+    - no (or an incomplete) response means the device is not there (unplugged, rebooting), not that it was written too fast
+    """
+    return bool(response_line) and response_line.endswith(FRAME_END)
+
+
+def loadPacing(pacing_file):
+    """
+    Returns the pacing learned by earlier processes: {device: delay}, empty if there is none
+    """
+    import json
+    try:
+        with open(pacing_file) as f:
+            pacing = json.load(f)
+    except (IOError, OSError):
+        return {}
+    except ValueError:
+        log.debug('Ignoring unreadable pacing file %s', pacing_file, exc_info=True)
+        return {}
+    return pacing if isinstance(pacing, dict) else {}
+
+
+def savePacing(pacing_file, serial_device, delay):
+    """
+    Records the pacing learned for a device
+    - failing to write (e.g. a read-only home) only means the next process learns it again
+    """
+    import json
+    from .mppregistry import writeCacheFile
+    pacing = loadPacing(pacing_file)
+    pacing[serial_device] = delay
+    try:
+        writeCacheFile(pacing_file, json.dumps(pacing).encode('utf-8'))
+    except (IOError, OSError):
+        log.debug('Could not write pacing file %s', pacing_file, exc_info=True)
+
+
+class mppWritePacer(object):
+    """
+    Inter-chunk delay used when writing HID reports
+    - fixed pacing always waits FIXED_CHUNK_DELAY
+    - adaptive pacing starts aggressive, doubles the delay on a failed write or
+      corrupted response and slowly speeds up again (not to a delay that has failed,
+      until enough good commands in a row have made that failure stale)
+    - with a serial_device and pacing_file, adaptive pacing starts from (and records) the delay learned
+      for the device by earlier processes (the failed delay is only kept by this process)
+    """
+
+    def __init__(self, mode=PACING_FIXED, serial_device=None, pacing_file=None):
+        if mode not in PACING_MODES:
+            raise ValueError("Unknown pacing mode '{}', expected one of {}".format(mode, PACING_MODES))
+        self.mode = mode
+        self._successes = 0
+        self._good_run = 0
+        self._floor = 0
+        self._serial_device = serial_device
+        self._pacing_file = None
+        if mode == PACING_ADAPTIVE:
+            self.delay = ADAPTIVE_INITIAL_DELAY
+            if serial_device and pacing_file:
+                self._pacing_file = pacing_file
+                self._restore()
+        else:
+            self.delay = FIXED_CHUNK_DELAY
+
+    def __str__(self):
+        return "{} pacing, {:.3f}s between reports".format(self.mode, self.delay)
+
+    def wait(self):
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+    def _restore(self):
+        learned = loadPacing(self._pacing_file).get(self._serial_device)
+        if isinstance(learned, list) and learned:
+            # written as [delay, floor] by earlier versions
+            learned = learned[0]
+        try:
+            self.delay = min(max(float(learned), 0), FIXED_CHUNK_DELAY)
+        except (TypeError, ValueError):
+            return
+        log.debug('Write pacing for %s learned earlier: %s', self._serial_device, self)
+
+    def _remember(self):
+        if self._pacing_file:
+            savePacing(self._pacing_file, self._serial_device, self.delay)
+
+    def backoff(self, reason):
+        """
+        Slow down after the device failed to keep up
+        """
+        self._successes = 0
+        self._good_run = 0
+        if self.mode != PACING_ADAPTIVE:
+            return
+        self._floor = max(self._floor, self.delay)
+        self.delay = min(max(self.delay * 2, ADAPTIVE_BACKOFF_STEP), FIXED_CHUNK_DELAY)
+        log.debug('Write pacing backing off (%s): now %s', reason, self)
+        self._remember()
+
+    def success(self):
+        """
+        Speed up (a little) after enough good commands
+        """
+        if self.mode != PACING_ADAPTIVE:
+            return
+        self._successes += 1
+        self._good_run += 1
+        if self._good_run >= ADAPTIVE_FLOOR_DECAY_AFTER and self._floor:
+            self._good_run = 0
+            self._floor /= 2
+            log.debug('Write pacing failed delay decayed to %.3fs', self._floor)
+        if self._successes < ADAPTIVE_SPEEDUP_AFTER:
+            return
+        self._successes = 0
+        faster = self.delay * 0.8
+        if faster > self._floor:
+            self.delay = faster
+            log.debug('Write pacing speeding up: now %s', self)
+            self._remember()
+
+
+# Learned write pacing per device path, shared by all connections in this process
+# (adaptive pacing is also kept in the pacing file for later processes)
+_write_pacers = {}
+
+
+def getWritePacer(serial_device, mode=PACING_FIXED, pacing_file=None):
+    """
+    Returns the (remembered) write pacer for the device path
+    - pacing_file defaults to getPacingFile(), False does not keep the learned pacing across processes
+    """
+    pacer = _write_pacers.get(serial_device)
+    if pacer is None or pacer.mode != mode:
+        if pacing_file is None and mode == PACING_ADAPTIVE:
+            pacing_file = getPacingFile()
+        pacer = mppWritePacer(mode, serial_device, pacing_file)
+        _write_pacers[serial_device] = pacer
+    return pacer
+
+
+class mppHidrawConnection(object):
+    """
+    Persistent direct USB (hidraw) connection to an inverter
+    - the device is opened on first use and kept open across commands
+    - responses are read as soon as the device has data (select with a deadline)
+      and returned as soon as a frame is complete (split from the reports by an mppFrameParser)
+    """
+
+    def __init__(self, serial_device, timeout=DEFAULT_TIMEOUT, pacing=PACING_FIXED):
+        self._serial_device = serial_device
+        self._timeout = timeout
+        self._pacer = getWritePacer(serial_device, pacing)
+        self._fd = None
+        self._parser = mppFrameParser()
+
+    def __str__(self):
+        return "direct USB device {}".format(self._serial_device)
+
+    def isOpen(self):
+        return self._fd is not None
+
+    def open(self):
+        """
+        Opens the hidraw device (if not already open) and returns the file descriptor
+        """
+        if self._fd is None:
+            log.debug('Opening USB device %s', self._serial_device)
+            self._fd = os.open(self._serial_device, os.O_RDWR | os.O_NONBLOCK)
+        return self._fd
+
+    def close(self):
+        """
+        Closes the hidraw device, it will be reopened by the next command
+        """
+        if self._fd is None:
+            return
+        log.debug('Closing USB device %s', self._serial_device)
+        try:
+            os.close(self._fd)
+        except OSError:
+            log.debug('Error closing USB device %s', self._serial_device, exc_info=True)
+        self._fd = None
+        self._parser.clear()
+
+    def _drain(self, fd):
+        """
+        Discards anything left unread from an earlier command (and what was read after its frame)
+        """
+        self._parser.clear()
+        while True:
+            try:
+                stale = os.read(fd, 256)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            if not stale:
+                return
+            log.debug('Discarding stale USB data: %s', stale)
+
+    def _write(self, fd, full_command):
+        """
+        Writes the full command in 8 byte chunks (the HID report size)
+        - waits between chunks as set by the write pacer
+        - a refused (EAGAIN) or short write slows the pacer down and is retried
+        """
+        to_send = memoryview(full_command)
+        if self._pacer.mode == PACING_FIXED:
+            self._pacer.wait()
+        attempts = 0
+        while (len(to_send) > 0):
+            # Split the full command into smaller chucks
+            send = to_send[:8]
+            try:
+                written = os.write(fd, send)
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                written = 0
+            to_send = to_send[written:]
+            if written < len(send):
+                attempts += 1
+                if attempts >= MAX_WRITE_ATTEMPTS:
+                    raise OSError(errno.EIO, 'Device did not accept report after {} attempts'.format(attempts))
+                self._pacer.backoff('short write' if written else 'write refused')
+            else:
+                attempts = 0
+            if to_send:
+                self._pacer.wait()
+
+    def _read(self, fd):
+        """
+        Reads until a frame is complete or the deadline passes
+        - returns the incomplete response (if any) at the deadline
+        """
+        parser = self._parser
+        deadline = monotonic() + self._timeout
+        while True:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                log.debug('USB read timed out after %ss', self._timeout)
+                break
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                continue
+            try:
+                r = os.read(fd, 256)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    continue
+                raise
+            if parser.feed(r):
+                # anything after the frame is kept by the parser (and discarded before the next command)
+                return parser.nextFrame()
+        return parser.takePartial() or None
+
+    def query(self, full_command):
+        """
+        Sends the full command (bytes, including CRC and CR) and returns the response line (bytes)
+        - on an I/O error the device is closed (so the next query reopens it) and None returned
+        """
+        try:
+            fd = self.open()
+            self._drain(fd)
+            self._write(fd, full_command)
+            response_line = self._read(fd)
+        except (OSError, select.error) as e:
+            log.debug('USB I/O error on %s: %s', self._serial_device, e)
+            self.close()
+            return None
+        log.debug('usb response was: %s', response_line)
+        return response_line
+
+    def reportResponse(self, valid):
+        """
+        Feedback from the caller on whether the response was valid (used for write pacing)
+        """
+        if valid:
+            self._pacer.success()
+        else:
+            self._pacer.backoff('invalid response')
+
+
+class mppMuxConnection(object):
+    """
+    Connection to an inverter shared by the multiplexer daemon
+    - the socket to the daemon is opened on first use and kept open across commands
+    - the command (without CRC and CR) is sent, the daemon returns the raw response
+    """
+
+    def __init__(self, serial_device, timeout=MUX_TIMEOUT):
+        self._device, self._address = parseMuxDevice(serial_device)
+        self._timeout = timeout
+        self._socket = None
+        self._file = None
+
+    def __str__(self):
+        return "{} via multiplexer at {}".format(self._device, self._address)
+
+    def isOpen(self):
+        return self._socket is not None
+
+    def open(self):
+        if self._socket is None:
+            import socket
+            log.debug('Connecting to multiplexer at %s', self._address)
+            family = socket.AF_INET if isinstance(self._address, tuple) else socket.AF_UNIX
+            s = socket.socket(family, socket.SOCK_STREAM)
+            s.settimeout(self._timeout)
+            try:
+                s.connect(self._address)
+            except Exception:
+                s.close()
+                raise
+            self._socket = s
+            self._file = s.makefile('rb')
+        return self._socket
+
+    def close(self):
+        if self._socket is None:
+            return
+        log.debug('Closing multiplexer connection %s', self._address)
+        self._file.close()
+        self._socket.close()
+        self._socket = self._file = None
+
+    def query(self, full_command, *args):
+        """
+        Sends the command to the daemon and returns the response line
+        - on an I/O error the connection is closed (so the next query reconnects) and None returned
+        """
+        import json
+        request = {'device': self._device, 'command': toJsonFrame(full_command[:-3])}
+        try:
+            self.open().sendall((json.dumps(request) + '\n').encode('utf-8'))
+            line = self._file.readline()
+            if not line:
+                raise IOError('Multiplexer closed the connection')
+        except (IOError, OSError) as e:
+            # socket.error is an IOError
+            log.debug('Multiplexer I/O error on %s: %s', self._address, e)
+            self.close()
+            return None
+        reply = json.loads(line.decode('utf-8'))
+        if 'error' in reply:
+            log.warning('Multiplexer error: %s', reply['error'])
+            return None
+        return fromJsonFrame(reply['response'])
+
+    def reportResponse(self, valid):
+        pass
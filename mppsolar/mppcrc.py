@@ -0,0 +1,69 @@
+"""
+MPP Solar Inverter Command Library
+CRC used by the inverter protocol
+- CRC-16/XMODEM (polynomial 0x1021, initial value 0) of the frame data
+- bytes of the CRC that are 0x28 '(', 0x0d CR or 0x0a LF are incremented
+  (so the CRC never looks like the start or end of a frame)
+mppcrc.py
+"""
+import binascii
+
+# Bytes the inverter does not allow in a CRC
+CRC_RESERVED = (0x28, 0x0d, 0x0a)
+
+
+def _buildTable():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xffff
+            else:
+                crc = (crc << 1) & 0xffff
+        table.append(crc)
+    return table
+
+
+# CRC of each byte value (most significant byte first)
+CRC_TABLE = _buildTable()
+
+
+def crc16_table(data):
+    """
+    Returns the CRC-16/XMODEM of the supplied bytes (pure python, one table lookup per byte)
+    """
+    crc = 0
+    for b in bytearray(data):
+        crc = ((crc << 8) & 0xff00) ^ CRC_TABLE[(crc >> 8) ^ b]
+    return crc
+
+
+def crc16(data):
+    """
+    Returns the CRC-16/XMODEM of the supplied bytes
+    - binascii.crc_hqx computes the same CRC in C
+    """
+    return binascii.crc_hqx(data, 0)
+
+
+def adjust(crc):
+    """
+    Returns the [high, low] bytes of the CRC as sent by the inverter (reserved bytes incremented)
+    """
+    crc_high = crc >> 8
+    crc_low = crc & 0xff
+    if crc_low in CRC_RESERVED:
+        crc_low += 1
+    if crc_high in CRC_RESERVED:
+        crc_high += 1
+    return [crc_high, crc_low]
+
+
+def crc(cmd, encoding='latin-1'):
+    """
+    Calculates CRC for supplied text (or bytes), returns [high, low]
+    """
+    if not isinstance(cmd, (bytes, bytearray)):
+        cmd = cmd.encode(encoding)
+    return adjust(crc16(cmd))
@@ -0,0 +1,221 @@
+"""
+MPP Solar Inverter Command Library
+response decoders compiled from the response definitions (in the commands/*.json files)
+- each field of a definition becomes a step (the key, unit and lookup table are worked out once)
+- decoding a response is then a single pass over its values, into a compact mppSample
+- decoders only hold data and module level functions, so they are kept in the registry cache
+- responses are decoded from bytes, only the values are turned into text
+mppdecoder.py
+"""
+import logging
+
+from .mppsample import mppSample, mppSampleSchema
+
+log = logging.getLogger('MPP-Solar')
+
+# Frames are single byte characters (latin-1 maps each byte to the same code point)
+ENCODING = 'latin-1'
+
+# Unit reported for each flag of a 'flags' field
+FLAG_UNIT = 'True - 1/False - 0'
+
+
+def makeKey(name):
+    """
+    Returns the key used in the response dict for a field (or flag) name
+    """
+    return '{}'.format(name).lower().replace(" ", "_")
+
+
+def _cast(cast, result):
+    # int and float parse the bytes directly,
+    # values the inverter did not send as a number (e.g. '---') are kept as strings
+    try:
+        return cast(result)
+    except ValueError:
+        log.debug('Could not convert %s with %s', result, cast.__name__)
+        return result.decode(ENCODING)
+
+
+# Values a definition does not cover (an unlisted option or key, a flag that is not a digit, flags past the
+# end of the list) never fail the decoding, unlisted values are kept as sent (also by mppbatch, which uses these converters)
+def _decodeOption(values, slot, options, result, typed):
+    # eg. ['option', 'Output source priority', ['Utility first', 'Solar first', 'SBU first']],
+    index = int(result) if result.isdigit() else len(options)
+    if len(options) > index:
+        values[slot] = options[index]
+    else:
+        values[slot] = result
+
+
+def _decodeKeyed(values, slot, table, result, typed):
+    # eg. ['keyed', 'Machine type', {'00': 'Grid tie', '01': 'Off Grid', '10': 'Hybrid'}],
+    values[slot] = table.get(result, result)
+
+
+def _decodeFlags(values, slot, slots, result, typed):
+    # eg. ['flags', 'Device status', [ 'is_load_on', 'is_charging_on' ...
+    for flag, flag_slot in zip(result, slots):
+        value = int(flag) if flag.isdigit() else flag
+        values[flag_slot] = value == 1 if typed else value
+
+
+def _decodeStatFlags(values, slot, slots, result, typed):
+    # eg. ['stat_flags', 'Warning status', ['Reserved', 'Inver...
+    for flag, flag_slot in zip(result, slots):
+        if flag == '1':
+            values[flag_slot] = True if typed else '1'
+
+
+# Typed value of each enflags status
+ENFLAGS_TYPED = {'enabled': True, 'disabled': False, 'unknown': None}
+# Status of each typed enflags value
+ENFLAGS_TEXT = dict((typed, status) for status, typed in ENFLAGS_TYPED.items())
+
+
+def _decodeEnflags(values, slot, slots, result, typed):
+    # eg. ['enflags', 'Device Status', {'a': {'name': 'Buzzer', 'state': 'disabled'},
+    status = 'unknown'
+    for item in result:
+        if item == 'E':
+            status = 'enabled'
+        elif item == 'D':
+            status = 'disabled'
+        else:
+            flag_slot = slots.get(item)
+            if flag_slot is not None:
+                values[flag_slot] = ENFLAGS_TYPED[status] if typed else status
+
+
+# Python type of the values of each plain field type (None: kept as a string)
+CASTS = {'float': float, 'int': int, 'string': None}
+
+
+class _schemaBuilder(object):
+    """
+    Collects the keys (and units) of a definition while it is compiled, giving each key a slot
+    - a key used twice gets the same slot (the later value wins, as it did in the response dict)
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.units = []
+        self.slots = {}
+
+    def slot(self, key, unit=''):
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.slots[key] = len(self.keys)
+            self.keys.append(key)
+            self.units.append(unit)
+        else:
+            self.units[slot] = unit
+        return slot
+
+
+def _flagKey(flag):
+    # flags are named as they are, or by a pair of [name when 0, name when 1] (eg. QPGS ['SCC Loss', 'SCC OK'])
+    if isinstance(flag, list):
+        return makeKey(flag[1])
+    return flag
+
+
+def _compileField(index, resp_format, name, command_type, schema):
+    """
+    Returns the (converter, slot, argument, cast) step for one field of a definition
+    - converter None means the value is stored as is, cast (if any) is the type of its typed value
+    - the keys of the field are added to the schema (flag fields have one key per flag, the argument holds their slots)
+    """
+    field_type = resp_format[0]
+    key = makeKey(resp_format[1])
+    if field_type in CASTS:
+        return (None, schema.slot(key, resp_format[2]), None, CASTS[field_type])
+    if field_type == 'option':
+        return (_decodeOption, schema.slot(key), list(resp_format[2]), None)
+    if field_type == 'keyed':
+        return (_decodeKeyed, schema.slot(key), dict(resp_format[2]), None)
+    if field_type == 'flags':
+        return (_decodeFlags, None, [schema.slot(_flagKey(flag), FLAG_UNIT) for flag in resp_format[2]], None)
+    if field_type == 'stat_flags':
+        return (_decodeStatFlags, None, [schema.slot(makeKey(flag)) for flag in resp_format[2]], None)
+    if field_type == 'enflags':
+        slots = {}
+        for item, flag in resp_format[2].items():
+            try:
+                slots[item] = schema.slot(flag['name'])
+            except (KeyError, TypeError):
+                pass
+        return (_decodeEnflags, None, slots, None)
+    # unknown field types keep the raw value (under the command name for setters)
+    if command_type == 'SETTER':
+        return (None, schema.slot(name), None, None)
+    return (None, schema.slot(index), None, None)
+
+
+class mppResponseDecoder(object):
+    """
+    Decoder for the responses (bytes) of one command
+    - decodeSample(response) returns the values in an mppSample (the keys and units are in the shared schema)
+    - decode(response) returns the same dict (with value, unit arrays) as interpreting the definition
+    - decodeTyped(response) returns the values as int, float or bool (as their field type says)
+    """
+
+    def __init__(self, name, command_type, response_definition):
+        schema = _schemaBuilder()
+        self.fields = [_compileField(i, resp_format, name, command_type, schema)
+                       for i, resp_format in enumerate(response_definition or [])]
+        # step for values past the end of the definition
+        self.unknown_field = (None, schema.slot(makeKey('Unknown value in response')), None, None)
+        self.schema = mppSampleSchema(schema.keys, schema.units)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def enflagKeys(self):
+        """
+        Returns the (status) keys of the enflags fields, whose typed values are True / False / None
+        for enabled / disabled / unknown (see ENFLAGS_TEXT)
+        """
+        keys = self.schema.status_keys
+        return [keys[flag_slot] for convert, _, slots, _ in self.fields if convert is _decodeEnflags
+                for flag_slot in slots.values()]
+
+    def decodeSample(self, response, typed=False):
+        """
+        Returns the (valid) response as an mppSample
+        - typed returns the values in their native types: float and int fields as float and int,
+          flags as bool (enflags None if not enabled or disabled), strings, options and keyed values as strings
+        """
+        values = self.schema.newValues()
+        fields = self.fields
+        count = len(fields)
+        if typed:
+            for i, result in enumerate(response[1:-3].split(b" ")):
+                convert, slot, argument, cast = fields[i] if i < count else self.unknown_field
+                if cast is not None:
+                    values[slot] = _cast(cast, result)
+                elif convert is None:
+                    values[slot] = result.decode(ENCODING)
+                else:
+                    convert(values, slot, argument, result.decode(ENCODING), True)
+        else:
+            # every value is text, so the frame is converted once
+            for i, result in enumerate(response[1:-3].decode(ENCODING).split(" ")):
+                convert, slot, argument, _ = fields[i] if i < count else self.unknown_field
+                if convert is None:
+                    values[slot] = result
+                else:
+                    convert(values, slot, argument, result, False)
+        return mppSample(self.schema, values)
+
+    def decode(self, response):
+        """
+        Returns the (valid) response in a dict (with value, unit array)
+        """
+        return self.decodeSample(response).toDict()
+
+    def decodeTyped(self, response):
+        """
+        Returns the (valid) response in a dict (with value, unit array), the values in their native types
+        """
+        return self.decodeSample(response, True).toDict()
@@ -0,0 +1,109 @@
+"""
+MPP Solar Inverter Command Library
+incremental parser that splits the bytes read from an inverter into frames
+- accepts the bytes in whatever chunks they arrive (a frame split over reads, several frames in one read)
+- a frame ends at CR, it starts at the beginning of the data or at a '(' (the start of every response)
+- resynchronises after stray bytes: the first start whose frame has a valid CRC wins, the bytes before it are
+  discarded (if no start gives a valid CRC the frame from the last '(' is returned as it is, for the caller to reject)
+- bytes after the last complete frame are kept for the next read
+mppframe.py
+"""
+import logging
+from collections import deque
+
+from .mppcommand import isCrcValid
+
+log = logging.getLogger('MPP-Solar')
+
+# Marks the start of a response
+FRAME_START = b'('
+# Ends every frame
+FRAME_END = b'\r'
+
+
+class mppFrameParser(object):
+    """
+    Splits a stream of bytes into frames
+    - feed(data) adds bytes, nextFrame() returns the complete frames in order
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._frames = deque()
+        # bytes skipped while resynchronising (since the parser was created)
+        self.discarded = 0
+
+    def __len__(self):
+        """
+        Number of complete frames waiting to be read
+        """
+        return len(self._frames)
+
+    def feed(self, data):
+        """
+        Adds the bytes read and returns the number of complete frames waiting
+        """
+        scan_from = len(self._buffer)
+        self._buffer += data
+        while True:
+            end = self._buffer.find(FRAME_END, scan_from)
+            if end < 0:
+                return len(self._frames)
+            self._frames.append(self._takeFrame(end))
+            scan_from = 0
+
+    def _takeFrame(self, end):
+        """
+        Removes the frame ending at end (and any stray bytes before it) from the buffer and returns it
+        """
+        buffer = self._buffer
+        starts = [0]
+        start = buffer.find(FRAME_START, 1, end)
+        while start >= 0:
+            starts.append(start)
+            start = buffer.find(FRAME_START, start + 1, end)
+        frame_start = starts[-1]
+        if len(starts) > 1:
+            for start in starts:
+                if isCrcValid(bytes(buffer[start:end + 1])):
+                    frame_start = start
+                    break
+        if frame_start:
+            log.debug('Discarding %d stray bytes: %s', frame_start, bytes(buffer[:frame_start]))
+            self.discarded += frame_start
+        frame = bytes(buffer[frame_start:end + 1])
+        del buffer[:end + 1]
+        return frame
+
+    def nextFrame(self):
+        """
+        Returns the oldest complete frame (None if there is none)
+        """
+        if self._frames:
+            return self._frames.popleft()
+        return None
+
+    def pending(self):
+        """
+        Number of bytes received that are not (yet) part of a complete frame
+        """
+        return len(self._buffer)
+
+    def takePartial(self, length=None):
+        """
+        Returns (and removes) the bytes of the incomplete frame (up to length bytes)
+        """
+        partial = bytes(self._buffer[:length])
+        del self._buffer[:len(partial)]
+        return partial
+
+    def clear(self):
+        """
+        Discards everything received (e.g. stale answers before a new command), returns the number of bytes discarded
+        """
+        discarded = len(self._buffer) + sum(len(frame) for frame in self._frames)
+        if discarded:
+            log.debug('Discarding stale data: %s %s', list(self._frames), bytes(self._buffer))
+        del self._buffer[:]
+        self._frames.clear()
+        return discarded
@@ -4,18 +4,19 @@ reference library of serial commands (and responses) for PIP-4048MS inverters
 mppinverter.py
 """
 import sys
-import traceback
-
-import serial
+import threading
 import time
 import re
 import logging
-import json
-import glob
-import os
-from os import path
 
-from .mppcommand import mppCommand, ENCODING
+from .mppcommand import isCrcValid
+from .mppregistry import getCommandRegistry, getCommandsFromJson, getDataValue  # noqa: F401
+from .mppscheduler import mppScheduler, gatherFutures, PRIORITY_SETTER, PRIORITY_QUERY, PRIORITY_BACKGROUND
+from .mppretry import mppRetryPolicy, mppCircuitBreaker, PROBE_COMMAND, monotonic
+from .mppconnection import mppSerialConnection, mppHidrawConnection, mppMuxConnection, isMuxDevice, \
+    isCompleteFrame, PACING_FIXED, DEFAULT_TIMEOUT
+from .mppcapture import mppRecordingConnection, mppReplayConnection, isReplayDevice, \
+    REPLAY_PREFIX, REPLAY_ORIGINAL_SPEED
 
 log = logging.getLogger('MPP-Solar')
 
@@ -39,46 +40,6 @@ class NoTestResponseDefined(MppSolarError):
     pass
 
 
-def getDataValue(data, key):
-    """
-    Get value from data dict (loaded from JSON) or return empty String
-    """
-    if key == 'regex':
-        if 'regex' in data and data['regex']:
-            return re.compile(data['regex'])
-        else:
-            return None
-    if key in data:
-        return data[key]
-    else:
-        return ""
-
-
-# file:///home/aquarat/Downloads/PIP-GK_MK%20Protocol.pdf
-def getCommandsFromJson():
-    """
-    Read in all the json files in the commands subdirectory
-    this builds a list of all valid commands
-    """
-    COMMANDS = []
-    here = path.abspath(path.dirname(__file__))
-    files = glob.glob(here + '/commands/*.json')
-
-    for file in sorted(files):
-        log.debug("Loading command information from {}".format(file))
-        with open(file) as f:
-            try:
-                data = json.load(f)
-            except Exception:
-                log.debug("Error processing JSON in {}".format(file), exc_info=True)
-                continue
-            COMMANDS.append(mppCommand(getDataValue(data, 'name'), getDataValue(data, 'description'),
-                                       getDataValue(data, 'type'), getDataValue(data, 'response'),
-                                       getDataValue(data, 'test_responses'), getDataValue(data, 'regex'),
-                                       help=getDataValue(data, 'help')))
-    return COMMANDS
-
-
 def isTestDevice(serial_device):
     """
     Determine if this instance is just a Test connection
@@ -102,38 +63,113 @@ def isDirectUsbDevice(serial_device):
     return False
 
 
+def getDefaultRetryPolicy(serial_device):
+    """
+    Returns the retry policy used unless one is supplied
+    - clients of the multiplexer make a single attempt, the daemon retries the command itself
+    """
+    if isMuxDevice(serial_device):
+        return mppRetryPolicy(max_attempts=1)
+    return mppRetryPolicy()
+
+
+def describeInverter(serial_device, connection, commands):
+    """
+    Returns the description of an inverter: how it is connected and the commands it supports
+    """
+    if isReplayDevice(serial_device):
+        inverter = "Inverter replayed from {}".format(connection)
+    elif isMuxDevice(serial_device):
+        inverter = "Inverter connected via {}".format(connection)
+    elif isDirectUsbDevice(serial_device):
+        inverter = "Inverter connected via USB on {}".format(serial_device)
+    elif isTestDevice(serial_device):
+        inverter = "Inverter connected as a TEST"
+    else:
+        inverter = "Inverter connected via serial port on {}".format(serial_device)
+    inverter += "\n-------- List of supported commands --------\n"
+    if commands:
+        for cmd in commands:
+            inverter += str(cmd)
+    return inverter
+
+
 class mppInverter:
     """
     MPP Solar Inverter Command Library
     - represents an inverter (and the commands the inverter supports)
     """
 
-    def __init__(self, serial_device=None, baud_rate=2400):
+    def __init__(self, serial_device=None, baud_rate=2400, pacing=PACING_FIXED, timeout=DEFAULT_TIMEOUT,
+                 retry_policy=None, circuit_breaker=None, record=None, replay_speed=REPLAY_ORIGINAL_SPEED):
         if not serial_device:
             raise NoDeviceError("A device to communicate by must be supplied, e.g. /dev/ttyUSB0")
         self._baud_rate = baud_rate
         self._serial_device = serial_device
         self._serial_number = None
         self._test_device = isTestDevice(serial_device)
-        self._direct_usb = isDirectUsbDevice(serial_device)
-        self._commands = getCommandsFromJson()
+        self._replay = isReplayDevice(serial_device)
+        self._mux = isMuxDevice(serial_device)
+        self._direct_usb = isDirectUsbDevice(serial_device) and not (self._replay or self._mux)
+        self._registry = getCommandRegistry()
+        self._commands = self._registry.commands
+        self._scheduler = mppScheduler('mppInverter {}'.format(serial_device))
+        self._retry_policy = retry_policy or getDefaultRetryPolicy(serial_device)
+        self._circuit_breaker = circuit_breaker or mppCircuitBreaker()
+        self._probe_timer = None
+        self._closed = False
+        self._connection = None
+        if self._replay:
+            self._connection = mppReplayConnection(serial_device[len(REPLAY_PREFIX):], speed=replay_speed)
+        elif self._mux:
+            self._connection = mppMuxConnection(serial_device)
+        elif self._direct_usb:
+            self._connection = mppHidrawConnection(serial_device, timeout=timeout, pacing=pacing)
+        elif not self._test_device:
+            self._connection = mppSerialConnection(serial_device, baud_rate, timeout=timeout)
+        if record and self._connection is not None:
+            self._connection = mppRecordingConnection(self._connection, record)
         # TODO: text descrption of inverter? version numbers?
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
     def __str__(self):
+        return describeInverter(self._serial_device, self._connection, self._commands)
+
+    def close(self):
         """
+        Closes any open connection to the inverter and stops its worker thread
+        - a later command will reopen (and restart) them
+        - no more probes are scheduled, even by a probe running while the inverter is closed
         """
-        inverter = "\n"
-        if self._direct_usb:
-            inverter = "Inverter connected via USB on {}".format(self._serial_device)
-        elif self._test_device:
-            inverter = "Inverter connected as a TEST"
-        else:
-            inverter = "Inverter connected via serial port on {}".format(self._serial_device)
-        inverter += "\n-------- List of supported commands --------\n"
-        if self._commands:
-            for cmd in self._commands:
-                inverter += str(cmd)
-        return inverter
+        self._closed = True
+        self._cancelProbe()
+        if self._connection is not None:
+            if self._scheduler.isRunning():
+                # do not close the connection under a running command
+                self._scheduler.submit(self._connection.close, PRIORITY_SETTER).result()
+            else:
+                self._connection.close()
+        self._scheduler.stop()
+        self._cancelProbe()
+
+    def _cancelProbe(self):
+        probe_timer = self._probe_timer
+        if probe_timer is not None:
+            self._probe_timer = None
+            probe_timer.cancel()
+            # a timer that already fired has queued its probe, which runs before the worker stops
+            probe_timer.join()
+
+    def isDown(self):
+        """
+        True if the inverter has stopped responding (commands fail straight away until a probe succeeds)
+        """
+        return self._circuit_breaker.isOpen()
 
     def getSerialNumber(self):
         if self._serial_number is None:
@@ -148,26 +184,22 @@ class mppInverter:
         """
         return self._commands
 
-    def _getCommand(self, cmd):
+    def _findCommand(self, cmd):
         """
-        Returns the mppcommand object of the supplied cmd string
+        Returns the (shared) mppcommand definition matching the supplied cmd string
+        and the value (if any) supplied with it
         """
         log.debug("Searching for cmd '{}'".format(cmd))
-        if not self._commands:
-            log.debug("No commands found")
+        return self._registry.find(cmd)
+
+    def _getCommand(self, cmd):
+        """
+        Returns a new request (mppCommandRequest) for the supplied cmd string
+        """
+        command, value = self._findCommand(cmd)
+        if command is None:
             return None
-        for command in self._commands:
-            if not command.regex:
-                if cmd == command.name:
-                    return command
-            else:
-                match = command.regex.match(cmd)
-                if match:
-                    log.debug(command.name, command.regex)
-                    log.debug("Matched: {} Value: {}".format(command.name, match.group(1)))
-                    command.setValue(match.group(1))
-                    return command
-        return None
+        return command.createRequest(value)
 
     def _doTestCommand(self, command):
         """
@@ -180,124 +212,183 @@ class mppInverter:
 
     def _doSerialCommand(self, command):
         """
-        Opens serial connection, sends command (multiple times if needed)
+        Sends command over the (persistent) serial connection
         and returns the response
         """
         command.clearResponse()
-        response_line = None
-        log.debug('port %s, baudrate %s', self._serial_device, self._baud_rate)
-        try:
-            with serial.serial_for_url(self._serial_device, self._baud_rate) as s:
-                # Execute command multiple times, increase timeouts each time
-                for x in range(1, 5):
-                    log.debug('Command execution attempt %d...', x)
-                    s.timeout = 1 + x
-                    s.write_timeout = 1 + x
-                    s.flushInput()
-                    s.flushOutput()
-                    s.write(command.full_command)
-                    time.sleep(0.5 * x)  # give serial port time to receive the data
-                    response_line = s.readline()
-                    log.debug('serial response was: %s', response_line)
-                    command.setResponse(response_line)
-                    return command
-        except Exception as e:
-            log.debug('Serial read error', e.strerror)
-        log.info('Command execution failed')
+        response_line = self._connection.query(command.full_command, command.getExpectedResponseLength())
+        if response_line is None:
+            log.info('Command execution failed')
+            return command
+        command.setResponse(response_line)
         return command
 
     def _doDirectUsbCommand(self, command):
         """
-        Opens direct USB connection, sends command (multiple times if needed)
+        Sends command over the (persistent) direct USB connection
         and returns the response
+        - tells the connection whether a complete frame came back with a valid CRC (for write pacing)
         """
         command.clearResponse()
-        response_line = ""
-        usb0 = None
-        try:
-            try:
-                usb0 = os.open(self._serial_device, os.O_RDWR | os.O_NONBLOCK)
-            except Exception as e:
-                log.debug('USB open error', e.strerror)
-                return command
-            # Send the command to the open usb connection
-            to_send = command.full_command
-            while (len(to_send) > 0):
-                # Split the full command into smaller chucks
-                send, to_send = to_send[:8], to_send[8:]
-                time.sleep(0.35)
-                if is_py3():
-                    send = send.encode(ENCODING)
-                os.write(usb0, send)
-            time.sleep(0.25)
-            # Read from the usb connection
-            # try to a max of 100 times
-            for x in range(100):
-                # attempt to deal with resource busy and other failures to read
-                try:
-                    time.sleep(0.15)
-                    r = os.read(usb0, 256)
-                    if is_py3():
-                        r = r.decode(ENCODING)
-                    response_line += r
-                except Exception as e:
-                    log.debug('USB read error')
-                # Finished is \r is in response
-                if ('\r' in response_line):
-                    # remove anything after the \r
-                    response_line = response_line[:response_line.find('\r') + 1]
-                    break
-            log.debug('usb response was: %s', response_line)
-            command.setResponse(response_line)
-        except Exception as err:
-            log.error(err)
-            traceback.print_exc()
+        response_line = self._connection.query(command.full_command)
+        if isCompleteFrame(response_line):
+            self._connection.reportResponse(isCrcValid(response_line))
+        if response_line is None:
+            log.info('Command execution failed')
+            return command
+        command.setResponse(response_line)
+        return command
 
-        try:
-            if usb0 is not None:
-                os.close(usb0)
-        except:
-            pass
+    @staticmethod
+    def _getPriority(commands):
+        """
+        Setters run before any queued queries
+        """
+        for command, _ in commands:
+            if command is not None and command.command_type == 'SETTER':
+                return PRIORITY_SETTER
+        return PRIORITY_QUERY
 
-        return command
+    def submit(self, cmd, priority=None):
+        """
+        Queues a command (as supplied) for the inverter, returns a Future for the executed command
+        - commands run one at a time, setter commands run before any queued queries
+          unless a priority is supplied
+        """
+        found = self._findCommand(cmd)
+        if priority is None:
+            priority = self._getPriority([found])
+        self._closed = False
+        return self._scheduler.submit(self._execute, priority, cmd, found)
 
-    locked = False
+    def execute(self, cmd, priority=None):
+        """
+        Sends a command (as supplied) to inverter and returns the command (with response)
+        - waits for its turn in the inverter's command queue
+        """
+        return self.submit(cmd, priority).result()
 
-    def execute(self, cmd):
+    def submitMany(self, cmds, priority=None):
         """
-        Sends a command (as supplied) to inverter and returns the raw response
+        Queues several commands (as supplied) to run one after another,
+        returns a Future for the list of executed commands (None for unknown commands)
+        - all the commands are looked up before anything is sent
+        - each command is a job of its own, so a setter submitted meanwhile runs before the rest of them
+          (the connection stays open between them)
         """
-        while self.locked:
-            time.sleep(0.1)
-        self.locked = True
+        found = [self._findCommand(cmd) for cmd in cmds]
+        if priority is None:
+            priority = self._getPriority(found)
+        self._closed = False
+        return gatherFutures([self._scheduler.submit(self._execute, priority, cmd, f) for cmd, f in zip(cmds, found)])
 
-        doCommand = None
+    def executeMany(self, cmds, priority=None):
+        """
+        Sends several commands (as supplied) one after another over one connection
+        and returns the list of executed commands (None for unknown commands)
+        """
+        return self.submitMany(cmds, priority).result()
+
+    def _doCommand(self, command):
+        """
+        Sends the command once over the inverter's connection
+        """
+        if (self._test_device):
+            log.debug('TEST connection: executing %s', command)
+            return self._doTestCommand(command)
+        elif (self._direct_usb):
+            log.debug('DIRECT USB connection: executing %s', command)
+            return self._doDirectUsbCommand(command)
+        log.debug('SERIAL connection: executing %s', command)
+        return self._doSerialCommand(command)
+
+    def _isResponding(self, command):
+        """
+        True if the device answered the command with anything, even a frame failing its CRC
+        """
+        return bool(command.response)
 
-        for i in range(0, 10):
+    def _execute(self, cmd, found=None):
+        """
+        Sends a command (as supplied) to inverter and returns a new request (with response)
+        - found is the (command, value) already looked up for cmd
+        - retries as set by the retry policy
+        - fails straight away (with no response) if the device has been marked down
+        - only called from the scheduler's worker
+        """
+        if found is None:
+            found = self._findCommand(cmd)
+        command, value = found
+        if command is None:
+            log.critical("Command not found")
+            return None
+        command = command.createRequest(value)
+        if self._circuit_breaker.isOpen():
+            log.info('%s is not responding (%s), not sending %s', self._serial_device, self._circuit_breaker, cmd)
+            command.clearResponse()
+            return command
+
+        policy = self._retry_policy
+        started = monotonic()
+        attempt = 0
+        answered = False
+        while True:
+            attempt += 1
             try:
-                command = self._getCommand(cmd)
-
-                if command is None:
-                    log.critical("Command not found")
-                elif (self._test_device):
-                    log.debug('TEST connection: executing %s', command)
-                    doCommand = self._doTestCommand(command)
-                elif (self._direct_usb):
-                    log.debug('DIRECT USB connection: executing %s', command)
-                    doCommand = self._doDirectUsbCommand(command)
-                else:
-                    log.debug('SERIAL connection: executing %s', command)
-                    doCommand = self._doSerialCommand(command)
+                self._doCommand(command)
             except Exception as err:
                 log.error(sys.exc_info()[0])
                 log.error(err)
+                command.clearResponse()
 
-            if doCommand.getResponse() is not None and doCommand.isResponseValid(doCommand.getResponse()):
-                break
-
-            log.debug("Received empty response. Retrying attempt {} of {}...".format(i, 10))
-            time.sleep(1)
+            if command.valid_response:
+                self._circuit_breaker.recordSuccess()
+                return command
 
-        self.locked = False
+            responded = self._isResponding(command)
+            answered = answered or responded
+            delay = policy.getDelay(attempt, responded)
+            if not policy.shouldRetry(attempt, started, delay):
+                break
+            log.debug("Received %s response. Retrying attempt %d of %d in %.2fs...",
+                      "invalid" if responded else "no", attempt + 1, policy.max_attempts, delay)
+            time.sleep(delay)
+
+        if answered:
+            # the device is there, its responses were just damaged or did not match the definition
+            self._circuit_breaker.recordSuccess()
+        elif self._circuit_breaker.recordFailure():
+            self._scheduleProbe()
+        return command
 
-        return doCommand
+    def _scheduleProbe(self):
+        """
+        Queue a (background priority) probe of a device marked down after the probe interval
+        - not once the inverter has been closed
+        """
+        if self._closed:
+            return
+        self._probe_timer = threading.Timer(self._circuit_breaker.probe_interval,
+                                            self._scheduler.submit, (self._probe, PRIORITY_BACKGROUND))
+        self._probe_timer.daemon = True
+        self._probe_timer.start()
+
+    def _probe(self):
+        """
+        Check (with a single short command) if a device marked down is responding again
+        """
+        self._probe_timer = None
+        if self._closed or not self._circuit_breaker.isOpen():
+            return
+        command = self._getCommand(PROBE_COMMAND)
+        log.debug('Probing %s with %s', self._serial_device, PROBE_COMMAND)
+        try:
+            self._doCommand(command)
+        except Exception as err:
+            log.debug('Probe failed: %s', err)
+            command.clearResponse()
+        if self._isResponding(command):
+            self._circuit_breaker.recordSuccess()
+        else:
+            self._circuit_breaker.recordFailure()
+            self._scheduleProbe()
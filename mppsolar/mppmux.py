@@ -0,0 +1,206 @@
+"""
+MPP Solar Inverter Command Library
+device multiplexer, lets several processes share an inverter
+- the daemon (mpp-solar-mux) owns each device through an mppInverter, which serialises access
+- clients use devices named mux:<device> (or mux:<device>@<socket path or host:port>),
+  their commands are sent to the daemon over a UNIX socket (or TCP loopback, other addresses only if allowed)
+- identical queries within the cache time are answered from the daemon's cache
+  (and identical queries waiting on the device share one command)
+mppmux.py
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+from argparse import ArgumentParser
+
+from .mppconnection import DEFAULT_TIMEOUT, PACING_FIXED, PACING_MODES, MUX_SOCKET, monotonic, \
+    parseAddress, toJsonFrame
+from .mppinverter import mppInverter
+from .mppregistry import getCommandRegistry
+
+if sys.version_info[0] < 3:
+    import SocketServer as socketserver
+else:
+    import socketserver
+
+log = logging.getLogger('MPP-Solar')
+
+# Seconds a (valid) query response is reused for identical queries
+MUX_CACHE_TIME = 5.0
+
+
+class mppMultiplexer(object):
+    """
+    Shares inverters between clients
+    - query runs a command on one of the devices, answering queries from the cache where possible
+    - setters are never cached and clear the device's cache
+    """
+
+    def __init__(self, devices, baud_rate=2400, pacing=PACING_FIXED, timeout=DEFAULT_TIMEOUT,
+                 cache_time=MUX_CACHE_TIME):
+        self.cache_time = cache_time
+        self._registry = getCommandRegistry()
+        self._inverters = {}
+        for device in devices:
+            self._inverters[device] = mppInverter(device, baud_rate, pacing=pacing, timeout=timeout)
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._inflight = {}
+        self.commands_sent = 0
+
+    def __str__(self):
+        return "Multiplexer for {}".format(', '.join(sorted(self._inverters)))
+
+    def close(self):
+        for inverter in self._inverters.values():
+            inverter.close()
+
+    def query(self, device, cmd):
+        """
+        Returns the response (bytes, None for no response) of the inverter on device to cmd
+        """
+        inverter = self._inverters.get(device)
+        if inverter is None:
+            raise ValueError("Device '{}' is not shared by this multiplexer".format(device))
+        command, _ = self._registry.find(cmd)
+        if command is None:
+            raise ValueError("Unknown command '{}'".format(cmd))
+        key = (device, cmd)
+        with self._lock:
+            if command.command_type == 'SETTER':
+                for cached in [k for k in self._cache if k[0] == device]:
+                    del self._cache[cached]
+                future, owner = inverter.submit(cmd), False
+                self.commands_sent += 1
+            else:
+                cached = self._cache.get(key)
+                if cached is not None and monotonic() - cached[0] < self.cache_time:
+                    log.debug('Answering %s on %s from cache', cmd, device)
+                    return cached[1]
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = inverter.submit(cmd)
+                    self._inflight[key] = future
+                    self.commands_sent += 1
+        try:
+            command = future.result()
+        finally:
+            if owner:
+                with self._lock:
+                    del self._inflight[key]
+        if owner and command.valid_response:
+            with self._lock:
+                self._cache[key] = (monotonic(), command.response)
+        return command.response
+
+
+class mppMuxRequestHandler(socketserver.StreamRequestHandler):
+    """
+    One client connection, each line is a JSON request {"device": ..., "command": ...}
+    answered by a JSON line {"response": ...} (or {"error": ...})
+    """
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line.decode('utf-8'))
+                response = self.server.multiplexer.query(request['device'], request['command'])
+                reply = {'response': toJsonFrame(response)}
+            except Exception as e:
+                log.debug('Multiplexer request %s failed', line, exc_info=True)
+                reply = {'error': str(e)}
+            self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class mppMuxUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class mppMuxTcpServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _isListening(path):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        s.close()
+
+
+def isLoopback(host):
+    """
+    True if host (a name or address) is this machine's loopback interface
+    """
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(host, None)]
+    except socket.error:
+        return False
+    return bool(addresses) and all(address.startswith('127.') or address == '::1' for address in addresses)
+
+
+def createServer(multiplexer, address=MUX_SOCKET, allow_remote=False):
+    """
+    Returns a server (not yet serving) for the multiplexer on a UNIX socket path or (host, port)
+    - TCP is only served on the loopback interface unless allow_remote (the daemon does not authenticate clients)
+    """
+    if isinstance(address, tuple):
+        if not allow_remote and not isLoopback(address[0]):
+            raise ValueError("Not listening on '{}': it is not a loopback address and remote clients are not allowed".format(
+                address[0]))
+        server = mppMuxTcpServer(address, mppMuxRequestHandler)
+    else:
+        if os.path.exists(address) and not _isListening(address):
+            # left behind by a daemon that did not shut down cleanly
+            os.unlink(address)
+        server = mppMuxUnixServer(address, mppMuxRequestHandler)
+    server.multiplexer = multiplexer
+    return server
+
+
+def main():
+    parser = ArgumentParser(description='MPP Solar Device Multiplexer')
+    parser.add_argument('-d', '--device', type=str, help='Serial device(s) to share [comma separated]',
+                        default='/dev/hidraw0')
+    parser.add_argument('-b', '--baud', type=int, help='Baud rate for serial communications', default=2400)
+    parser.add_argument('--pacing', choices=PACING_MODES, help='Write pacing for direct USB (hidraw) devices', default=PACING_FIXED)
+    parser.add_argument('--timeout', type=float, help='Seconds to wait for a response from the inverter', default=DEFAULT_TIMEOUT)
+    parser.add_argument('-S', '--socket', type=str, help='UNIX socket path (or host:port) to listen on', default=MUX_SOCKET)
+    parser.add_argument('--allow-remote', action='store_true',
+                        help='Allow listening on a TCP address other than loopback (clients are not authenticated)')
+    parser.add_argument('-c', '--cache', type=float, help='Seconds to answer identical queries from the cache',
+                        default=MUX_CACHE_TIME)
+    parser.add_argument('-D', '--enableDebug', action='store_true', help='Enable Debug')
+    args = parser.parse_args()
+
+    if args.enableDebug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    address = parseAddress(args.socket)
+    if isinstance(address, tuple) and not args.allow_remote and not isLoopback(address[0]):
+        parser.error("{} is not a loopback address, add --allow-remote to listen on it".format(args.socket))
+    multiplexer = mppMultiplexer(args.device.split(','), args.baud, pacing=args.pacing, timeout=args.timeout,
+                                 cache_time=args.cache)
+    server = createServer(multiplexer, address, allow_remote=args.allow_remote)
+    print('{} listening on {}'.format(multiplexer, args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        multiplexer.close()
+        if not isinstance(address, tuple) and os.path.exists(address):
+            os.unlink(address)
@@ -0,0 +1,529 @@
+"""
+MPP Solar Inverter Command Library
+helpers for publishing inverter data to an MQTT broker (used by mpp_info_pub)
+- mppPublishFilter: change-only publishing, a value is only published if it changed by more than its deadband
+  since it was last published (queued), or if its topic has been silent for the heartbeat
+- documents: all the values of a device for one cycle in one message (json, or msgpack / cbor if installed)
+- mppPublishQueue: messages are queued (never blocking the caller) and sent to the broker by a background thread,
+  when the queue is full they are written (by another thread) to an mppSpool file, replayed in order once the broker is back
+mpppublish.py
+"""
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+log = logging.getLogger('MPP-Solar')
+
+# Most seconds a topic goes without being published (when publishing changes only)
+DEFAULT_HEARTBEAT = 300
+# Field name of the deadband used for numeric fields without their own
+DEFAULT_DEADBAND_FIELD = '*'
+# Formats of the per cycle document: module needed (None: standard library)
+DOCUMENT_FORMATS = {'json': None, 'msgpack': 'msgpack', 'cbor': 'cbor2'}
+# Messages held in memory waiting for the broker
+DEFAULT_QUEUE_SIZE = 1000
+# Seconds between attempts to send a message the broker did not take
+RETRY_DELAY = 1
+# Messages sent but not yet confirmed by the broker (paho's default max_inflight_messages)
+DEFAULT_WINDOW = 20
+# Seconds between checks for confirmations while messages are in flight
+CONFIRM_POLL = 0.01
+
+
+def parseDeadbands(spec):
+    """
+    Returns {field: (absolute, relative)} from 'field=deadband,...'
+    - a deadband is an absolute change (e.g. battery_voltage=0.2) or a percentage of the last value (e.g. ac_output_load=5%)
+    - field '*' is the deadband of numeric fields that do not have one
+    """
+    deadbands = {}
+    if not spec:
+        return deadbands
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        try:
+            field, deadband = item.split('=')
+            field = field.strip()
+            deadband = deadband.strip()
+            if deadband.endswith('%'):
+                deadbands[field] = (0.0, float(deadband[:-1]) / 100)
+            else:
+                deadbands[field] = (float(deadband), 0.0)
+        except ValueError:
+            raise ValueError("Invalid deadband '{}', expected field=change or field=change%".format(item))
+    return deadbands
+
+
+def isNumber(value):
+    # flags (bool) are compared for any change
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class mppPublishFilter(object):
+    """
+    Per topic cache of the last value published
+    - changed(topic, field, value) says whether the value should be published, record(topic, value) remembers it
+      once it has been queued, forget(topic) when it was dropped after all (so the next value is published)
+    - numbers are published when they move more than the field's deadband (absolute or relative to the value
+      last published), other values on any change, every value at least once every heartbeat seconds (0 for never)
+    """
+
+    def __init__(self, deadbands=None, heartbeat=DEFAULT_HEARTBEAT, clock=time.time):
+        self.deadbands = deadbands or {}
+        self.heartbeat = heartbeat
+        self._clock = clock
+        # topic: (value, time published)
+        self._last = {}
+        self.published = 0
+        self.suppressed = 0
+
+    def __len__(self):
+        return len(self._last)
+
+    def clear(self):
+        """
+        Forgets the values published (e.g. after reconnecting, so everything is published again)
+        """
+        self._last.clear()
+
+    def isChange(self, field, last, value):
+        """
+        Whether value differs from the last published value by more than the field's deadband
+        """
+        if not (isNumber(value) and isNumber(last)):
+            return value != last
+        absolute, relative = self.deadbands.get(field, self.deadbands.get(DEFAULT_DEADBAND_FIELD, (0.0, 0.0)))
+        change = abs(value - last)
+        if not (absolute or relative):
+            return change != 0
+        return change > absolute and change > relative * abs(last)
+
+    def changed(self, topic, field, value):
+        """
+        Returns True if the value should be published to the topic
+        """
+        last = self._last.get(topic)
+        if last is not None and not self.isChange(field, last[0], value):
+            if not self.heartbeat or self._clock() - last[1] < self.heartbeat:
+                self.suppressed += 1
+                return False
+        return True
+
+    def record(self, topic, value):
+        """
+        Remembers the value as published to the topic (once the message has been queued)
+        """
+        self._last[topic] = (value, self._clock())
+        self.published += 1
+
+    def forget(self, topic):
+        """
+        Forgets the value published to the topic (its message was dropped), the next value is published
+        """
+        self._last.pop(topic, None)
+
+
+def buildDocument(serial_number, timestamp, status, settings=None):
+    """
+    Returns the document for one cycle of a device: its serial number, the time (ms since the epoch) and
+    the values of its status (and settings) dicts (as returned by getFullStatus / getSettings)
+    """
+    document = {'serial_number': serial_number,
+                'timestamp': timestamp,
+                'status': dict((key, item['value']) for key, item in status.items())}
+    if settings is not None:
+        document['settings'] = dict((key, item['value']) for key, item in settings.items())
+    return document
+
+
+def getDocumentEncoder(document_format):
+    """
+    Returns the function that encodes a document in the format
+    - raises ImportError if the format needs a module that is not installed
+    """
+    if document_format == 'json':
+        return lambda document: json.dumps(document, separators=(',', ':'))
+    if document_format == 'msgpack':
+        import msgpack
+        return lambda document: msgpack.packb(document, use_bin_type=True)
+    if document_format == 'cbor':
+        import cbor2
+        return cbor2.dumps
+    raise ValueError('Unknown document format {}, expected one of {}'.format(document_format, ', '.join(sorted(DOCUMENT_FORMATS))))
+
+
+class mppSpool(object):
+    """
+    Append-only file of messages (one json line each: timestamp, topic, payload)
+    - messages left from an earlier run are replayed first
+    - the file is emptied once everything in it has been replayed and sent (messages may be sent again if the
+      program stops while replaying)
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, 'a+b')
+        self._file.seek(0, os.SEEK_END)
+        self._size = self._file.tell()
+        self._offset = 0
+        if self._size:
+            log.info('Spool %s has %d bytes of messages to replay', filename, self._size)
+
+    def __str__(self):
+        return 'mppSpool({})'.format(self.filename)
+
+    def pending(self):
+        """
+        Whether there are messages waiting to be replayed
+        """
+        return self._offset < self._size
+
+    @staticmethod
+    def _line(timestamp, topic, payload):
+        record = {'timestamp': timestamp, 'topic': topic}
+        if isinstance(payload, bytes) and not isinstance(payload, str):
+            record['payload_base64'] = base64.b64encode(payload).decode('ascii')
+        else:
+            record['payload'] = payload
+        return json.dumps(record).encode('utf-8') + b'\n'
+
+    def _write(self, data):
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._size = self._file.tell()
+
+    def extend(self, messages):
+        """
+        Appends messages (timestamp, topic, payload) to the file, written and synced together
+        """
+        if messages:
+            self._write(b''.join(self._line(*message) for message in messages))
+
+    def prepend(self, messages):
+        """
+        Puts (older) messages ahead of the ones waiting to be replayed
+        """
+        self._file.seek(self._offset)
+        waiting = self._file.read()
+        self._file.truncate(0)
+        self._size = self._offset = 0
+        self._write(b''.join(self._line(*message) for message in messages) + waiting)
+
+    def next(self):
+        """
+        Returns the oldest message not yet replayed (timestamp, topic, payload), None if there is none
+        """
+        while self.pending():
+            self._file.seek(self._offset)
+            line = self._file.readline()
+            self._offset = self._file.tell()
+            try:
+                record = json.loads(line.decode('utf-8'))
+                if 'payload_base64' in record:
+                    return record['timestamp'], record['topic'], base64.b64decode(record['payload_base64'])
+                return record['timestamp'], record['topic'], record['payload']
+            except (ValueError, KeyError):
+                # e.g. the end of a line written when the program stopped
+                log.warning('%s: skipping unreadable message %s', self, line)
+        return None
+
+    def compact(self):
+        """
+        Empties the file once every message in it has been replayed (and sent)
+        """
+        if self._size and not self.pending():
+            self._file.truncate(0)
+            self._size = self._offset = 0
+
+    def close(self):
+        self._file.close()
+
+
+class mppPublishQueue(object):
+    """
+    Bounded queue of messages (timestamp, topic, payload) sent by a background thread
+    - put() never blocks: when the queue is full messages go to the spool (if there is one, otherwise the oldest
+      message is dropped), and keep going there until the spool has been replayed (so messages stay in order)
+    - put() returns False if the message was not queued (the queue has been stopped), on_drop(topic) is called
+      for a message dropped after it was queued (queue full without a spool, spool file not written)
+    - put() does not touch the spool file: spooled messages are buffered and written by a spool thread, a batch
+      at a time, the file has its own lock (so disk writes never hold up put())
+    - send(topic, payload, timestamp) is called on the background thread, it returns False if the message could not
+      be sent (the queue sends it again once connected, before the next one), True if the broker has confirmed it,
+      or else a receipt whose is_published() says when the broker has (e.g. paho's MQTTMessageInfo)
+    - once send has returned a receipt the client owns the message: the queue never sends it again, the client does
+      until the broker acknowledges it (paho resends QoS 1 messages after reconnecting), so each message has a
+      single sender
+    - up to window messages are in flight (sent, not yet confirmed) at a time
+    - a message only counts as sent (and the spool is only emptied) once it has been confirmed, messages still in
+      flight when the queue is stopped are spooled (and may reach the broker twice if it had got them)
+    """
+
+    def __init__(self, send, maxsize=DEFAULT_QUEUE_SIZE, spool=None, clock=time.time, window=DEFAULT_WINDOW,
+                 on_drop=None):
+        self._send = send
+        self.maxsize = maxsize
+        self.window = window
+        self.spool = spool
+        self._on_drop = on_drop
+        self._clock = clock
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._connected = threading.Event()
+        self._thread = None
+        self._running = False
+        self._stopped = False
+        # messages taken from the queue or spool and not yet confirmed, in order: [message, receipt]
+        # (receipt None: to be sent, again if the client did not take it)
+        self._inflight = []
+        # messages go to the spool (rather than the queue) until everything spooled has been read back
+        self._spooling = spool is not None and spool.pending()
+        # messages spooled but not written to the file yet, and the batches written so far
+        self._overflow = []
+        self._overflowed = threading.Condition(self._lock)
+        self._spool_writes = 0
+        # held while the spool file is used (taken before _lock when both are needed)
+        self._spool_lock = threading.Lock()
+        self._spool_thread = None
+        self.sent = 0
+        self.spooled = 0
+        self.dropped = 0
+
+    def __len__(self):
+        """
+        Number of messages waiting in memory
+        """
+        return len(self._queue)
+
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._drain, name='mpp-publish')
+            self._thread.daemon = True
+            self._thread.start()
+            if self.spool is not None:
+                self._spool_thread = threading.Thread(target=self._writeSpool, name='mpp-spool')
+                self._spool_thread.daemon = True
+                self._spool_thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread, messages not sent are spooled (if there is a spool)
+        """
+        with self._lock:
+            self._running = False
+            self._stopped = True
+            self._available.notify_all()
+            self._overflowed.notify_all()
+        self._connected.set()
+        for thread in (self._thread, self._spool_thread):
+            if thread is not None:
+                thread.join()
+        self._thread = self._spool_thread = None
+        self._confirm()
+        with self._spool_lock, self._lock:
+            unsent = [entry[0] for entry in self._inflight] + list(self._queue)
+            self._queue.clear()
+            self._inflight = []
+            if self.spool is not None:
+                # the file ends up as: unsent, spooled not yet replayed, spooled not yet written
+                if unsent:
+                    self.spool.prepend(unsent)
+                self.spool.extend(self._overflow)
+                self._overflow = []
+                self.spool.close()
+
+    def setConnected(self, connected):
+        """
+        Called when the connection to the broker is made or lost
+        """
+        if connected:
+            self._connected.set()
+        else:
+            self._connected.clear()
+
+    def put(self, topic, payload, timestamp=None):
+        """
+        Queues a message, never waits for the broker, returns False if it was not queued
+        """
+        message = (self._clock() if timestamp is None else timestamp, topic, payload)
+        dropped = None
+        with self._lock:
+            if self._stopped:
+                return False
+            if self.spool is not None and (self._spooling or len(self._queue) >= self.maxsize):
+                self._overflow.append(message)
+                self._spooling = True
+                self.spooled += 1
+                self._overflowed.notify()
+            else:
+                if len(self._queue) >= self.maxsize:
+                    dropped = self._queue.popleft()
+                    self.dropped += 1
+                    if self.dropped == 1 or self.dropped % self.maxsize == 0:
+                        log.warning('Publish queue full, %d messages dropped', self.dropped)
+                self._queue.append(message)
+            self._available.notify()
+        if dropped is not None:
+            self._dropped([dropped])
+        return True
+
+    def _dropped(self, messages):
+        """
+        Tells on_drop about messages dropped after they were queued (called without holding _lock)
+        """
+        if self._on_drop is not None:
+            for _, topic, _ in messages:
+                self._on_drop(topic)
+
+    def flush(self, timeout):
+        """
+        Waits (up to timeout seconds) until every message has been sent, returns True if they were
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._lock:
+                if not self._queue and not self._inflight and not self._spooling:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    @staticmethod
+    def _wait(condition, deadline):
+        """
+        Waits on the condition (held) until notified or the deadline (None for ever), False once the deadline has passed
+        """
+        if deadline is None:
+            condition.wait()
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        condition.wait(remaining)
+        return True
+
+    def _take(self, message):
+        # called holding _lock
+        entry = [message, None]
+        self._inflight.append(entry)
+        return entry
+
+    def _next(self, timeout=None):
+        """
+        Waits (up to timeout seconds, None for ever) for the next message (oldest in memory, then the spool)
+        and returns its in flight entry, None when stopped or timed out
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                while self._running and not self._queue and not self._spooling:
+                    if not self._wait(self._available, deadline):
+                        return None
+                if not self._running:
+                    return None
+                if self._queue:
+                    return self._take(self._queue.popleft())
+            # read without holding _lock, so put() never waits for the disk
+            with self._spool_lock:
+                message = self.spool.next()
+                with self._lock:
+                    if message is not None:
+                        return self._take(message)
+                    if not self._overflow:
+                        # everything spooled has been read back, messages go to the queue again
+                        self._spooling = False
+                        continue
+                    written = self._spool_writes
+            with self._lock:
+                # the rest has not been written yet
+                while self._running and self._spool_writes == written:
+                    if not self._wait(self._available, deadline):
+                        return None
+
+    def _writeSpool(self):
+        """
+        Writes the spooled messages to the file, a batch at a time (on the spool thread)
+        """
+        while True:
+            with self._lock:
+                while self._running and not self._overflow:
+                    self._overflowed.wait()
+                if not self._running:
+                    # stop() writes what is left
+                    return
+            with self._spool_lock:
+                with self._lock:
+                    messages = self._overflow
+                    self._overflow = []
+                try:
+                    self.spool.extend(messages)
+                except (IOError, OSError) as e:
+                    log.error('%s: %d messages lost: %s', self.spool, len(messages), e)
+                    self._dropped(messages)
+            with self._lock:
+                self._spool_writes += 1
+                self._available.notify_all()
+
+    def _transmit(self, entry):
+        """
+        Sends an in flight message, returns False if it could not be sent
+        """
+        timestamp, topic, payload = entry[0]
+        try:
+            receipt = self._send(topic, payload, timestamp)
+        except Exception as e:
+            log.warning('Publishing to %s failed: %s', topic, e)
+            return False
+        if not receipt:
+            return False
+        with self._lock:
+            entry[1] = receipt
+        return True
+
+    def _confirm(self):
+        """
+        Counts the messages the broker has confirmed as sent
+        """
+        confirmed = 0
+        with self._lock:
+            for entry in list(self._inflight):
+                receipt = entry[1]
+                if receipt is None:
+                    continue
+                if receipt is True or receipt.is_published():
+                    self._inflight.remove(entry)
+                    confirmed += 1
+            self.sent += confirmed
+        if confirmed and self.spool is not None:
+            with self._spool_lock, self._lock:
+                if not self._inflight:
+                    self.spool.compact()
+
+    def _drain(self):
+        while self._running:
+            self._connected.wait()
+            if not self._running:
+                return
+            self._confirm()
+            with self._lock:
+                # messages the client did not take are sent again (in order) before any new one
+                entry = next((entry for entry in self._inflight if entry[1] is None), None)
+                waiting = len(self._inflight)
+            if entry is None:
+                if waiting >= self.window:
+                    time.sleep(CONFIRM_POLL)
+                    continue
+                # while messages are in flight, only wait long enough to check for their confirmation
+                entry = self._next(CONFIRM_POLL if waiting else None)
+                if entry is None:
+                    continue
+            if not self._transmit(entry):
+                time.sleep(RETRY_DELAY)
@@ -0,0 +1,232 @@
+"""
+MPP Solar Inverter Command Library
+registry of the commands defined in the commands/*.json files
+- loaded once per process and shared by all inverters (the command definitions are immutable)
+- kept in a cache file (with the full commands already built) so later processes load it with one read
+mppregistry.py
+"""
+import glob
+import logging
+import os
+import pickle
+import re
+import sys
+import threading
+from os import path
+
+from . import mppcommand, mppcrc, mppdecoder, mppsample
+from .mppcommand import mppCommand
+
+log = logging.getLogger('MPP-Solar')
+
+
+def getDataValue(data, key):
+    """
+    Get value from data dict (loaded from JSON) or return empty String
+    """
+    if key == 'regex':
+        if 'regex' in data and data['regex']:
+            return re.compile(data['regex'])
+        else:
+            return None
+    if key in data:
+        return data[key]
+    else:
+        return ""
+
+
+# Where the command definitions live
+COMMANDS_DIR = path.join(path.abspath(path.dirname(__file__)), 'commands')
+# Bump when the cached registry layout changes
+CACHE_VERSION = 5
+
+
+# file:///home/aquarat/Downloads/PIP-GK_MK%20Protocol.pdf
+def getCommandsFromJson(directory=COMMANDS_DIR):
+    """
+    Read in all the json files in the commands subdirectory
+    this builds a list of all valid commands
+    """
+    import json
+    COMMANDS = []
+    files = glob.glob(path.join(directory, '*.json'))
+
+    for file in sorted(files):
+        log.debug("Loading command information from {}".format(file))
+        with open(file) as f:
+            try:
+                data = json.load(f)
+            except Exception:
+                log.debug("Error processing JSON in {}".format(file), exc_info=True)
+                continue
+            COMMANDS.append(mppCommand(getDataValue(data, 'name'), getDataValue(data, 'description'),
+                                       getDataValue(data, 'type'), getDataValue(data, 'response'),
+                                       getDataValue(data, 'test_responses'), getDataValue(data, 'regex'),
+                                       help=getDataValue(data, 'help')))
+    return COMMANDS
+
+
+class mppCommandRegistry(object):
+    """
+    Index of the known commands
+    - commands without a regex are looked up by name in a dict
+    - parameterised commands (e.g. PCP01) are matched by a single precompiled
+      alternation of all their regexes (tried in definition order)
+    - an exact name is preferred over a regex match
+    """
+
+    loaded_from_cache = False
+
+    def __init__(self, commands):
+        self.commands = commands
+        self._by_name = {}
+        self._by_group = {}
+        patterns = []
+        for command in commands:
+            if not command.regex:
+                # the first definition of a name wins (as when the list was searched)
+                self._by_name.setdefault(command.name, command)
+                continue
+            group = 'c{}'.format(len(patterns))
+            patterns.append('(?P<{}>{})'.format(group, command.regex.pattern))
+            self._by_group[group] = command
+        self._matcher = re.compile('|'.join(patterns)) if patterns else None
+
+    def __len__(self):
+        return len(self.commands)
+
+    def find(self, cmd):
+        """
+        Returns the command matching the cmd string and the value (if any) supplied with it
+        (None, None if no command matches)
+        """
+        command = self._by_name.get(cmd)
+        if command is not None:
+            return command, None
+        if self._matcher is None:
+            return None, None
+        match = self._matcher.match(cmd)
+        if match is None:
+            log.debug("No command matches '{}'".format(cmd))
+            return None, None
+        command = self._by_group[match.lastgroup]
+        value = None
+        if command.regex.groups:
+            # the command's own (first) group follows the group wrapped around its regex
+            value = match.group(self._matcher.groupindex[match.lastgroup] + 1)
+        log.debug("Matched: {} Value: {}".format(command.name, value))
+        return command, value
+
+
+def getCacheDir():
+    """
+    Returns the mpp-solar directory in the user's cache directory
+    """
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or path.join(path.expanduser('~'), '.cache')
+    return path.join(cache_dir, 'mpp-solar')
+
+
+def getCacheFile():
+    """
+    Returns the default registry cache file (in the user's cache directory, one per python version)
+    """
+    return path.join(getCacheDir(), 'commands-py{}{}.cache'.format(*sys.version_info[:2]))
+
+
+def getDefinitionsSignature(directory=COMMANDS_DIR):
+    """
+    Returns what the cache is valid for: the name, size and modification time of each definition
+    (and of the code that builds the registry, including mppcrc for the full commands)
+    """
+    files = sorted(glob.glob(path.join(directory, '*.json')))
+    files += [mppcommand.__file__, mppcrc.__file__, mppdecoder.__file__, mppsample.__file__, __file__]
+    signature = [CACHE_VERSION, path.abspath(directory)]
+    for file in files:
+        stat = os.stat(file)
+        signature.append((path.basename(file), stat.st_size, stat.st_mtime))
+    return signature
+
+
+def _readCache(cache_file, signature):
+    try:
+        with open(cache_file, 'rb') as f:
+            cached_signature, registry = pickle.loads(f.read())
+    except (IOError, OSError):
+        return None
+    except Exception:
+        log.debug('Ignoring unreadable command cache %s', cache_file, exc_info=True)
+        return None
+    if cached_signature != signature:
+        log.debug('Command cache %s is out of date', cache_file)
+        return None
+    return registry
+
+
+def writeCacheFile(cache_file, data):
+    """
+    Writes data (bytes) to a file in the cache directory via a temporary file, so readers never see part of it
+    - the directory is created if needed
+    - raises IOError / OSError if it could not be written (the temporary file is removed)
+    """
+    import tempfile
+    cache_dir = path.dirname(cache_file)
+    if not path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    fd, temp_file = tempfile.mkstemp(dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_file, cache_file)
+    except (IOError, OSError):
+        if path.exists(temp_file):
+            os.unlink(temp_file)
+        raise
+
+
+def _writeCache(cache_file, signature, registry):
+    """
+    Writes the cache
+    - failing to write (e.g. a read-only home) only costs the next process the JSON parsing
+    """
+    try:
+        writeCacheFile(cache_file, pickle.dumps((signature, registry), pickle.HIGHEST_PROTOCOL))
+    except (IOError, OSError):
+        log.debug('Could not write command cache %s', cache_file, exc_info=True)
+
+
+def loadCommandRegistry(cache_file=None, directory=COMMANDS_DIR):
+    """
+    Returns a registry of the command definitions in directory
+    - loaded from the cache file if it is up to date, otherwise built from the JSON and cached
+    - cache_file False disables the cache
+    """
+    if cache_file is None:
+        cache_file = getCacheFile()
+    signature = getDefinitionsSignature(directory) if cache_file else None
+    if cache_file:
+        registry = _readCache(cache_file, signature)
+        if registry is not None:
+            log.debug('Loaded %d commands from cache %s', len(registry), cache_file)
+            registry.loaded_from_cache = True
+            return registry
+    registry = mppCommandRegistry(getCommandsFromJson(directory))
+    if cache_file:
+        _writeCache(cache_file, signature, registry)
+    return registry
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def getCommandRegistry():
+    """
+    Returns the process-wide command registry (loaded on first use)
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = loadCommandRegistry()
+    return _registry
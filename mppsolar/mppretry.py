@@ -0,0 +1,101 @@
+"""
+MPP Solar Inverter Command Library
+retry policy and circuit breaker used when executing commands
+mppretry.py
+"""
+import logging
+import time
+
+log = logging.getLogger('MPP-Solar')
+
+# time.monotonic is not available in python2
+monotonic = getattr(time, 'monotonic', time.time)
+
+# Command used to check if a device marked down has come back (short response)
+PROBE_COMMAND = 'QPI'
+
+
+class mppRetryPolicy(object):
+    """
+    How often and how quickly a failed command is retried
+    - max_attempts: attempts in total (including the first)
+    - initial_delay, backoff, max_delay: delay before each retry grows as
+      initial_delay * backoff ** (retry - 1), capped at max_delay
+    - deadline: no retry is started once this many seconds have passed since the first attempt
+    A corrupted (or unexpected) response means the device is there, so it is retried
+    straight away without backing off; backing off is for no response at all
+    """
+
+    def __init__(self, max_attempts=3, initial_delay=0.2, backoff=2.0, max_delay=2.0, deadline=10):
+        self.max_attempts = max_attempts
+        self.initial_delay = initial_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def __str__(self):
+        return "{} attempts, {}s backing off x{} to {}s, {}s deadline".format(
+            self.max_attempts, self.initial_delay, self.backoff, self.max_delay, self.deadline)
+
+    def getDelay(self, retry, responded=False):
+        """
+        Returns the seconds to wait before the supplied retry (1 is the first retry)
+        """
+        if responded:
+            return 0.0
+        return min(self.initial_delay * (self.backoff ** (retry - 1)), self.max_delay)
+
+    def shouldRetry(self, attempt, started, delay):
+        """
+        True if another attempt is allowed after the supplied (1 based) attempt number
+        """
+        if attempt >= self.max_attempts:
+            return False
+        return monotonic() + delay - started < self.deadline
+
+
+class mppCircuitBreaker(object):
+    """
+    Marks a device as down after threshold consecutive failed commands
+    - while down commands fail straight away instead of tying up the caller
+    - a probe is due every probe_interval seconds, a successful probe (or command) marks the device up
+    """
+
+    def __init__(self, threshold=3, probe_interval=30):
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self._failures = 0
+        self._open = False
+        self._next_probe = 0
+
+    def __str__(self):
+        if self._open:
+            return "down after {} failures".format(self._failures)
+        return "up ({} recent failures)".format(self._failures)
+
+    def isOpen(self):
+        """
+        True if the device is considered down
+        """
+        return self._open
+
+    def isProbeDue(self):
+        return self._open and monotonic() >= self._next_probe
+
+    def recordSuccess(self):
+        if self._open:
+            log.info('Device is responding again')
+        self._failures = 0
+        self._open = False
+
+    def recordFailure(self):
+        """
+        Counts a failed command (or probe), returns True if the device has just been marked down
+        """
+        self._failures += 1
+        self._next_probe = monotonic() + self.probe_interval
+        if not self._open and self._failures >= self.threshold:
+            log.warning('Device marked down after %d consecutive failures', self._failures)
+            self._open = True
+            return True
+        return False
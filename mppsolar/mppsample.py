@@ -0,0 +1,135 @@
+"""
+MPP Solar Inverter Command Library
+compact records of the values decoded from one response
+- the schema (keys, units, status keys) is built once per command and shared by all its samples
+- a sample only holds the schema and a list of values (MISSING where the response had no value)
+- dicts (as returned by getResponseDict and getFullStatus) are only built when asked for
+mppsample.py
+"""
+
+
+class _Missing(object):
+    """
+    Marks a key with no value in a sample (e.g. a stat flag that is not set)
+    """
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'MISSING'
+
+    def __reduce__(self):
+        # unpickles as the same object
+        return 'MISSING'
+
+
+# Value of the keys a response did not include
+MISSING = _Missing()
+
+
+class mppSampleSchema(object):
+    """
+    The keys (and their units) a command's responses can have, in definition order
+    """
+
+    __slots__ = ('keys', 'units', 'status_keys', 'index')
+
+    def __init__(self, keys, units):
+        self.keys = tuple(keys)
+        self.units = tuple(units)
+        # keys as used in the status and settings dicts (spaces replaced), worked out once
+        self.status_keys = tuple('{}'.format(key).replace(" ", "_") for key in self.keys)
+        self.index = dict((key, i) for i, key in enumerate(self.keys))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getstate__(self):
+        return (self.keys, self.units)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def newValues(self):
+        """
+        Returns the values list for a new sample (every key MISSING)
+        """
+        return [MISSING] * len(self.keys)
+
+
+class mppSample(object):
+    """
+    The values decoded from one response
+    - read like a (read only) dict of key: value, the unit of a key is sample.unit(key)
+    - toDict() and toStatus() build the dicts the rest of the library used before samples
+    """
+
+    __slots__ = ('schema', 'values')
+
+    def __init__(self, schema, values):
+        self.schema = schema
+        self.values = values
+
+    def __repr__(self):
+        return 'mppSample({})'.format(dict(self.items()))
+
+    def __len__(self):
+        return sum(1 for value in self.values if value is not MISSING)
+
+    def __contains__(self, key):
+        i = self.schema.index.get(key)
+        return i is not None and self.values[i] is not MISSING
+
+    def __getitem__(self, key):
+        value = self.values[self.schema.index[key]]
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __eq__(self, other):
+        if not isinstance(other, mppSample):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def get(self, key, default=None):
+        i = self.schema.index.get(key)
+        if i is None or self.values[i] is MISSING:
+            return default
+        return self.values[i]
+
+    def unit(self, key):
+        return self.schema.units[self.schema.index[key]]
+
+    def keys(self):
+        return [key for key, value in zip(self.schema.keys, self.values) if value is not MISSING]
+
+    def items(self):
+        return [(key, value) for key, value in zip(self.schema.keys, self.values) if value is not MISSING]
+
+    def toDict(self):
+        """
+        Returns the sample as a dict of key: [value, unit]
+        """
+        schema = self.schema
+        return {key: [value, unit] for key, unit, value in zip(schema.keys, schema.units, self.values)
+                if value is not MISSING}
+
+    def toStatus(self, status=None):
+        """
+        Adds the sample to (or returns) a status dict of key: {"value": value, "unit": unit}
+        """
+        if status is None:
+            status = {}
+        schema = self.schema
+        for key, unit, value in zip(schema.status_keys, schema.units, self.values):
+            if value is not MISSING:
+                status[key] = {"value": value, "unit": unit}
+        return status
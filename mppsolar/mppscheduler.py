@@ -0,0 +1,126 @@
+"""
+MPP Solar Inverter Command Library
+per-device command scheduler (priority queue with a single worker)
+mppscheduler.py
+"""
+import itertools
+import logging
+import sys
+import threading
+from concurrent.futures import Future
+
+if sys.version_info[0] < 3:
+    from Queue import PriorityQueue
+else:
+    from queue import PriorityQueue
+
+log = logging.getLogger('MPP-Solar')
+
+# Lower runs first
+PRIORITY_SETTER = 0
+PRIORITY_QUERY = 10
+PRIORITY_BACKGROUND = 20
+
+
+def gatherFutures(futures):
+    """
+    Returns a Future for the list of the futures' results (in order)
+    - fails with the first exception (in order) once all the futures are done, cancelled if any was cancelled
+    """
+    gathered = Future()
+    waiting = [len(futures)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            waiting[0] -= 1
+            if waiting[0]:
+                return
+        for future in futures:
+            if future.cancelled():
+                gathered.cancel()
+                return
+            if future.exception() is not None:
+                gathered.set_exception(future.exception())
+                return
+        gathered.set_result([future.result() for future in futures])
+
+    if not futures:
+        gathered.set_result([])
+    for future in futures:
+        future.add_done_callback(done)
+    return gathered
+
+
+class mppScheduler(object):
+    """
+    Per-device request queue
+    - a single worker thread runs the submitted jobs one at a time, lowest priority value first
+      (jobs of equal priority run in the order they were submitted)
+    - submit returns a Future for the job's result
+    """
+
+    def __init__(self, name='mppScheduler'):
+        self._name = name
+        self._queue = PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def __str__(self):
+        return "{} ({} queued)".format(self._name, self._queue.qsize())
+
+    def isWorkerThread(self):
+        """
+        True if called from a job running on this scheduler's worker
+        """
+        return self._worker is not None and threading.current_thread() is self._worker
+
+    def isRunning(self):
+        return self._worker is not None and self._worker.is_alive()
+
+    def _ensureWorker(self):
+        with self._lock:
+            if not self.isRunning():
+                self._worker = threading.Thread(target=self._run, name=self._name)
+                self._worker.daemon = True
+                self._worker.start()
+
+    def submit(self, fn, priority=PRIORITY_QUERY, *args):
+        """
+        Queues fn(*args) to run on the worker, returns a Future for its result
+        - jobs submitted from the worker itself run immediately (so jobs can use the scheduler)
+        """
+        future = Future()
+        if self.isWorkerThread():
+            self._call(future, fn, args)
+            return future
+        self._queue.put((priority, next(self._sequence), future, fn, args))
+        self._ensureWorker()
+        return future
+
+    def stop(self):
+        """
+        Stops the worker once the jobs already queued have run
+        """
+        if self.isRunning() and not self.isWorkerThread():
+            self._queue.put((sys.maxsize, next(self._sequence), None, None, None))
+            self._worker.join()
+
+    @staticmethod
+    def _call(future, fn, args):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            log.debug('Scheduled job failed', exc_info=True)
+            future.set_exception(e)
+
+    def _run(self):
+        while True:
+            priority, _, future, fn, args = self._queue.get()
+            if future is None:
+                log.debug('%s stopping', self._name)
+                return
+            self._call(future, fn, args)
@@ -0,0 +1,244 @@
+"""
+MPP Solar Inverter Command Library
+simulated inverter for benchmarks and tests without hardware
+- answers on a pseudo-terminal (usable as a serial port, or as a hidraw device via a link
+  named like /tmp/sim/hidraw0) and optionally on a TCP socket (socket://host:port)
+- responses come from the test_responses of each command definition
+mppsimulator.py
+"""
+import errno
+import logging
+import os
+import random
+import select
+import socket
+import threading
+import time
+import tty
+from argparse import ArgumentParser
+
+from .mppcommand import crc, SETTER_ACK, SETTER_NAK
+from .mppdecoder import ENCODING
+from .mppregistry import getCommandRegistry
+
+log = logging.getLogger('MPP-Solar')
+
+
+def buildFrame(data):
+    """
+    Appends CRC and CR to the supplied bytes
+    """
+    crc_high, crc_low = crc(data)
+    return data + bytearray([crc_high, crc_low]) + b'\r'
+
+
+class mppSimulator(object):
+    """
+    Simulated inverter
+    - latency: seconds before answering each command
+    - baud_rate: if set, the answer is sent at (about) this line speed
+    - corrupt_rate: chance that a byte of an answer is changed (so its CRC fails)
+    - drop_rate: chance that a byte of an answer is dropped
+    - port: also listen on this TCP port (0 picks a free port, see .port)
+    - link: also make this path a symlink to the pty (e.g. a path ending in hidraw0)
+    """
+
+    def __init__(self, latency=0.0, baud_rate=None, corrupt_rate=0.0, drop_rate=0.0,
+                 port=None, link=None, seed=None):
+        self.latency = latency
+        self.baud_rate = baud_rate
+        self.corrupt_rate = corrupt_rate
+        self.drop_rate = drop_rate
+        self.port = port
+        self.link = link
+        self.device = None
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._registry = getCommandRegistry()
+        self._master = None
+        self._slave = None
+        self._server = None
+        self._running = False
+        self._threads = []
+
+    def __str__(self):
+        return "Simulated inverter on {}".format(self.device)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stop()
+
+    def start(self):
+        """
+        Opens the pty (and socket) and starts answering, returns the pty device path
+        """
+        self._master, self._slave = os.openpty()
+        try:
+            tty.setraw(self._slave)
+            self.device = os.ttyname(self._slave)
+            if self.link:
+                if os.path.lexists(self.link):
+                    os.unlink(self.link)
+                os.symlink(self.device, self.link)
+            self._running = True
+            self._startThread(self._serve, self._master, os.read, os.write)
+            if self.port is not None:
+                self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self._server.bind(('127.0.0.1', self.port))
+                self._server.listen(5)
+                self.port = self._server.getsockname()[1]
+                self._startThread(self._accept)
+        except Exception:
+            # e.g. the directory of the link does not exist: do not leave the pty open
+            self.stop()
+            raise
+        log.info('%s', self)
+        return self.device
+
+    def stop(self):
+        """
+        Stops answering and closes the pty and socket
+        """
+        self._running = False
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+        if self.link and os.path.lexists(self.link):
+            os.unlink(self.link)
+
+    def _startThread(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def _accept(self):
+        while self._running:
+            readable, _, _ = select.select([self._server], [], [], 0.1)
+            if not readable:
+                continue
+            conn, _ = self._server.accept()
+            self._startThread(self._serveSocket, conn)
+
+    def _serveSocket(self, conn):
+        try:
+            self._serve(conn.fileno(), lambda fd, n: conn.recv(n), lambda fd, data: conn.sendall(data))
+        finally:
+            conn.close()
+
+    def _serve(self, fd, read, write):
+        """
+        Reads commands (terminated by CR) from fd and writes the answers
+        """
+        buffer = b''
+        while self._running:
+            readable, _, _ = select.select([fd], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                data = read(fd, 256)
+            except (OSError, socket.error) as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    continue
+                return
+            if not data:
+                return
+            buffer += data
+            while b'\r' in buffer:
+                request, buffer = buffer.split(b'\r', 1)
+                response = self.respond(request + b'\r')
+                if self.latency:
+                    time.sleep(self.latency)
+                self._send(fd, write, self._damage(response))
+
+    def _send(self, fd, write, response):
+        """
+        Writes the answer, paced to the baud rate if one is set (10 bits per byte)
+        """
+        if not self.baud_rate:
+            write(fd, response)
+            return
+        for i in range(0, len(response), 8):
+            chunk = response[i:i + 8]
+            time.sleep(len(chunk) * 10.0 / self.baud_rate)
+            write(fd, chunk)
+
+    def _damage(self, response):
+        """
+        Corrupts and drops bytes (never the CR) as set by corrupt_rate and drop_rate
+        """
+        if not self.corrupt_rate and not self.drop_rate:
+            return response
+        damaged = bytearray()
+        for i, b in enumerate(bytearray(response)):
+            last = i == len(response) - 1
+            if not last and self._random.random() < self.drop_rate:
+                continue
+            if not last and self._random.random() < self.corrupt_rate:
+                b = (b + self._random.randrange(1, 255)) % 256
+                if b == 0x0d:
+                    b = 0x0e
+            damaged.append(b)
+        return bytes(damaged)
+
+    def respond(self, request):
+        """
+        Returns the answer (bytes) for a full command (including CRC and CR)
+        - a command with a bad CRC or unknown to the definitions is NAKed
+        """
+        self.requests += 1
+        if len(request) < 4 or buildFrame(request[:-3]) != request:
+            log.debug('Simulator: bad request %s', request)
+            return SETTER_NAK.encode(ENCODING)
+        cmd = request[:-3].decode(ENCODING)
+        command, _ = self._registry.find(cmd)
+        if command is None:
+            log.debug('Simulator: unknown command %s', cmd)
+            return SETTER_NAK.encode(ENCODING)
+        if command.command_type == 'SETTER':
+            return SETTER_ACK.encode(ENCODING)
+        if not command.test_responses:
+            return SETTER_NAK.encode(ENCODING)
+        response = self._random.choice(command.test_responses).encode(ENCODING)
+        # Use the test response data, but always with a correct CRC
+        return buildFrame(response[:-3])
+
+
+def main():
+    parser = ArgumentParser(description='MPP Solar Inverter Simulator')
+    parser.add_argument('-l', '--latency', type=float, help='Seconds before answering each command', default=0.0)
+    parser.add_argument('-b', '--baud', type=int, help='Emulate this line speed (default: as fast as possible)')
+    parser.add_argument('-c', '--corrupt', type=float, help='Chance each answer byte is corrupted', default=0.0)
+    parser.add_argument('-x', '--drop', type=float, help='Chance each answer byte is dropped', default=0.0)
+    parser.add_argument('-p', '--port', type=int, help='Also listen on this TCP port (socket://localhost:PORT)')
+    parser.add_argument('-L', '--link', type=str, help='Symlink to the pty (name it hidrawN to use the direct USB path)')
+    parser.add_argument('-D', '--enableDebug', action='store_true', help='Enable Debug')
+    args = parser.parse_args()
+
+    if args.enableDebug:
+        logging.basicConfig(level=logging.DEBUG)
+
+    simulator = mppSimulator(latency=args.latency, baud_rate=args.baud, corrupt_rate=args.corrupt,
+                             drop_rate=args.drop, port=args.port, link=args.link)
+    with simulator:
+        print('Simulated inverter on {}'.format(simulator.device))
+        if args.link:
+            print('linked as {}'.format(args.link))
+        if args.port is not None:
+            print('listening on socket://localhost:{}'.format(simulator.port))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -7,6 +7,8 @@ mpputils.py
 import logging
 from .mppinverter import mppInverter
 from .mppinverter import NoDeviceError
+from .mppconnection import PACING_FIXED, DEFAULT_TIMEOUT
+from .mppcapture import REPLAY_ORIGINAL_SPEED
 
 log = logging.getLogger('MPP-Solar')
 
@@ -20,6 +22,40 @@ def getVal(_dict, key, ind=None):
         return _dict[key][ind]
 
 
+def buildSampleStatus(samples):
+    """
+    Build the status dict ({key: {value, unit}}) straight from query response samples (later samples win)
+    """
+    status = {}
+    for sample in samples:
+        if sample is not None:
+            sample.toStatus(status)
+    return status
+
+
+def buildSettings(default_settings, current_settings, flag_settings):
+    """
+    Build the settings dict ({key: {value, unit, default}}) from the QDI, QPIRI and QFLAG response dicts
+    """
+    # current_settings.update(flag_settings)  # Combine current and flag settings dicts
+
+    settings = {}
+    # {"Battery Bulk Charge Voltage": {"unit": "V", "default": 56.4, "value": 57.4}}
+
+    for item in current_settings.keys():
+        key = '{}'.format(item).replace(" ", "_")
+        settings[key] = {"value": getVal(current_settings, key, 0),
+                         "unit": getVal(current_settings, key, 1),
+                         "default": getVal(default_settings, key, 0)}
+    for key in flag_settings:
+        _key = '{}'.format(key).replace(" ", "_")
+        if _key in settings:
+            settings[_key]['value'] = getVal(flag_settings, key, 0)
+        else:
+            settings[_key] = {'value': getVal(flag_settings, key, 0), "unit": "", "default": ""}
+    return settings
+
+
 class mppUtils:
     """
     MPP Solar Inverter Utility Library
@@ -27,20 +63,51 @@ class mppUtils:
 
     serial_number = None
 
-    def __init__(self, serial_device=None, baud_rate=2400):
+    def __init__(self, serial_device=None, baud_rate=2400, pacing=PACING_FIXED, timeout=DEFAULT_TIMEOUT,
+                 record=None, replay_speed=REPLAY_ORIGINAL_SPEED):
         if (serial_device is None):
             raise NoDeviceError("A serial device must be supplied, e.g. /dev/ttyUSB0")
-        self.inverter = mppInverter(serial_device, baud_rate)
+        self.inverter = mppInverter(serial_device, baud_rate, pacing=pacing, timeout=timeout,
+                                    record=record, replay_speed=replay_speed)
         self.getSerialNumber()
 
+    def close(self):
+        self.inverter.close()
+
     def getKnownCommands(self):
         return self.inverter.getAllCommands()
 
-    def getResponseDict(self, cmd):
-        return self.inverter.execute(cmd).getResponseDict()
+    def getResponseDict(self, cmd, typed=False):
+        command = self.inverter.execute(cmd)
+        if command is None:
+            return {}
+        return command.getResponseDict(typed)
 
     def getResponse(self, cmd):
-        return self.inverter.execute(cmd).getResponse()
+        command = self.inverter.execute(cmd)
+        if command is None:
+            return None
+        return command.getResponse()
+
+    def executeMany(self, cmds, typed=False):
+        """
+        Runs several commands one after another and returns {cmd: response dict} for all of them
+        - typed returns the values as int, float or bool rather than as sent
+        """
+        results = {}
+        for cmd, command in zip(cmds, self.inverter.executeMany(cmds)):
+            if command is None:
+                results[cmd] = {}
+            else:
+                results[cmd] = command.getResponseDict(typed)
+        return results
+
+    def getSamples(self, cmds, typed=False):
+        """
+        Runs several commands one after another and returns {cmd: mppSample} for all of them (None if there was no valid response)
+        """
+        return dict((cmd, None if command is None else command.getSample(typed))
+                    for cmd, command in zip(cmds, self.inverter.executeMany(cmds)))
 
     def getSerialNumber(self):
         if self.serial_number is None:
@@ -48,15 +115,13 @@ class mppUtils:
 
         return self.serial_number
 
-    def getFullStatus(self, queries="Q1,QPIGS", extraFlagData=False):
+    def getFullStatus(self, queries="Q1,QPIGS", extraFlagData=False, typed=False):
         """
         Helper function that returns all the status data
         """
-        status = {}
         # serial_number = self.getSerialNumber()
-        data = {}
-        for i in queries.split(","):
-            data.update(self.getResponseDict(i))
+        cmds = queries.split(",")
+        samples = self.getSamples(cmds, typed)
 
         # Need to get 'Parallel' info, but dont know what the parallel number for the correct inverter is...
         # parallel_data = self.mp.getResponseDict("QPGS0")
@@ -65,35 +130,12 @@ class mppUtils:
         #    parallel_data = self.mp.getResponseDict("QPGS1")
         # status_data.update(parallel_data)
 
-        for item in data.keys():
-            key = '{}'.format(item).replace(" ", "_")
-            status[key] = {"value": data[key][0], "unit": data[key][1]}
-        # Still have 'Device Status' from QPIGS
-        # Still have QPGSn
-        return status
+        return buildSampleStatus(samples[i] for i in cmds)
 
-    def getSettings(self):
+    def getSettings(self, typed=False):
         """
         Query inverter for all current settings
         """
         # serial_number = self.getSerialNumber()
-        default_settings = self.getResponseDict("QDI")
-        current_settings = self.getResponseDict("QPIRI")
-        flag_settings = self.getResponseDict("QFLAG")
-        # current_settings.update(flag_settings)  # Combine current and flag settings dicts
-
-        settings = {}
-        # {"Battery Bulk Charge Voltage": {"unit": "V", "default": 56.4, "value": 57.4}}
-
-        for item in current_settings.keys():
-            key = '{}'.format(item).replace(" ", "_")
-            settings[key] = {"value": getVal(current_settings, key, 0),
-                             "unit": getVal(current_settings, key, 1),
-                             "default": getVal(default_settings, key, 0)}
-        for key in flag_settings:
-            _key = '{}'.format(key).replace(" ", "_")
-            if _key in settings:
-                settings[_key]['value'] = getVal(flag_settings, key, 0)
-            else:
-                settings[_key] = {'value': getVal(flag_settings, key, 0), "unit": "", "default": ""}
-        return settings
+        results = self.executeMany(["QDI", "QPIRI", "QFLAG"], typed)
+        return buildSettings(results["QDI"], results["QPIRI"], results["QFLAG"])
@@ -1,5 +1,6 @@
 # This is a custom 1-1 character map for dealing with Python2->3's unicode-related transition.
 # There's probably a better way of handling this, but I don't know it.
+# The library no longer uses it (frames are handled as bytes), it is kept for programs that register it.
 
 import codecs
 
@@ -76,7 +76,7 @@ setup(
     # your project is installed. For an analysis of "install_requires" vs pip's
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
-    install_requires=['pyserial'],
+    install_requires=['pyserial', 'futures; python_version < "3"'],
 
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
@@ -85,6 +85,7 @@ setup(
     extras_require={
         'dev': ['check-manifest'],
         'test': ['coverage'],
+        'batch': ['numpy'],
     },
 
     # To provide executable scripts, use entry points in preference to the
@@ -94,6 +95,8 @@ setup(
         'console_scripts': [
             'mpp-solar=mppsolar:main',
             'mpp-info-pub=mppsolar.mpp_info_pub:main',
+            'mpp-solar-sim=mppsolar.mppsimulator:main',
+            'mpp-solar-mux=mppsolar.mppmux:main',
         ],
     },
 
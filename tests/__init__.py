@@ -1,15 +1,53 @@
 # __init__ file
+import sys
 import unittest
 
 
 def get_tests():
 
+    from .test_entrypoints import test_entrypoints
+    from .test_mpp_info_pub import test_mpp_info_pub
+    from .test_mppbatch import test_mppbatch
+    from .test_mppcapture import test_mppcapture
     from .test_mppcommand import test_mppcommand
+    from .test_mppconnection import test_mppconnection
+    from .test_mppcrc import test_mppcrc
+    from .test_mppdecoder import test_mppdecoder
+    from .test_mppframe import test_mppframe
     from .test_mppinverter import test_mppinverter
+    from .test_mppmux import test_mppmux
+    from .test_mpppublish import test_mpppublish
+    from .test_mppregistry import test_mppregistry
+    from .test_mppretry import test_mppretry
+    from .test_mppsample import test_mppsample
+    from .test_mppscheduler import test_mppscheduler
+    from .test_mppsimulator import test_mppsimulator
     from .test_mpputils import test_mpputils
 
+    entrypoints = unittest.TestLoader().loadTestsFromTestCase(test_entrypoints)
+    mpp_info_pub = unittest.TestLoader().loadTestsFromTestCase(test_mpp_info_pub)
+    mppbatch = unittest.TestLoader().loadTestsFromTestCase(test_mppbatch)
+    mppcapture = unittest.TestLoader().loadTestsFromTestCase(test_mppcapture)
     mppcommand = unittest.TestLoader().loadTestsFromTestCase(test_mppcommand)
+    mppconnection = unittest.TestLoader().loadTestsFromTestCase(test_mppconnection)
+    mppcrc = unittest.TestLoader().loadTestsFromTestCase(test_mppcrc)
+    mppdecoder = unittest.TestLoader().loadTestsFromTestCase(test_mppdecoder)
+    mppframe = unittest.TestLoader().loadTestsFromTestCase(test_mppframe)
     mppinverter = unittest.TestLoader().loadTestsFromTestCase(test_mppinverter)
+    mppmux = unittest.TestLoader().loadTestsFromTestCase(test_mppmux)
+    mpppublish = unittest.TestLoader().loadTestsFromTestCase(test_mpppublish)
+    mppregistry = unittest.TestLoader().loadTestsFromTestCase(test_mppregistry)
+    mppretry = unittest.TestLoader().loadTestsFromTestCase(test_mppretry)
+    mppsample = unittest.TestLoader().loadTestsFromTestCase(test_mppsample)
+    mppscheduler = unittest.TestLoader().loadTestsFromTestCase(test_mppscheduler)
+    mppsimulator = unittest.TestLoader().loadTestsFromTestCase(test_mppsimulator)
     mpputils = unittest.TestLoader().loadTestsFromTestCase(test_mpputils)
 
-    return unittest.TestSuite([mppcommand, mppinverter, mpputils])
+    suites = [entrypoints, mpp_info_pub, mppbatch, mppcapture, mppcommand, mppconnection, mppcrc, mppdecoder, mppframe, mppinverter, mppmux, mpppublish, mppregistry, mppretry, mppsample, mppscheduler, mppsimulator, mpputils]
+
+    # asyncio support is python3 only
+    if sys.version_info[0] >= 3:
+        from .test_mppasync import test_mppasync
+        suites.append(unittest.TestLoader().loadTestsFromTestCase(test_mppasync))
+
+    return unittest.TestSuite(suites)
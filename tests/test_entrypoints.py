@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Report the modules imported once the entry point has finished (or exited)
+REPORT_MODULES = "import atexit, sys; atexit.register(lambda: sys.stderr.write('MODULES ' + ' '.join(sys.modules)))"
+
+
+def imported_modules(code):
+    """
+    Runs code in a fresh interpreter and returns the modules it imported
+    """
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(HERE))
+    process = subprocess.Popen([sys.executable, '-c', REPORT_MODULES + '; ' + code],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+    _, err = process.communicate()
+    return err.decode('utf-8').split('MODULES ')[-1].split()
+
+
+class test_entrypoints(unittest.TestCase):
+    def test_mpp_solar_help(self):
+        """ mpp-solar -h should not load the inverter libraries """
+        modules = imported_modules("from mppsolar import main; sys.argv = ['mpp-solar', '-h']; main()")
+        self.assertIn('argparse', modules)
+        for module in ['serial', 'mppsolar.mppinverter', 'mppsolar.mppregistry']:
+            self.assertNotIn(module, modules)
+
+    def test_mpp_info_pub_help(self):
+        """ mpp-info-pub -h should not load paho or the inverter libraries """
+        modules = imported_modules("from mppsolar.mpp_info_pub import main; sys.argv = ['mpp-info-pub', '-h']; main()")
+        for module in ['paho.mqtt.client', 'serial', 'mppsolar.mppinverter']:
+            self.assertNotIn(module, modules)
+
+    def test_mpp_solar_list(self):
+        """ mpp-solar -l should only need the command registry """
+        modules = imported_modules("from mppsolar import main; sys.argv = ['mpp-solar', '-l']; main()")
+        self.assertIn('mppsolar.mppregistry', modules)
+        for module in ['serial', 'mppsolar.mppinverter', 'mppsolar.mppscheduler', 'mppsolar.one_to_one_codec']:
+            self.assertNotIn(module, modules)
+
+    def test_mpputils_export(self):
+        """ mppUtils should be importable from the package """
+        from mppsolar import mppUtils
+        from mppsolar import mpputils
+        self.assertIs(mppUtils, mpputils.mppUtils)
@@ -0,0 +1,60 @@
+import unittest
+from mppsolar.mpp_info_pub import MPPSolarMain
+from mppsolar.mppregistry import getCommandRegistry
+
+
+class test_mpp_info_pub(unittest.TestCase):
+    def test_payloads(self):
+        """ typed values should be published as text """
+        self.assertEqual(MPPSolarMain.toPayload(57.5), '57.5')
+        self.assertEqual(MPPSolarMain.toPayload('01'), '01')
+        self.assertEqual(MPPSolarMain.toPayload('01', conform=True), '1')
+        self.assertEqual(MPPSolarMain.toPayload(True), '1')
+        self.assertEqual(MPPSolarMain.toPayload(False), '0')
+        self.assertEqual(MPPSolarMain.toPayload(True, enflag=True), 'enabled')
+        self.assertEqual(MPPSolarMain.toPayload(False, enflag=True), 'disabled')
+        self.assertEqual(MPPSolarMain.toPayload(None, enflag=True), 'unknown')
+
+    def test_qflag_settings(self):
+        """ the QFLAG settings should be published as enabled / disabled """
+        command, _ = getCommandRegistry().find('QFLAG')
+        request = command.createRequest()
+        request.setResponse(command.test_responses[0])
+        text = request.getSample().toStatus()
+        typed = request.getSample(typed=True).toStatus()
+        keys = command.decoder.enflagKeys()
+        self.assertIn('Overload_Bypass', keys)
+        for key in keys:
+            self.assertEqual(MPPSolarMain.toPayload(typed[key]['value'], enflag=True), text[key]['value'])
+
+    def test_payloads_as_before_typed(self):
+        """ typed payloads of the test responses should be the text published before values were typed """
+        def conformNumber(number):
+            # how status values were published before values were typed
+            if number.isdigit():
+                return int(number)
+            if number.find("\t- ") > 0:
+                return number[number.find("- ") + 2:]
+            return number
+
+        for command in getCommandRegistry().commands:
+            if command.response_definition is None:
+                continue
+            for response in command.test_responses:
+                request = command.createRequest()
+                request.setResponse(response)
+                if not request.valid_response:
+                    continue
+                text = request.getSample().toStatus()
+                typed = request.getSample(typed=True).toStatus()
+                enflags = command.decoder.enflagKeys()
+                for key in text:
+                    value = typed[key]['value']
+                    for conform, before in ((True, '{}'.format(conformNumber('{}'.format(text[key]['value'])))),
+                                            (False, '{}'.format(text[key]['value']))):
+                        payload = MPPSolarMain.toPayload(value, key in enflags, conform)
+                        if isinstance(value, (int, float)) and not isinstance(value, bool):
+                            # numbers are published as decoded from their field type, e.g. 057.50 as 57.5
+                            self.assertEqual(float(payload), float(before), (command.name, key))
+                        else:
+                            self.assertEqual(payload, before, (command.name, key))
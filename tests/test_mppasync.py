@@ -0,0 +1,145 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+from mppsolar import mppasync
+from mppsolar import mppcapture
+from mppsolar import mppcommand
+from .test_mppconnection import fake_hidraw
+
+
+def run_in_new_loop(coro):
+    """ asyncio.run is python 3.7+, the asyncio inverter supports 3.6 """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class test_mppasync(unittest.TestCase):
+    def test_execute_test_device(self):
+        """ test execute of a query (TEST connection) """
+        inverter = mppasync.AsyncMppInverter('TEST')
+        command = run_in_new_loop(inverter.execute('QPI'))
+        self.assertIsInstance(command, mppcommand.mppCommandRequest)
+        self.assertTrue(command.valid_response)
+
+    def test_execute_invalid_cmd(self):
+        """ test execute of INVALID command (TEST connection) - should return None """
+        inverter = mppasync.AsyncMppInverter('TEST')
+        self.assertIsNone(run_in_new_loop(inverter.execute('INVALID99')))
+
+    def test_concurrent_execute_other_loops(self):
+        """ commands to one inverter (created outside the loop) should queue up in each loop that runs them """
+        inverter = mppasync.AsyncMppInverter('TEST')
+        execute = inverter._execute
+
+        async def slow_execute(cmd, found):
+            await asyncio.sleep(0.01)
+            return await execute(cmd, found)
+
+        inverter._execute = slow_execute
+
+        async def run():
+            return await asyncio.gather(inverter.execute('QPI'), inverter.execute('QID'))
+
+        for _ in range(2):
+            commands = run_in_new_loop(run())
+            self.assertEqual([command.name for command in commands], ['QPI', 'QID'])
+        # and inverters can still be created once a loop running commands has closed
+        self.assertTrue(run_in_new_loop(mppasync.AsyncMppInverter('TEST').execute('QPI')).valid_response)
+
+    def test_utils_full_status(self):
+        """ test full status and settings from AsyncMppUtils """
+        utils = mppasync.AsyncMppUtils('TEST')
+        self.assertEqual(run_in_new_loop(utils.getSerialNumber()), '9293333010501')
+        self.assertIsInstance(run_in_new_loop(utils.getFullStatus()), dict)
+        self.assertIsInstance(run_in_new_loop(utils.getSettings()), dict)
+
+    def test_gather_full_status(self):
+        """ test polling several devices from one event loop """
+        utils = [mppasync.AsyncMppUtils('TEST') for _ in range(3)]
+        statuses = run_in_new_loop(mppasync.gatherFullStatus(utils, queries='QPIGS'))
+        self.assertEqual(len(statuses), 3)
+        self.assertIn('battery_voltage', statuses[0])
+
+    def test_hidraw_devices_concurrent(self):
+        """ several hidraw devices should be queried concurrently """
+        devices = [fake_hidraw(b'(PI30\x9a\x0b\r') for _ in range(3)]
+        inverters = [mppasync.AsyncMppInverter(device) for _, _, device in devices]
+        for inverter in inverters:
+            inverter._connection = mppasync.asyncHidrawConnection(inverter._serial_device,
+                                                                  pacing=mppasync.PACING_FIXED)
+
+        async def run():
+            return await asyncio.gather(*[inverter.execute('QPI') for inverter in inverters])
+
+        try:
+            start = time.time()
+            commands = run_in_new_loop(run())
+            elapsed = time.time() - start
+        finally:
+            for master, slave, _ in devices:
+                os.close(master)
+                os.close(slave)
+        for command in commands:
+            self.assertEqual(command.getResponse(), '(PI30\x9a\x0b\r')
+        # each command takes one fixed 0.35s write delay, run serially they would take over 1s
+        self.assertLess(elapsed, 1)
+
+    def test_serial_device(self):
+        """ test execute over a (pty) serial port """
+        master, slave, device = fake_hidraw(b'(PI30\x9a\x0b\r')
+        inverter = mppasync.AsyncMppInverter(device)
+        inverter._connection = mppasync.asyncSerialConnection(device)
+        try:
+            command = run_in_new_loop(inverter.execute('QPI'))
+        finally:
+            inverter.close()
+            os.close(master)
+            os.close(slave)
+        self.assertEqual(command.getResponse(), '(PI30\x9a\x0b\r')
+
+    def test_record_replay(self):
+        """ a capture recorded by the asyncio inverter should replay """
+        master, slave, device = fake_hidraw(b'(PI30\x9a\x0b\r')
+        capture_file = os.path.join(tempfile.mkdtemp(), 'inverter.cap')
+        inverter = mppasync.AsyncMppInverter(device, record=capture_file)
+        try:
+            run_in_new_loop(inverter.execute('QPI'))
+        finally:
+            inverter.close()
+            os.close(master)
+            os.close(slave)
+        inverter = mppasync.AsyncMppInverter(mppcapture.REPLAY_PREFIX + capture_file, replay_speed=0)
+        command = run_in_new_loop(inverter.execute('QPI'))
+        self.assertEqual(command.getResponse(), '(PI30\x9a\x0b\r')
+
+    def test_no_blocking_inverter(self):
+        """ the asyncio inverter should not start a blocking inverter's worker thread """
+        threads = threading.active_count()
+        inverter = mppasync.AsyncMppInverter('TEST')
+        self.assertEqual(threading.active_count(), threads)
+        self.assertIn('Inverter connected as a TEST', str(inverter))
+        self.assertIs(inverter.getAllCommands(), inverter._registry.commands)
+
+    def test_fd_connection_default_open(self):
+        """ the base fd connection should open the device node itself """
+        master, slave, device = fake_hidraw(b'(PI30\x9a\x0b\r')
+        connection = mppasync.asyncFdConnection(device)
+
+        async def run():
+            connection.open()
+            await connection._writeAll(b'QPI\xbe\xac\x0d')
+            return await connection._readResponse(5)
+
+        try:
+            response = run_in_new_loop(run())
+        finally:
+            connection.close()
+            os.close(master)
+            os.close(slave)
+        self.assertEqual(response, b'(PI30\x9a\x0b\r')
@@ -0,0 +1,84 @@
+import unittest
+from mppsolar.mppcommand import get_full_command
+from mppsolar.mppregistry import getCommandRegistry
+
+try:
+    import numpy
+    from mppsolar import mppbatch
+except ImportError:
+    numpy = None
+
+QPIGS = b'(000.0 00.0 230.0 49.9 0161 0119 003 460 57.50 012 100 0069 0014 103.8 57.45 00000 00110110 00 00 00856 010'
+QPGS = (b'(1 92931701100510 B 00 000.0 00.00 230.0 50.00 0230 0184 004 51.3 000 100 000.0 000 00230 00184 004 '
+        b'10100010 1 2 060 120 030 00 000')
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class test_mppbatch(unittest.TestCase):
+    def assertColumnsMatch(self, command, frames, columns):
+        """ each valid frame should decode (live, typed) to the same values as its row of the columns """
+        for row, frame in enumerate(frames):
+            request = command.createRequest()
+            request.setResponse(frame)
+            for key, value in request.getSample(typed=True).items():
+                if key != 'unknown_value_in_response':
+                    self.assertEqual(columns[key][row], value, key)
+
+    def test_qpigs(self):
+        """ batch decoding should give typed columns matching the live decoder """
+        command, _ = getCommandRegistry().find('QPIGS')
+        frames = [get_full_command(QPIGS), get_full_command(QPIGS.replace(b'57.50', b'51.25') + b' 42')]
+        valid, columns = mppbatch.mppBatchDecoder(command).decode(frames)
+        self.assertListEqual(valid.tolist(), [True, True])
+        self.assertEqual(columns['battery_voltage'].tolist(), [57.5, 51.25])
+        self.assertEqual(columns['ac_output_apparent_power'].dtype.kind, 'i')
+        self.assertEqual(columns['is_load_on'].dtype, bool)
+        self.assertNotIn('unknown_value_in_response', columns)
+        self.assertColumnsMatch(command, frames, columns)
+
+    def test_qpgs(self):
+        """ options, keyed values and flag pairs should decode as the live decoder does """
+        command, _ = getCommandRegistry().find('QPGS0')
+        frames = [get_full_command(QPGS), get_full_command(QPGS.replace(b' B 00 ', b' L 03 '))]
+        valid, columns = mppbatch.mppBatchDecoder(command).decode(frames)
+        self.assertTrue(valid.all())
+        self.assertEqual(columns['work_mode'].tolist(), ['Battery Mode', 'Line Mode'])
+        self.assertEqual(columns['scc_ok'].tolist(), [True, True])
+        self.assertColumnsMatch(command, frames, columns)
+
+    def test_unknown_option(self):
+        """ a value the definition does not list should be kept as sent, not fail the batch """
+        command, _ = getCommandRegistry().find('QPGS0')
+        frames = [get_full_command(QPGS), get_full_command(QPGS.replace(b' B 00 ', b' Z 00 '))]
+        valid, columns = mppbatch.mppBatchDecoder(command).decode(frames)
+        self.assertTrue(valid.all())
+        self.assertEqual(columns['work_mode'].tolist(), ['Battery Mode', 'Z'])
+        self.assertEqual(columns['scc_ok'].tolist(), [True, True])
+        self.assertColumnsMatch(command, frames, columns)
+
+    def test_invalid_frames(self):
+        """ frames with a bad CRC or too few values should be left out """
+        command, _ = getCommandRegistry().find('QPIGS')
+        good = get_full_command(QPIGS)
+        frames = [good, good[:-2] + b'x\r', get_full_command(QPIGS[:50]), b'(\r', good]
+        valid, columns = mppbatch.mppBatchDecoder(command).decode(frames)
+        self.assertListEqual(valid.tolist(), [True, False, False, False, True])
+        self.assertEqual(len(columns['ac_output_voltage']), 2)
+
+    def test_space_in_crc(self):
+        """ a CRC byte that is a space should not count as a value, live or batch """
+        command, _ = getCommandRegistry().find('QDI')
+        frame = get_full_command(b'(230.0 50.0 0024 42.0 54.0 56.4 46.0 60 0 0 2 0 0 0 0 0 1 1 0 0 1 0 54.0 0 1 000')
+        self.assertEqual(frame[-3:-2], b' ')
+        self.assertFalse(command.isResponseValid(frame))
+        valid, _ = mppbatch.mppBatchDecoder(command).decode([frame])
+        self.assertListEqual(valid.tolist(), [False])
+
+    def test_not_a_number(self):
+        """ values that are not numbers should be nan """
+        command, _ = getCommandRegistry().find('QPIGS')
+        frames = [get_full_command(QPIGS.replace(b'000.0', b'--.-', 1)), get_full_command(QPIGS)]
+        valid, columns = mppbatch.mppBatchDecoder(command).decode(frames)
+        self.assertTrue(numpy.isnan(columns['ac_input_voltage'][0]))
+        self.assertEqual(columns['ac_input_voltage'][1], 0.0)
+        self.assertEqual(columns['ac_input_frequency'].tolist(), [0.0, 0.0])
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import time
+import unittest
+from mppsolar import mppcapture
+from mppsolar import mppinverter
+from mppsolar import mppsimulator
+
+
+def record(capture_file, cmds, latency=0.0):
+    """
+    Records the supplied commands against the simulated inverter, returns the responses (bytes)
+    """
+    with mppsimulator.mppSimulator(latency=latency) as simulator:
+        with mppinverter.mppInverter(simulator.device, record=capture_file) as inverter:
+            return [inverter.execute(cmd).response for cmd in cmds]
+
+
+class test_mppcapture(unittest.TestCase):
+    def setUp(self):
+        self.capture_file = os.path.join(tempfile.mkdtemp(), 'inverter.cap')
+
+    def test_record(self):
+        """ every frame sent and received should be in the capture """
+        responses = record(self.capture_file, ['QPI', 'QPIGS'])
+        frames = mppcapture.readCapture(self.capture_file)
+        self.assertEqual([direction for direction, _, _ in frames], [0, 1, 0, 1])
+        self.assertEqual(frames[0][2], b'QPI\xbe\xac\r')
+        self.assertEqual(frames[3][2], responses[1])
+        offsets = [offset for _, offset, _ in frames]
+        self.assertEqual(offsets, sorted(offsets))
+
+    def test_record_across_close(self):
+        """ closing the connection should close the capture, a later command should add to it """
+        with mppsimulator.mppSimulator() as simulator:
+            with mppinverter.mppInverter(simulator.device, record=self.capture_file) as inverter:
+                inverter.execute('QPI')
+                inverter.close()
+                self.assertIsNone(inverter._connection._writer._file)
+                inverter.execute('QPIGS')
+        frames = mppcapture.readCapture(self.capture_file)
+        self.assertEqual([direction for direction, _, _ in frames], [0, 1, 0, 1])
+        self.assertEqual(frames[2][2][:5], b'QPIGS')
+
+    def test_replay(self):
+        """ replay should serve the recorded responses """
+        responses = record(self.capture_file, ['QPI', 'QPIGS', 'QPIGS'])
+        with mppinverter.mppInverter(mppcapture.REPLAY_PREFIX + self.capture_file, replay_speed=0) as inverter:
+            self.assertEqual(inverter.execute('QPIGS').response, responses[1])
+            self.assertEqual(inverter.execute('QPIGS').response, responses[2])
+            self.assertTrue(inverter.execute('QPIGS').getResponse() is None)
+
+    def test_replay_speed(self):
+        """ replay should keep the recorded gaps between responses, divided by the speed """
+        record(self.capture_file, ['QPI', 'QPI', 'QPI'], latency=0.2)
+        connection = mppcapture.mppReplayConnection(self.capture_file, speed=2)
+        start = time.time()
+        for _ in range(3):
+            connection.query(b'QPI\xbe\xac\r')
+        elapsed = time.time() - start
+        self.assertGreater(elapsed, 0.18)
+        self.assertLess(elapsed, 0.4)
+        self.assertEqual(connection.remaining(), 0)
+
+    def test_replay_skips(self):
+        """ replay should skip recorded commands that are not asked for """
+        responses = record(self.capture_file, ['QPI', 'QID', 'QPIGS'])
+        connection = mppcapture.mppReplayConnection(self.capture_file, speed=0)
+        self.assertTrue(connection.query(b'QMOD\x49\xc1\r') is None)
+        self.assertEqual(connection.remaining(), 3)
+        self.assertEqual(connection.query(b'QPIGS\xb7\xa9\r'), responses[2])
+        self.assertEqual(connection.remaining(), 0)
+
+    def test_truncated_capture(self):
+        """ a capture cut short should keep its complete records """
+        record(self.capture_file, ['QPI', 'QPIGS'])
+        with open(self.capture_file, 'rb') as f:
+            data = f.read()
+        with open(self.capture_file, 'wb') as f:
+            f.write(data[:-5])
+        self.assertEqual(len(mppcapture.readCapture(self.capture_file)), 3)
+
+    def test_not_a_capture(self):
+        """ other files should be refused """
+        with open(self.capture_file, 'wb') as f:
+            f.write(b'QPIGS\r')
+        self.assertRaises(ValueError, mppcapture.readCapture, self.capture_file)
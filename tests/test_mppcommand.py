@@ -2,6 +2,13 @@ import unittest
 from mppsolar import mppcommand
 
 
+class brokenCommand(mppcommand.mppCommand):
+    """ a command whose responses cannot be decoded """
+
+    def decodeSample(self, response, typed=False):
+        raise KeyError('Se5')
+
+
 class test_mppcommand(unittest.TestCase):
     def test_crc(self):
         """ Test crc function generates correct crc """
@@ -10,3 +17,51 @@ class test_mppcommand(unittest.TestCase):
         self.assertListEqual(mppcommand.crc('PSDV56.4'), [249, 224])
         self.assertListEqual(mppcommand.crc('186'), [41, 60])
         self.assertListEqual(mppcommand.crc('196'), [27, 14])
+
+    def test_command_immutable(self):
+        """ command definitions are shared and should not be changed """
+        command = mppcommand.mppCommand('PCP', 'Set charging priority', 'SETTER', None, regex=None)
+        self.assertRaises(AttributeError, setattr, command, 'name', 'POP')
+
+    def test_request(self):
+        """ requests should carry their own value, full command and response """
+        command = mppcommand.mppCommand('PCP', 'Set charging priority', 'SETTER', None, regex=None)
+        request1 = command.createRequest('01')
+        request2 = command.createRequest('02')
+        self.assertEqual(request1.full_command, b'PCP01\x9d[\r')
+        self.assertEqual(request2.full_command, b'PCP02\xad8\r')
+        self.assertEqual(request1.name, 'PCP')
+        request1.setResponse('(ACK9 \r')
+        self.assertTrue(request1.valid_response)
+        self.assertFalse(request2.valid_response)
+        self.assertIsNone(request2.getResponse())
+        self.assertRaises(AttributeError, setattr, request1, 'other', 1)
+
+    def test_full_command_memoized(self):
+        """ the full command for a value should be built once """
+        command = mppcommand.mppCommand('PCP', 'Set charging priority', 'SETTER', None, regex=None)
+        self.assertIs(command.getFullCommand('01'), command.createRequest('01').full_command)
+        self.assertEqual(command.getFullCommand(), command.full_command)
+
+    def test_response_bytes(self):
+        """ responses are kept as bytes, text only at the edge """
+        command = mppcommand.mppCommand('QPI', 'Device Protocol ID Inquiry', 'QUERY',
+                                        [['string', 'Protocol ID', '']], regex=None)
+        self.assertTrue(mppcommand.isCrcValid(b'(PI30\x9a\x0b\r'))
+        self.assertTrue(mppcommand.isCrcValid('(PI30\x9a\x0b\r'))
+        self.assertFalse(mppcommand.isCrcValid(b'(PI31\x9a\x0b\r'))
+        request = command.createRequest()
+        request.setResponse(b'(PI30\x9a\x0b\r')
+        self.assertTrue(request.valid_response)
+        self.assertEqual(request.response, b'(PI30\x9a\x0b\r')
+        self.assertEqual(request.getResponse(), '(PI30\x9a\x0b\r')
+        self.assertEqual(request.getResponseDict(), {'protocol_id': ['PI30', '']})
+
+    def test_decode_error(self):
+        """ a response that cannot be decoded should lose only this command's values """
+        command = brokenCommand('QPI', 'Device Protocol ID Inquiry', 'QUERY', [['string', 'Protocol ID', '']], regex=None)
+        request = command.createRequest()
+        request.setResponse(b'(PI30\x9a\x0b\r')
+        self.assertTrue(request.valid_response)
+        self.assertIsNone(request.getSample(typed=True))
+        self.assertDictEqual(request.getResponseDict(), {})
@@ -0,0 +1,274 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import tty
+import unittest
+from mppsolar import mppconnection
+from mppsolar import mppinverter
+
+
+def fake_hidraw(response):
+    """
+    Opens a raw pty to stand in for a hidraw device
+    - a thread answers the first complete command with the supplied response
+    """
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    device = os.ttyname(slave)
+
+    def respond():
+        request = b''
+        while not request.endswith(b'\r'):
+            request += os.read(master, 64)
+        os.write(master, response)
+
+    thread = threading.Thread(target=respond)
+    # left waiting if the test fails before sending a command
+    thread.daemon = True
+    thread.start()
+    return master, slave, device
+
+
+class test_mppconnection(unittest.TestCase):
+    def setUp(self):
+        # learned pacing goes to a cache directory of the test's own
+        self._cache_home = os.environ.get('XDG_CACHE_HOME')
+        self._cache_dir = tempfile.mkdtemp()
+        os.environ['XDG_CACHE_HOME'] = self._cache_dir
+
+    def tearDown(self):
+        if self._cache_home is None:
+            del os.environ['XDG_CACHE_HOME']
+        else:
+            os.environ['XDG_CACHE_HOME'] = self._cache_home
+        shutil.rmtree(self._cache_dir)
+
+    def test_serial_connection_reused(self):
+        """ serial port should stay open across commands """
+        connection = mppconnection.mppSerialConnection('loop://')
+        self.assertFalse(connection.isOpen())
+        connection.query(b'QPI\x0d')
+        port = connection.open()
+        connection.query(b'QPI\x0d')
+        self.assertTrue(connection.isOpen())
+        self.assertIs(connection.open(), port)
+
+    def test_serial_connection_close(self):
+        """ close should release the port, next query reopens it """
+        connection = mppconnection.mppSerialConnection('loop://')
+        connection.query(b'QPI\x0d')
+        connection.close()
+        self.assertFalse(connection.isOpen())
+        connection.query(b'QPI\x0d')
+        self.assertTrue(connection.isOpen())
+
+    def test_serial_connection_terminator(self):
+        """ serial read should return as soon as the terminator arrives """
+        connection = mppconnection.mppSerialConnection('loop://', timeout=5)
+        start = time.time()
+        self.assertEqual(connection.query(b'QPI\xbe\xac\x0d'), b'QPI\xbe\xac\x0d')
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_serial_connection_expected_length(self):
+        """ serial read should stop at the expected length if the terminator does not arrive """
+        connection = mppconnection.mppSerialConnection('loop://', timeout=5)
+        start = time.time()
+        self.assertEqual(connection.query(b'QPIGS\xb7\xa9', 5), b'QPIGS')
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_serial_connection_stale_data(self):
+        """ a late answer to an earlier command should not be read as the response """
+        connection = mppconnection.mppSerialConnection('loop://', timeout=5)
+        connection.open().write(b'(PI30\x9a\x0b\r(230.0 2')
+        self.assertEqual(connection.query(b'QPI\xbe\xac\x0d'), b'QPI\xbe\xac\x0d')
+
+    def test_serial_connection_timeout(self):
+        """ serial command should be retried on timeout within the overall deadline """
+        master, slave = os.openpty()
+        requests = []
+
+        def listen():
+            try:
+                while True:
+                    requests.append(os.read(master, 64))
+            except OSError:
+                pass
+
+        thread = threading.Thread(target=listen)
+        thread.daemon = True
+        thread.start()
+        connection = mppconnection.mppSerialConnection(os.ttyname(slave), timeout=3.5)
+        try:
+            start = time.time()
+            self.assertIsNone(connection.query(b'QPI\xbe\xac\x0d'))
+            elapsed = time.time() - start
+        finally:
+            connection.close()
+            os.close(slave)
+            os.close(master)
+        self.assertGreaterEqual(elapsed, 3.4)
+        self.assertLess(elapsed, 4)
+        self.assertEqual(b''.join(requests).count(b'\r'), 3)
+
+    def test_serial_connection_not_reconfigured(self):
+        """ reading a response in pieces should not reconfigure the port for each read """
+        master, slave = os.openpty()
+        tty.setraw(slave)
+
+        def respond():
+            request = b''
+            while not request.endswith(b'\r'):
+                request += os.read(master, 64)
+            for piece in (b'(PI', b'30', b'\x9a\x0b\r'):
+                os.write(master, piece)
+                time.sleep(0.05)
+
+        thread = threading.Thread(target=respond)
+        thread.daemon = True
+        thread.start()
+        connection = mppconnection.mppSerialConnection(os.ttyname(slave))
+        port = connection.open()
+        reconfigure = port._reconfigure_port
+        reconfigured = []
+
+        def count(*args, **kwargs):
+            reconfigured.append(args)
+            return reconfigure(*args, **kwargs)
+
+        port._reconfigure_port = count
+        try:
+            self.assertEqual(connection.query(b'QPI\xbe\xac\x0d'), b'(PI30\x9a\x0b\r')
+        finally:
+            connection.close()
+            os.close(slave)
+            os.close(master)
+        # only for the write timeout of the one attempt
+        self.assertEqual(len(reconfigured), 1)
+
+    def test_serial_connection_io_error(self):
+        """ an I/O error should close the port and return None """
+        connection = mppconnection.mppSerialConnection('/dev/ttyDOESNOTEXIST')
+        self.assertIsNone(connection.query(b'QPI\x0d'))
+        self.assertFalse(connection.isOpen())
+
+    def test_inverter_close(self):
+        """ inverter should own and close its serial connection """
+        with mppinverter.mppInverter('loop://') as inverter:
+            inverter._connection.open()
+            self.assertTrue(inverter._connection.isOpen())
+        self.assertFalse(inverter._connection.isOpen())
+
+    def test_hidraw_connection_response(self):
+        """ hidraw read should return as soon as the terminator arrives """
+        master, slave, device = fake_hidraw(b'(PI30\x9a\x0b\rtrailing')
+        connection = mppconnection.mppHidrawConnection(device, timeout=5)
+        try:
+            start = time.time()
+            response = connection.query(b'QPI\xbe\xac\x0d')
+            self.assertEqual(response, b'(PI30\x9a\x0b\r')
+            self.assertLess(time.time() - start, 2)
+            self.assertTrue(connection.isOpen())
+        finally:
+            connection.close()
+            os.close(master)
+            os.close(slave)
+        self.assertFalse(connection.isOpen())
+
+    def test_hidraw_connection_timeout(self):
+        """ hidraw read should give up at the deadline """
+        master, slave, device = fake_hidraw(b'(PI30')
+        connection = mppconnection.mppHidrawConnection(device, timeout=0.5)
+        try:
+            self.assertEqual(connection.query(b'QPI\xbe\xac\x0d'), b'(PI30')
+        finally:
+            connection.close()
+            os.close(master)
+            os.close(slave)
+
+    def test_fixed_pacing(self):
+        """ fixed pacing should not change on failures """
+        pacer = mppconnection.mppWritePacer(mppconnection.PACING_FIXED)
+        pacer.backoff('test')
+        self.assertEqual(pacer.delay, mppconnection.FIXED_CHUNK_DELAY)
+
+    def test_adaptive_pacing(self):
+        """ adaptive pacing should back off on failure and not soon speed up past a failed delay """
+        pacer = mppconnection.mppWritePacer(mppconnection.PACING_ADAPTIVE)
+        self.assertLess(pacer.delay, mppconnection.FIXED_CHUNK_DELAY)
+        failed = pacer.delay
+        pacer.backoff('test')
+        self.assertGreater(pacer.delay, failed)
+        for _ in range(mppconnection.ADAPTIVE_FLOOR_DECAY_AFTER - 1):
+            pacer.success()
+        self.assertGreater(pacer.delay, failed)
+        for _ in range(20):
+            pacer.backoff('test')
+        self.assertEqual(pacer.delay, mppconnection.FIXED_CHUNK_DELAY)
+
+    def test_pacing_remembered_per_device(self):
+        """ the learned delay should be shared by connections to the same device """
+        first = mppconnection.mppHidrawConnection('/dev/hidraw8', pacing=mppconnection.PACING_ADAPTIVE)
+        first.reportResponse(False)
+        second = mppconnection.mppHidrawConnection('/dev/hidraw8', pacing=mppconnection.PACING_ADAPTIVE)
+        self.assertIs(first._pacer, second._pacer)
+        other = mppconnection.mppHidrawConnection('/dev/hidraw7', pacing=mppconnection.PACING_ADAPTIVE)
+        self.assertLess(other._pacer.delay, second._pacer.delay)
+
+    def test_pacing_kept_across_processes(self):
+        """ the learned delay should be picked up by a later process (pacing file) """
+        pacing_file = os.path.join(self._cache_dir, 'mpp-solar', mppconnection.PACING_FILE_NAME)
+        pacer = mppconnection.mppWritePacer(mppconnection.PACING_ADAPTIVE, '/dev/hidraw8', pacing_file)
+        pacer.backoff('test')
+        pacer.backoff('test')
+        learned = mppconnection.mppWritePacer(mppconnection.PACING_ADAPTIVE, '/dev/hidraw8', pacing_file)
+        self.assertEqual(learned.delay, pacer.delay)
+        # the delay that failed is not kept, the learned delay may speed up again
+        self.assertEqual(learned._floor, 0)
+        other = mppconnection.mppWritePacer(mppconnection.PACING_ADAPTIVE, '/dev/hidraw7', pacing_file)
+        self.assertEqual(other.delay, mppconnection.ADAPTIVE_INITIAL_DELAY)
+        # a process using the default pacing file
+        mppconnection._write_pacers.pop('/dev/hidraw8', None)
+        self.assertEqual(mppconnection.getPacingFile(), pacing_file)
+        self.assertEqual(mppconnection.getWritePacer('/dev/hidraw8', mppconnection.PACING_ADAPTIVE).delay, pacer.delay)
+
+    def test_unreadable_pacing_file(self):
+        """ an unreadable pacing file should be ignored """
+        pacing_file = os.path.join(self._cache_dir, mppconnection.PACING_FILE_NAME)
+        with open(pacing_file, 'w') as f:
+            f.write('{"/dev/hidraw8": [0.1')
+        pacer = mppconnection.mppWritePacer(mppconnection.PACING_ADAPTIVE, '/dev/hidraw8', pacing_file)
+        self.assertEqual(pacer.delay, mppconnection.ADAPTIVE_INITIAL_DELAY)
+        pacer.backoff('test')
+        self.assertEqual(mppconnection.loadPacing(pacing_file), {'/dev/hidraw8': pacer.delay})
+
+    def test_old_pacing_file(self):
+        """ a pacing file written as [delay, floor] should still give the delay """
+        pacing_file = os.path.join(self._cache_dir, mppconnection.PACING_FILE_NAME)
+        with open(pacing_file, 'w') as f:
+            f.write('{"/dev/hidraw8": [0.1, 0.08]}')
+        pacer = mppconnection.mppWritePacer(mppconnection.PACING_ADAPTIVE, '/dev/hidraw8', pacing_file)
+        self.assertEqual((pacer.delay, pacer._floor), (0.1, 0))
+
+    def test_pacing_recovers(self):
+        """ a run of good commands should forget the delays that failed """
+        pacer = mppconnection.mppWritePacer(mppconnection.PACING_ADAPTIVE)
+        for _ in range(6):
+            pacer.backoff('test')
+        for _ in range(1000):
+            pacer.success()
+        self.assertLess(pacer.delay, mppconnection.ADAPTIVE_BACKOFF_STEP)
+
+    def test_adaptive_hidraw_response(self):
+        """ adaptive pacing should still get the full command through """
+        master, slave, device = fake_hidraw(b'(PI30\x9a\x0b\r')
+        connection = mppconnection.mppHidrawConnection(device, pacing=mppconnection.PACING_ADAPTIVE)
+        try:
+            start = time.time()
+            self.assertEqual(connection.query(b'QPIGS\xb7\xa9\x0d'), b'(PI30\x9a\x0b\r')
+            self.assertLess(time.time() - start, 0.35)
+        finally:
+            connection.close()
+            os.close(master)
+            os.close(slave)
@@ -0,0 +1,29 @@
+import random
+import unittest
+from mppsolar import mppcrc
+
+
+class test_mppcrc(unittest.TestCase):
+    def test_crc16(self):
+        """ crc16 should be CRC-16/XMODEM """
+        self.assertEqual(mppcrc.crc16(b'123456789'), 0x31c3)
+        self.assertEqual(mppcrc.crc16(b''), 0)
+
+    def test_table_matches(self):
+        """ the table driven crc should match the fast path """
+        rand = random.Random(16)
+        for length in range(64):
+            data = bytearray(rand.randint(0, 255) for _ in range(length))
+            self.assertEqual(mppcrc.crc16_table(data), mppcrc.crc16(bytes(data)))
+
+    def test_adjust(self):
+        """ reserved bytes should be incremented """
+        self.assertListEqual(mppcrc.adjust(0x280d), [0x29, 0x0e])
+        self.assertListEqual(mppcrc.adjust(0x0a0b), [0x0b, 0x0b])
+        self.assertListEqual(mppcrc.adjust(0xb7a9), [0xb7, 0xa9])
+
+    def test_crc(self):
+        """ text and bytes should give the same crc """
+        self.assertListEqual(mppcrc.crc('QPIGS'), [183, 169])
+        self.assertListEqual(mppcrc.crc(b'QPIGS'), [183, 169])
+        self.assertListEqual(mppcrc.crc(bytearray(b'QPIRI')), [248, 84])
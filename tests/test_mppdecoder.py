@@ -0,0 +1,79 @@
+import unittest
+from mppsolar import mppdecoder
+
+DEFINITION = [
+    ['float', 'AC Input Voltage', 'V'],
+    ['int', 'Battery Capacity', '%'],
+    ['option', 'Output source priority', ['Utility first', 'Solar first', 'SBU first']],
+    ['keyed', 'Machine type', {'00': 'Grid tie', '01': 'Off Grid', '10': 'Hybrid'}],
+    ['flags', 'Device status', ['is_load_on', 'is_charging_on']],
+    ['stat_flags', 'Warning status', ['Reserved', 'Inverter fault', 'Bus Over']],
+    ['enflags', 'Device Status', {'a': {'name': 'Buzzer', 'state': 'disabled'},
+                                  'b': {'name': 'Overload Bypass', 'state': 'disabled'}}],
+]
+
+
+class test_mppdecoder(unittest.TestCase):
+    def test_decode(self):
+        """ decoder should handle each field type """
+        decoder = mppdecoder.mppResponseDecoder('TEST', 'QUERY', DEFINITION)
+        self.assertEqual(len(decoder), len(DEFINITION))
+        msgs = decoder.decode(b'(230.0 085 2 01 10 011 EaDb 42\x00\x00\r')
+        self.assertDictEqual(msgs, {
+            'ac_input_voltage': ['230.0', 'V'],
+            'battery_capacity': ['085', '%'],
+            'output_source_priority': ['SBU first', ''],
+            'machine_type': ['Off Grid', ''],
+            'is_load_on': [1, 'True - 1/False - 0'],
+            'is_charging_on': [0, 'True - 1/False - 0'],
+            'inverter_fault': ['1', ''],
+            'bus_over': ['1', ''],
+            'Buzzer': ['enabled', ''],
+            'Overload Bypass': ['disabled', ''],
+            'unknown_value_in_response': ['42', ''],
+        })
+
+    def test_option_out_of_range(self):
+        """ options past the end of the list should be returned as is """
+        decoder = mppdecoder.mppResponseDecoder('TEST', 'QUERY', DEFINITION[2:3])
+        self.assertDictEqual(decoder.decode(b'(7\x00\x00\r'), {'output_source_priority': ['7', '']})
+
+    def test_unlisted_values(self):
+        """ values the definition does not list should be returned as is, not fail the decoding """
+        decoder = mppdecoder.mppResponseDecoder('TEST', 'QUERY', DEFINITION[2:6])
+        self.assertDictEqual(decoder.decode(b'(Z 11 1x1 0011\x00\x00\r'), {
+            'output_source_priority': ['Z', ''],
+            'machine_type': ['11', ''],
+            'is_load_on': [1, 'True - 1/False - 0'],
+            'is_charging_on': ['x', 'True - 1/False - 0'],
+            'bus_over': ['1', ''],
+        })
+
+    def test_unknown_type(self):
+        """ unknown field types should keep the raw value """
+        definition = [['ack', 'Command execution', {'NAK': 'Failed', 'ACK': 'Successful'}]]
+        query = mppdecoder.mppResponseDecoder('TEST', 'QUERY', definition)
+        setter = mppdecoder.mppResponseDecoder('PCP', 'SETTER', definition)
+        self.assertDictEqual(query.decode(b'(ACK\x00\x00\r'), {0: ['ACK', '']})
+        self.assertDictEqual(setter.decode(b'(ACK\x00\x00\r'), {'PCP': ['ACK', '']})
+
+    def test_decode_typed(self):
+        """ typed decoding should return native values """
+        decoder = mppdecoder.mppResponseDecoder('TEST', 'QUERY', DEFINITION)
+        msgs = decoder.decodeTyped(b'(230.0 085 2 01 10 011 EaDb 42\x00\x00\r')
+        self.assertEqual(msgs['ac_input_voltage'], [230.0, 'V'])
+        self.assertIsInstance(msgs['battery_capacity'][0], int)
+        self.assertEqual(msgs['battery_capacity'][0], 85)
+        self.assertEqual(msgs['output_source_priority'], ['SBU first', ''])
+        self.assertIs(msgs['is_load_on'][0], True)
+        self.assertIs(msgs['is_charging_on'][0], False)
+        self.assertIs(msgs['bus_over'][0], True)
+        self.assertIs(msgs['Buzzer'][0], True)
+        self.assertIs(msgs['Overload Bypass'][0], False)
+        self.assertEqual(msgs['unknown_value_in_response'], ['42', ''])
+
+    def test_decode_typed_not_a_number(self):
+        """ values that are not numbers should be kept as sent """
+        decoder = mppdecoder.mppResponseDecoder('TEST', 'QUERY', DEFINITION[:2])
+        self.assertDictEqual(decoder.decodeTyped(b'(--.- 085\x00\x00\r'),
+                             {'ac_input_voltage': ['--.-', 'V'], 'battery_capacity': [85, '%']})
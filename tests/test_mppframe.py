@@ -0,0 +1,52 @@
+import unittest
+from mppsolar import mppframe
+
+FRAME = b'(PI30\x9a\x0b\r'
+ACK = b'(ACK9 \r'
+
+
+class test_mppframe(unittest.TestCase):
+    def test_chunks(self):
+        """ a frame split over several reads should be returned once complete """
+        parser = mppframe.mppFrameParser()
+        for b in FRAME[:-1]:
+            self.assertEqual(parser.feed(bytes(bytearray([b]))), 0)
+        self.assertIsNone(parser.nextFrame())
+        self.assertEqual(parser.feed(b'\r'), 1)
+        self.assertEqual(parser.nextFrame(), FRAME)
+        self.assertEqual(parser.pending(), 0)
+
+    def test_back_to_back(self):
+        """ several frames in one read should be returned in order, the rest kept """
+        parser = mppframe.mppFrameParser()
+        self.assertEqual(parser.feed(FRAME + ACK + b'(NA'), 2)
+        self.assertEqual(parser.nextFrame(), FRAME)
+        self.assertEqual(parser.nextFrame(), ACK)
+        self.assertIsNone(parser.nextFrame())
+        self.assertEqual(parser.pending(), 3)
+        parser.feed(b'Kss\r')
+        self.assertEqual(parser.nextFrame(), b'(NAKss\r')
+
+    def test_resynchronise(self):
+        """ stray bytes (e.g. the start of a lost frame) before a frame should be discarded """
+        parser = mppframe.mppFrameParser()
+        parser.feed(b'\x00\x01(230.0 2' + FRAME)
+        self.assertEqual(parser.nextFrame(), FRAME)
+        self.assertEqual(parser.discarded, 10)
+
+    def test_bad_crc(self):
+        """ a frame that does not check should still be returned (for the caller to reject) """
+        parser = mppframe.mppFrameParser()
+        parser.feed(b'junk(PI31\x9a\x0b\r')
+        self.assertEqual(parser.nextFrame(), b'(PI31\x9a\x0b\r')
+
+    def test_partial_and_clear(self):
+        """ an incomplete frame can be taken, clear discards everything """
+        parser = mppframe.mppFrameParser()
+        parser.feed(b'(PI30')
+        self.assertEqual(parser.takePartial(3), b'(PI')
+        self.assertEqual(parser.takePartial(), b'30')
+        parser.feed(FRAME + b'(23')
+        self.assertEqual(parser.clear(), len(FRAME) + 3)
+        self.assertEqual(len(parser), 0)
+        self.assertEqual(parser.pending(), 0)
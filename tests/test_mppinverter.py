@@ -1,6 +1,7 @@
 import unittest
 from mppsolar import mppinverter
 from mppsolar import mppcommand
+from mppsolar import mppretry
 
 
 class test_mppinverter(unittest.TestCase):
@@ -76,7 +77,7 @@ class test_mppinverter(unittest.TestCase):
         inverter = mppinverter.mppInverter('TEST')
         command = inverter.execute('PSDV56.4')
         print(command)
-        self.assertIsInstance(command, mppcommand.mppCommand)
+        self.assertIsInstance(command, mppcommand.mppCommandRequest)
 
     def test_execute_invalid_cmd(self):
         """ test execute of INVALID command (TEST connection) - should return None"""
@@ -90,21 +91,29 @@ class test_mppinverter(unittest.TestCase):
         inverter = mppinverter.mppInverter('/dev/ttyUSB0')
         command = inverter.execute('Q1')
         print(command)
-        self.assertIsInstance(command, mppcommand.mppCommand)
+        self.assertIsInstance(command, mppcommand.mppCommandRequest)
 
     def test_execute_qid_usb_cmd(self):
         """ test execute of QID command (Direct USB connection)"""
         inverter = mppinverter.mppInverter('/dev/hidraw1')
         command = inverter.execute('Q1')
         print(command)
-        self.assertIsInstance(command, mppcommand.mppCommand)
+        self.assertIsInstance(command, mppcommand.mppCommandRequest)
+
+    def test_no_response_keeps_pacing(self):
+        """ a device that does not answer (e.g. unplugged) should not slow the write pacing down """
+        inverter = mppinverter.mppInverter('/dev/hidraw6', pacing='adaptive',
+                                           retry_policy=mppretry.mppRetryPolicy(max_attempts=1))
+        delay = inverter._connection._pacer.delay
+        inverter.execute('QPI')
+        self.assertEqual(inverter._connection._pacer.delay, delay)
 
     def test_set_command(self):
         """ Test a setting command """
         inverter = mppinverter.mppInverter('TEST')
         command = inverter.execute('PCVV48.0')
         print(command)
-        self.assertIsInstance(command, mppcommand.mppCommand)
+        self.assertIsInstance(command, mppcommand.mppCommandRequest)
 
     def test_bulk_commands(self):
         """ Test all query commands """
@@ -114,4 +123,18 @@ class test_mppinverter(unittest.TestCase):
             command = inverter.execute(cmd)
             print("Testing: ", cmd)
             print(command)
-            self.assertIsInstance(command, mppcommand.mppCommand)
+            self.assertIsInstance(command, mppcommand.mppCommandRequest)
+
+    def test_execute_many(self):
+        """ test executing several commands back-to-back (TEST connection) """
+        inverter = mppinverter.mppInverter('TEST')
+        commands = inverter.executeMany(['Q1', 'QPIGS', 'INVALID99', 'QMOD', 'QPIWS'])
+        self.assertEqual(len(commands), 5)
+        self.assertIsNone(commands[2])
+        self.assertEqual([c.name for c in commands if c is not None], ['Q1', 'QPIGS', 'QMOD', 'QPIWS'])
+
+    def test_execute_many_shared_definition(self):
+        """ commands sharing a definition should keep their own values """
+        inverter = mppinverter.mppInverter('TEST')
+        commands = inverter.executeMany(['PCP00', 'PCP01'])
+        self.assertEqual([c.value for c in commands], ['00', '01'])
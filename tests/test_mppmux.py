@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+import unittest
+from mppsolar import mppinverter
+from mppsolar import mppmux
+from mppsolar import mppsimulator
+
+
+class test_mppmux(unittest.TestCase):
+    def setUp(self):
+        self.simulator = mppsimulator.mppSimulator(latency=0.2)
+        self.simulator.start()
+        self.multiplexer = mppmux.mppMultiplexer([self.simulator.device])
+        self.address = os.path.join(tempfile.mkdtemp(), 'mux.sock')
+        self.server = mppmux.createServer(self.multiplexer, self.address)
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.thread.start()
+        self.device = 'mux:{}@{}'.format(self.simulator.device, self.address)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.multiplexer.close()
+        self.simulator.stop()
+
+    def test_execute(self):
+        """ commands should reach the device through the multiplexer """
+        with mppinverter.mppInverter(self.device) as inverter:
+            self.assertFalse(inverter._direct_usb)
+            command = inverter.execute('QPIGS')
+        self.assertTrue(command.valid_response)
+        self.assertEqual(self.simulator.requests, 1)
+
+    def test_cache(self):
+        """ identical queries from several clients should be answered from the cache """
+        inverters = [mppinverter.mppInverter(self.device) for _ in range(3)]
+        responses = [inverter.execute('QPIGS').getResponse() for inverter in inverters]
+        for inverter in inverters:
+            inverter.close()
+        self.assertEqual(len(set(responses)), 1)
+        self.assertEqual(self.simulator.requests, 1)
+        self.assertEqual(self.multiplexer.commands_sent, 1)
+
+    def test_concurrent_queries_shared(self):
+        """ identical queries waiting on the device should share one command """
+        results = []
+
+        def query():
+            with mppinverter.mppInverter(self.device) as inverter:
+                results.append(inverter.execute('QID').valid_response)
+
+        threads = [threading.Thread(target=query) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [True] * 4)
+        self.assertEqual(self.simulator.requests, 1)
+
+    def test_setter_clears_cache(self):
+        """ setters should always be sent and clear the cached queries """
+        with mppinverter.mppInverter(self.device) as inverter:
+            inverter.execute('QPIGS')
+            self.assertTrue(inverter.execute('PCP01').valid_response)
+            self.assertTrue(inverter.execute('PCP01').valid_response)
+            inverter.execute('QPIGS')
+        self.assertEqual(self.simulator.requests, 4)
+
+    def test_unknown_device(self):
+        """ devices the multiplexer does not share should get no response """
+        with mppinverter.mppInverter('mux:/dev/hidraw9@{}'.format(self.address),
+                                     retry_policy=mppinverter.mppRetryPolicy(max_attempts=1)) as inverter:
+            self.assertIsNone(inverter.execute('QPI').getResponse())
+        self.assertEqual(self.simulator.requests, 0)
+
+    def test_tcp(self):
+        """ the multiplexer should also serve on TCP loopback """
+        server = mppmux.createServer(self.multiplexer, ('127.0.0.1', 0))
+        thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05})
+        thread.start()
+        try:
+            device = 'mux:{}@127.0.0.1:{}'.format(self.simulator.device, server.server_address[1])
+            with mppinverter.mppInverter(device) as inverter:
+                self.assertTrue(inverter.execute('QPI').valid_response)
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+
+    def test_tcp_loopback_only(self):
+        """ the multiplexer should only listen on other addresses if allowed """
+        self.assertTrue(mppmux.isLoopback('localhost'))
+        self.assertFalse(mppmux.isLoopback('0.0.0.0'))
+        self.assertRaises(ValueError, mppmux.createServer, self.multiplexer, ('0.0.0.0', 0))
+        server = mppmux.createServer(self.multiplexer, ('0.0.0.0', 0), allow_remote=True)
+        server.server_close()
+
+    def test_client_single_attempt(self):
+        """ clients should not retry, the daemon retries the command itself """
+        with mppinverter.mppInverter(self.device) as inverter:
+            self.assertEqual(inverter._retry_policy.max_attempts, 1)
@@ -0,0 +1,301 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from mppsolar import mpppublish
+
+
+class fake_clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class fake_receipt(object):
+    """ stands in for paho's MQTTMessageInfo, published once the test confirms it """
+
+    def __init__(self):
+        self.published = False
+
+    def is_published(self):
+        return self.published
+
+
+def published(publish, topic, field, value):
+    """ checks a value with the filter and records it if it is published (as mpp_info_pub does once it is queued) """
+    if not publish.changed(topic, field, value):
+        return False
+    publish.record(topic, value)
+    return True
+
+
+class test_mpppublish(unittest.TestCase):
+    def test_parse_deadbands(self):
+        """ deadbands should be absolute or relative (percent) """
+        deadbands = mpppublish.parseDeadbands('battery_voltage=0.2, ac_output_load=5%,*=1')
+        self.assertEqual(deadbands, {'battery_voltage': (0.2, 0.0), 'ac_output_load': (0.0, 0.05), '*': (1.0, 0.0)})
+        self.assertEqual(mpppublish.parseDeadbands(None), {})
+        self.assertRaises(ValueError, mpppublish.parseDeadbands, 'battery_voltage')
+        self.assertRaises(ValueError, mpppublish.parseDeadbands, 'battery_voltage=low')
+
+    def test_unchanged_suppressed(self):
+        """ values should only be published when they change """
+        publish = mpppublish.mppPublishFilter()
+        self.assertTrue(published(publish, '/a', 'serial_number', '9293333010501'))
+        self.assertFalse(published(publish, '/a', 'serial_number', '9293333010501'))
+        self.assertTrue(published(publish, '/b', 'is_load_on', True))
+        self.assertFalse(published(publish, '/b', 'is_load_on', True))
+        self.assertTrue(published(publish, '/b', 'is_load_on', False))
+        self.assertEqual((publish.published, publish.suppressed), (3, 2))
+
+    def test_deadbands(self):
+        """ numbers should be published once they move past the deadband from the value last published """
+        publish = mpppublish.mppPublishFilter(mpppublish.parseDeadbands('battery_voltage=0.2,ac_output_load=10%'))
+        self.assertTrue(published(publish, '/v', 'battery_voltage', 52.0))
+        self.assertFalse(published(publish, '/v', 'battery_voltage', 52.15))
+        self.assertFalse(published(publish, '/v', 'battery_voltage', 51.85))
+        self.assertTrue(published(publish, '/v', 'battery_voltage', 52.3))
+        self.assertTrue(published(publish, '/l', 'ac_output_load', 50))
+        self.assertFalse(published(publish, '/l', 'ac_output_load', 54))
+        self.assertTrue(published(publish, '/l', 'ac_output_load', 56))
+        # no deadband: any change
+        self.assertTrue(published(publish, '/p', 'pv_input_voltage', 100.0))
+        self.assertTrue(published(publish, '/p', 'pv_input_voltage', 100.1))
+        # text where a number was
+        self.assertTrue(published(publish, '/v', 'battery_voltage', '--.-'))
+
+    def test_heartbeat(self):
+        """ unchanged values should be published again after the heartbeat, and after clear """
+        clock = fake_clock()
+        publish = mpppublish.mppPublishFilter(heartbeat=60, clock=clock)
+        self.assertTrue(published(publish, '/a', 'serial_number', '1'))
+        clock.now += 59
+        self.assertFalse(published(publish, '/a', 'serial_number', '1'))
+        clock.now += 1
+        self.assertTrue(published(publish, '/a', 'serial_number', '1'))
+        self.assertFalse(published(publish, '/a', 'serial_number', '1'))
+        publish.clear()
+        self.assertTrue(published(publish, '/a', 'serial_number', '1'))
+        never = mpppublish.mppPublishFilter(heartbeat=0, clock=clock)
+        published(never, '/a', 'serial_number', '1')
+        clock.now += 1e6
+        self.assertFalse(published(never, '/a', 'serial_number', '1'))
+
+    def test_document(self):
+        """ a document should hold the values of one cycle and a timestamp """
+        status = {'battery_voltage': {'value': 52.1, 'unit': 'V'}, 'is_load_on': {'value': True, 'unit': ''}}
+        settings = {'battery_type': {'value': 'AGM', 'unit': '', 'default': 'AGM'}}
+        document = mpppublish.buildDocument('9293333010501', 1500000000000, status, settings)
+        self.assertEqual(document, {'serial_number': '9293333010501', 'timestamp': 1500000000000,
+                                    'status': {'battery_voltage': 52.1, 'is_load_on': True},
+                                    'settings': {'battery_type': 'AGM'}})
+        self.assertNotIn('settings', mpppublish.buildDocument('9293333010501', 0, status))
+        encode = mpppublish.getDocumentEncoder('json')
+        self.assertEqual(json.loads(encode(document)), document)
+        self.assertRaises(ValueError, mpppublish.getDocumentEncoder, 'xml')
+
+    def test_binary_documents(self):
+        """ msgpack and cbor documents should decode to the same document (if the modules are installed) """
+        document = mpppublish.buildDocument('9293333010501', 1500000000000, {'battery_voltage': {'value': 52.1, 'unit': 'V'}})
+        for document_format, decode in (('msgpack', 'unpackb'), ('cbor', 'loads')):
+            try:
+                encode = mpppublish.getDocumentEncoder(document_format)
+            except ImportError:
+                continue
+            module = __import__(mpppublish.DOCUMENT_FORMATS[document_format])
+            encoded = encode(document)
+            self.assertIsInstance(encoded, bytes)
+            self.assertLess(len(encoded), len(mpppublish.getDocumentEncoder('json')(document)))
+            self.assertEqual(getattr(module, decode)(encoded), document)
+
+    def test_queue_waits_for_broker(self):
+        """ queued messages should be sent in order once connected """
+        sent = []
+        queue = mpppublish.mppPublishQueue(lambda topic, payload, timestamp: sent.append((topic, payload)) or True)
+        queue.start()
+        try:
+            queue.put('/a', '1')
+            queue.put('/b', '2')
+            self.assertFalse(queue.flush(0.2))
+            self.assertEqual(sent, [])
+            queue.setConnected(True)
+            self.assertTrue(queue.flush(5))
+            self.assertEqual(sent, [('/a', '1'), ('/b', '2')])
+        finally:
+            queue.stop()
+
+    def test_queue_resends_unconfirmed(self):
+        """ a message the broker did not confirm should be sent again before the next one """
+        attempts = []
+
+        def send(topic, payload, timestamp):
+            attempts.append(payload)
+            return len(attempts) > 1
+
+        retry_delay = mpppublish.RETRY_DELAY
+        mpppublish.RETRY_DELAY = 0.01
+        queue = mpppublish.mppPublishQueue(send)
+        queue.start()
+        try:
+            queue.put('/a', '1')
+            queue.put('/b', '2')
+            queue.setConnected(True)
+            self.assertTrue(queue.flush(5))
+            self.assertEqual(attempts, ['1', '1', '2'])
+            self.assertEqual(queue.sent, 2)
+        finally:
+            queue.stop()
+            mpppublish.RETRY_DELAY = retry_delay
+
+    def test_queue_window(self):
+        """ several messages should be in flight while the broker has not confirmed them yet """
+        receipts = []
+        broker = {'confirming': False}
+
+        def send(topic, payload, timestamp):
+            receipts.append((payload, fake_receipt()))
+            receipts[-1][1].published = broker['confirming']
+            return receipts[-1][1]
+
+        queue = mpppublish.mppPublishQueue(send, window=3)
+        queue.start()
+        try:
+            for i in range(5):
+                queue.put('/a', str(i))
+            queue.setConnected(True)
+            self.assertFalse(queue.flush(0.2))
+            # the window is full, nothing more is sent until a message is confirmed
+            self.assertEqual([payload for payload, _ in receipts], ['0', '1', '2'])
+            self.assertEqual(queue.sent, 0)
+            receipts[1][1].published = True
+            self.assertFalse(queue.flush(0.2))
+            self.assertEqual([payload for payload, _ in receipts], ['0', '1', '2', '3'])
+            self.assertEqual(queue.sent, 1)
+            broker['confirming'] = True
+            for _, receipt in receipts:
+                receipt.published = True
+            self.assertTrue(queue.flush(5))
+            self.assertEqual([payload for payload, _ in receipts], ['0', '1', '2', '3', '4'])
+            self.assertEqual(queue.sent, 5)
+        finally:
+            queue.stop()
+
+    def test_queue_leaves_resending_to_client(self):
+        """ a message the client took should not be sent again by the queue, however long the broker takes """
+        attempts = []
+        receipts = {}
+
+        def send(topic, payload, timestamp):
+            attempts.append(payload)
+            receipts[payload] = fake_receipt()
+            return receipts[payload]
+
+        queue = mpppublish.mppPublishQueue(send)
+        queue.start()
+        try:
+            for i in range(3):
+                queue.put('/a', str(i))
+            queue.setConnected(True)
+            self.assertFalse(queue.flush(0.3))
+            self.assertEqual(attempts, ['0', '1', '2'])
+            for receipt in receipts.values():
+                receipt.published = True
+            self.assertTrue(queue.flush(5))
+            self.assertEqual(attempts, ['0', '1', '2'])
+            self.assertEqual(queue.sent, 3)
+        finally:
+            queue.stop()
+
+    def test_filter_forgets_dropped(self):
+        """ a value the queue drops should be published again, not suppressed as unchanged """
+        publish = mpppublish.mppPublishFilter()
+        queue = mpppublish.mppPublishQueue(lambda topic, payload, timestamp: True, maxsize=1, on_drop=publish.forget)
+        for topic in ('/a', '/b'):
+            if publish.changed(topic, 'serial_number', '1') and queue.put(topic, '1'):
+                publish.record(topic, '1')
+        self.assertEqual(queue.dropped, 1)
+        self.assertTrue(publish.changed('/a', 'serial_number', '1'))
+        self.assertFalse(publish.changed('/b', 'serial_number', '1'))
+        # nothing is queued once the queue has stopped
+        queue.stop()
+        self.assertFalse(queue.put('/c', '1'))
+
+    def test_queue_stop_spools_in_flight(self):
+        """ messages in flight when stopped should be spooled ahead of the queue """
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'publish.spool')
+        try:
+            queue = mpppublish.mppPublishQueue(lambda *message: fake_receipt(), spool=mpppublish.mppSpool(filename))
+            queue.start()
+            for i in range(3):
+                queue.put('/a', str(i), timestamp=1000 + i)
+            queue.setConnected(True)
+            self.assertFalse(queue.flush(0.2))
+            queue.put('/a', '3', timestamp=1003)
+            queue.stop()
+            spool = mpppublish.mppSpool(filename)
+            self.assertEqual([spool.next() for _ in range(5)], [(1000 + i, '/a', str(i)) for i in range(4)] + [None])
+            spool.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_queue_full_without_spool(self):
+        """ without a spool the oldest messages should be dropped """
+        queue = mpppublish.mppPublishQueue(lambda topic, payload, timestamp: True, maxsize=2)
+        for i in range(5):
+            queue.put('/a', str(i))
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(queue.dropped, 3)
+
+    def test_spool(self):
+        """ messages past the queue should be spooled, then replayed in order with their timestamps """
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'publish.spool')
+        try:
+            sent = []
+            queue = mpppublish.mppPublishQueue(lambda *message: sent.append(message) or True, maxsize=2,
+                                               spool=mpppublish.mppSpool(filename))
+            for i in range(5):
+                queue.put('/a', str(i), timestamp=1000 + i)
+            queue.put('/doc', b'\x81\xa1a\x01', timestamp=1005)
+            self.assertEqual((len(queue), queue.spooled), (2, 4))
+            # stopped before the broker came back: everything is spooled for the next run
+            queue.stop()
+            self.assertGreater(os.path.getsize(filename), 0)
+            queue = mpppublish.mppPublishQueue(lambda *message: sent.append(message) or True, maxsize=2,
+                                               spool=mpppublish.mppSpool(filename))
+            queue.put('/a', '6', timestamp=1006)
+            queue.start()
+            queue.setConnected(True)
+            self.assertTrue(queue.flush(5))
+            queue.stop()
+            expected = [('/a', str(i), 1000 + i) for i in range(5)] + [('/doc', b'\x81\xa1a\x01', 1005), ('/a', '6', 1006)]
+            self.assertEqual(sent, expected)
+            self.assertEqual(os.path.getsize(filename), 0)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_spool_written_by_spool_thread(self):
+        """ put() should not wait for the spool file, spooled messages should still be sent in order """
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'publish.spool')
+        try:
+            sent = []
+            queue = mpppublish.mppPublishQueue(lambda *message: sent.append(message) or True, maxsize=2,
+                                               spool=mpppublish.mppSpool(filename))
+            queue.start()
+            # the spool file is busy (e.g. a slow disk)
+            with queue._spool_lock:
+                for i in range(10):
+                    queue.put('/a', str(i), timestamp=1000 + i)
+                self.assertEqual(queue.spooled, 8)
+            queue.setConnected(True)
+            self.assertTrue(queue.flush(5))
+            queue.stop()
+            self.assertEqual(sent, [('/a', str(i), 1000 + i) for i in range(10)])
+            self.assertEqual(os.path.getsize(filename), 0)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+from mppsolar import mppinverter
+from mppsolar import mppregistry
+
+
+class test_mppregistry(unittest.TestCase):
+    def test_shared(self):
+        """ the registry should be loaded once per process """
+        self.assertIs(mppregistry.getCommandRegistry(), mppregistry.getCommandRegistry())
+        self.assertEqual(len(mppregistry.getCommandRegistry()), len(mppregistry.getCommandsFromJson()))
+
+    def test_find_name(self):
+        """ commands without a regex should be found by name """
+        command, value = mppregistry.getCommandRegistry().find('QPIGS')
+        self.assertEqual(command.name, 'QPIGS')
+        self.assertIsNone(value)
+
+    def test_find_regex(self):
+        """ parameterised commands should be found with their value """
+        registry = mppregistry.getCommandRegistry()
+        for cmd, name, value in [('PCP01', 'PCP', '01'), ('POP02', 'POP', '02'), ('PBT01', 'PBT', '01'),
+                                 ('PBFT58.0', 'PBFT', '58.0')]:
+            command, found = registry.find(cmd)
+            self.assertEqual(command.name, name)
+            self.assertEqual(found, value)
+
+    def test_find_unknown(self):
+        """ unknown commands (and bad values) should not be found """
+        registry = mppregistry.getCommandRegistry()
+        self.assertEqual(registry.find('INVALID99'), (None, None))
+        self.assertEqual(registry.find('PCP09'), (None, None))
+        self.assertEqual(registry.find('PCP011'), (None, None))
+
+    def test_inverters_share_commands(self):
+        """ inverters should share the command definitions, each execute gets its own request """
+        inverter1 = mppinverter.mppInverter('TEST')
+        inverter2 = mppinverter.mppInverter('TEST')
+        self.assertIs(inverter1._findCommand('PCP01')[0], inverter2._findCommand('PCP02')[0])
+        command1 = inverter1.execute('PCP01')
+        command2 = inverter2.execute('PCP02')
+        self.assertIsNot(command1, command2)
+        self.assertIs(command1.command, command2.command)
+        self.assertEqual(command1.value, '01')
+        self.assertEqual(command2.value, '02')
+
+    def test_cache(self):
+        """ the registry should be cached, and rebuilt when a definition changes """
+        directory = tempfile.mkdtemp()
+        for name in ['qpigs.json', 'pcp.json']:
+            shutil.copy(os.path.join(mppregistry.COMMANDS_DIR, name), directory)
+        cache_file = os.path.join(directory, 'cache', 'commands.cache')
+
+        registry = mppregistry.loadCommandRegistry(cache_file, directory)
+        self.assertFalse(registry.loaded_from_cache)
+        self.assertTrue(os.path.exists(cache_file))
+
+        cached = mppregistry.loadCommandRegistry(cache_file, directory)
+        self.assertTrue(cached.loaded_from_cache)
+        self.assertEqual([c.full_command for c in cached.commands], [c.full_command for c in registry.commands])
+        self.assertEqual(cached.find('PCP02')[1], '02')
+
+        stat = os.stat(os.path.join(directory, 'pcp.json'))
+        os.utime(os.path.join(directory, 'pcp.json'), (stat.st_atime, stat.st_mtime + 10))
+        self.assertFalse(mppregistry.loadCommandRegistry(cache_file, directory).loaded_from_cache)
+        self.assertTrue(mppregistry.loadCommandRegistry(cache_file, directory).loaded_from_cache)
+
+    def test_signature_covers_crc(self):
+        """ the cached full commands come from mppcrc, so a change to it should invalidate the cache """
+        from mppsolar import mppcrc
+        files = [entry[0] for entry in mppregistry.getDefinitionsSignature()[2:]]
+        self.assertIn(os.path.basename(mppcrc.__file__), files)
+
+    def test_cache_unreadable(self):
+        """ a damaged cache should be ignored and rewritten """
+        cache_file = os.path.join(tempfile.mkdtemp(), 'commands.cache')
+        with open(cache_file, 'wb') as f:
+            f.write(b'not a cache')
+        self.assertFalse(mppregistry.loadCommandRegistry(cache_file).loaded_from_cache)
+        self.assertTrue(mppregistry.loadCommandRegistry(cache_file).loaded_from_cache)
@@ -0,0 +1,124 @@
+import threading
+import time
+import unittest
+from mppsolar import mppretry
+from mppsolar import mppinverter
+from mppsolar import mppsimulator
+
+
+class fake_dead_connection(object):
+    """ a connection to a device that never answers, each query waits until released """
+
+    def __init__(self):
+        self.queries = 0
+        self.querying = threading.Event()
+        self.release = threading.Event()
+
+    def query(self, *args):
+        self.queries += 1
+        self.querying.set()
+        self.release.wait(5)
+        return None
+
+    def close(self):
+        pass
+
+
+class test_mppretry(unittest.TestCase):
+    def test_backoff(self):
+        """ delay should back off for no response, but not for a bad response """
+        policy = mppretry.mppRetryPolicy(initial_delay=0.1, backoff=2, max_delay=0.3)
+        self.assertAlmostEqual(policy.getDelay(1), 0.1)
+        self.assertAlmostEqual(policy.getDelay(2), 0.2)
+        self.assertAlmostEqual(policy.getDelay(3), 0.3)
+        self.assertEqual(policy.getDelay(3, responded=True), 0)
+
+    def test_should_retry(self):
+        """ retries should stop at max attempts or the deadline """
+        policy = mppretry.mppRetryPolicy(max_attempts=3, deadline=5)
+        now = mppretry.monotonic()
+        self.assertTrue(policy.shouldRetry(1, now, 0.1))
+        self.assertFalse(policy.shouldRetry(3, now, 0.1))
+        self.assertFalse(policy.shouldRetry(1, now - 5, 0.1))
+
+    def test_circuit_breaker(self):
+        """ breaker should open after threshold failures and close on success """
+        breaker = mppretry.mppCircuitBreaker(threshold=2, probe_interval=0)
+        self.assertFalse(breaker.recordFailure())
+        self.assertFalse(breaker.isOpen())
+        self.assertTrue(breaker.recordFailure())
+        self.assertTrue(breaker.isOpen())
+        self.assertTrue(breaker.isProbeDue())
+        self.assertFalse(breaker.recordFailure())
+        breaker.recordSuccess()
+        self.assertFalse(breaker.isOpen())
+
+    def test_dead_device_fails_fast(self):
+        """ once marked down, commands to a missing device should return straight away """
+        policy = mppretry.mppRetryPolicy(max_attempts=2, initial_delay=0.01)
+        breaker = mppretry.mppCircuitBreaker(threshold=2, probe_interval=60)
+        inverter = mppinverter.mppInverter('/dev/ttyDOESNOTEXIST', retry_policy=policy, circuit_breaker=breaker)
+        try:
+            inverter.execute('QPIGS')
+            self.assertFalse(inverter.isDown())
+            inverter.execute('QPIGS')
+            self.assertTrue(inverter.isDown())
+            start = time.time()
+            command = inverter.execute('QPIGS')
+            self.assertLess(time.time() - start, 0.1)
+            self.assertIsNone(command.getResponse())
+        finally:
+            inverter.close()
+
+    def test_probe_marks_device_up(self):
+        """ a successful background probe should mark the device up again """
+        breaker = mppretry.mppCircuitBreaker(threshold=1, probe_interval=0.05)
+        inverter = mppinverter.mppInverter('TEST', circuit_breaker=breaker)
+        inverter._circuit_breaker.recordFailure()
+        self.assertTrue(inverter.isDown())
+        inverter._scheduleProbe()
+        for _ in range(100):
+            if not inverter.isDown():
+                break
+            time.sleep(0.01)
+        self.assertFalse(inverter.isDown())
+
+    def test_close_during_probe(self):
+        """ a probe failing while the inverter is closed should not schedule another one """
+        breaker = mppretry.mppCircuitBreaker(threshold=1, probe_interval=0.05)
+        inverter = mppinverter.mppInverter('/dev/ttyDOESNOTEXIST', circuit_breaker=breaker)
+        connection = inverter._connection = fake_dead_connection()
+        breaker.recordFailure()
+        inverter._scheduleProbe()
+        self.assertTrue(connection.querying.wait(5))
+        closing = threading.Thread(target=inverter.close)
+        closing.start()
+        time.sleep(0.1)
+        connection.release.set()
+        closing.join()
+        time.sleep(0.3)
+        self.assertEqual(connection.queries, 1)
+        self.assertFalse(inverter._scheduler.isRunning())
+        self.assertIsNone(inverter._probe_timer)
+
+    def test_damaged_responses_keep_device_up(self):
+        """ damaged responses mean the device is there: retried straight away, never marking it down """
+        breaker = mppretry.mppCircuitBreaker(threshold=1, probe_interval=60)
+        with mppsimulator.mppSimulator(corrupt_rate=1, seed=1) as simulator:
+            with mppinverter.mppInverter(simulator.device, circuit_breaker=breaker) as inverter:
+                start = time.time()
+                command = inverter.execute('QPIGS')
+                elapsed = time.time() - start
+                self.assertFalse(command.valid_response)
+                self.assertFalse(inverter.isDown())
+        self.assertEqual(simulator.requests, 3)
+        self.assertLess(elapsed, mppretry.mppRetryPolicy().initial_delay)
+
+    def test_noisy_line_keeps_device_up(self):
+        """ an occasional damaged or cut short response should not mark the device down """
+        breaker = mppretry.mppCircuitBreaker(threshold=1, probe_interval=60)
+        with mppsimulator.mppSimulator(corrupt_rate=0.01, drop_rate=0.01, seed=1) as simulator:
+            with mppinverter.mppInverter(simulator.device, timeout=0.2, circuit_breaker=breaker) as inverter:
+                for _ in range(20):
+                    inverter.execute('QPIGS')
+                self.assertFalse(inverter.isDown())
@@ -0,0 +1,60 @@
+import pickle
+import unittest
+from mppsolar import mppdecoder
+from mppsolar import mppsample
+
+DEFINITION = [
+    ['float', 'AC Input Voltage', 'V'],
+    ['int', 'Battery Capacity', '%'],
+    ['stat_flags', 'Warning status', ['Reserved', 'Inverter fault', 'Bus Over']],
+    ['enflags', 'Device Status', {'a': {'name': 'Buzzer', 'state': 'disabled'},
+                                  'b': {'name': 'Overload Bypass', 'state': 'disabled'}}],
+]
+RESPONSE = b'(230.0 085 010 Ea\x00\x00\r'
+
+
+class test_mppsample(unittest.TestCase):
+    def test_schema_shared(self):
+        """ samples of a command should share one schema holding the keys and units """
+        decoder = mppdecoder.mppResponseDecoder('TEST', 'QUERY', DEFINITION)
+        first = decoder.decodeSample(RESPONSE)
+        second = decoder.decodeSample(RESPONSE, typed=True)
+        self.assertIs(first.schema, second.schema)
+        self.assertEqual(first.unit('ac_input_voltage'), 'V')
+        self.assertFalse(hasattr(second, '__dict__'))
+
+    def test_sample_values(self):
+        """ a sample should read like a dict of the values in the response """
+        sample = mppdecoder.mppResponseDecoder('TEST', 'QUERY', DEFINITION).decodeSample(RESPONSE, typed=True)
+        self.assertEqual(sample['ac_input_voltage'], 230.0)
+        self.assertEqual(sample.get('battery_capacity'), 85)
+        self.assertIn('inverter_fault', sample)
+        self.assertNotIn('bus_over', sample)
+        self.assertRaises(KeyError, sample.__getitem__, 'bus_over')
+        self.assertIsNone(sample.get('Overload Bypass'))
+        self.assertEqual(sample.keys(), ['ac_input_voltage', 'battery_capacity', 'inverter_fault', 'Buzzer'])
+        self.assertEqual(len(sample), 4)
+
+    def test_dict_views(self):
+        """ the dict views should match the response dict and status dict """
+        decoder = mppdecoder.mppResponseDecoder('TEST', 'QUERY', DEFINITION)
+        sample = decoder.decodeSample(RESPONSE)
+        self.assertDictEqual(sample.toDict(), {
+            'ac_input_voltage': ['230.0', 'V'],
+            'battery_capacity': ['085', '%'],
+            'inverter_fault': ['1', ''],
+            'Buzzer': ['enabled', ''],
+        })
+        status = {'other': {'value': 1, 'unit': ''}}
+        sample.toStatus(status)
+        self.assertEqual(status['Buzzer'], {'value': 'enabled', 'unit': ''})
+        self.assertEqual(status['ac_input_voltage'], {'value': '230.0', 'unit': 'V'})
+        self.assertIn('other', status)
+
+    def test_pickle(self):
+        """ schemas (kept in the registry cache) and samples should survive pickling """
+        sample = mppdecoder.mppResponseDecoder('TEST', 'QUERY', DEFINITION).decodeSample(RESPONSE)
+        restored = pickle.loads(pickle.dumps(sample))
+        self.assertEqual(restored, sample)
+        self.assertIs(restored.values[-1], mppsample.MISSING)
+        self.assertEqual(restored.schema.status_keys, sample.schema.status_keys)
@@ -0,0 +1,97 @@
+import threading
+import unittest
+from mppsolar import mppscheduler
+from mppsolar import mppinverter
+
+
+class test_mppscheduler(unittest.TestCase):
+    def test_submit_result(self):
+        """ submit should return a future with the job's result """
+        scheduler = mppscheduler.mppScheduler()
+        self.assertEqual(scheduler.submit(lambda x: x * 2, mppscheduler.PRIORITY_QUERY, 21).result(), 42)
+        scheduler.stop()
+        self.assertFalse(scheduler.isRunning())
+
+    def test_submit_exception(self):
+        """ an exception in a job should be raised from the future """
+        scheduler = mppscheduler.mppScheduler()
+        future = scheduler.submit(lambda: 1 / 0)
+        self.assertRaises(ZeroDivisionError, future.result)
+
+    def test_priority_order(self):
+        """ queued setters should run before queued queries """
+        scheduler = mppscheduler.mppScheduler()
+        release = threading.Event()
+        order = []
+        blocker = scheduler.submit(release.wait)
+        futures = [scheduler.submit(order.append, mppscheduler.PRIORITY_QUERY, 'query1'),
+                   scheduler.submit(order.append, mppscheduler.PRIORITY_BACKGROUND, 'probe'),
+                   scheduler.submit(order.append, mppscheduler.PRIORITY_SETTER, 'setter'),
+                   scheduler.submit(order.append, mppscheduler.PRIORITY_QUERY, 'query2')]
+        release.set()
+        blocker.result()
+        for future in futures:
+            future.result()
+        self.assertEqual(order, ['setter', 'query1', 'query2', 'probe'])
+
+    def test_gather_futures(self):
+        """ gathered futures should give their results in order, or the first exception """
+        scheduler = mppscheduler.mppScheduler()
+        futures = [scheduler.submit(lambda x: x, mppscheduler.PRIORITY_QUERY, x) for x in range(3)]
+        self.assertEqual(mppscheduler.gatherFutures(futures).result(timeout=5), [0, 1, 2])
+        self.assertEqual(mppscheduler.gatherFutures([]).result(timeout=5), [])
+        failed = mppscheduler.gatherFutures([scheduler.submit(lambda: 1 / 0), scheduler.submit(lambda: 1)])
+        self.assertRaises(ZeroDivisionError, failed.result, 5)
+
+    def test_setter_during_execute_many(self):
+        """ a setter submitted while several queries are queued should run before the rest of them """
+        inverter = mppinverter.mppInverter('TEST')
+        order = []
+        do_command = inverter._doCommand
+        inverter._doCommand = lambda command: order.append(command.name) or do_command(command)
+        release = threading.Event()
+        blocker = inverter._scheduler.submit(release.wait)
+        queries = inverter.submitMany(['QPI', 'QID', 'QPIGS'])
+        setter = inverter.submit('PCP00')
+        release.set()
+        blocker.result()
+        self.assertEqual([c.name for c in queries.result(timeout=5)], ['QPI', 'QID', 'QPIGS'])
+        self.assertEqual(order, [setter.result().name, 'QPI', 'QID', 'QPIGS'])
+
+    def test_submit_from_worker(self):
+        """ a job submitting to its own scheduler should not deadlock """
+        scheduler = mppscheduler.mppScheduler()
+        future = scheduler.submit(lambda: scheduler.submit(lambda: 'inner').result())
+        self.assertEqual(future.result(timeout=5), 'inner')
+
+    def test_inverter_concurrent_execute(self):
+        """ commands from several threads should all complete (TEST connection) """
+        inverter = mppinverter.mppInverter('TEST')
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(inverter.execute('QID').getResponseDict()))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 5)
+        for result in results:
+            self.assertEqual(result['serial_number'][0], '9293333010501')
+
+    def test_inverter_submit(self):
+        """ inverter submit should return a future for the command """
+        inverter = mppinverter.mppInverter('TEST')
+        command = inverter.submit('QPI').result(timeout=5)
+        self.assertEqual(command.name, 'QPI')
+
+    def test_inverter_close_stops_worker(self):
+        """ closing an inverter should stop its worker thread, a later command should restart it """
+        inverter = mppinverter.mppInverter('TEST')
+        inverter.execute('QPI')
+        worker = inverter._scheduler._worker
+        self.assertTrue(worker.is_alive())
+        inverter.close()
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(inverter.execute('QPI').name, 'QPI')
+        inverter.close()
+        self.assertFalse(inverter._scheduler.isRunning())
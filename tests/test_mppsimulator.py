@@ -0,0 +1,71 @@
+import os
+import tempfile
+import time
+import unittest
+from mppsolar import mppsimulator
+from mppsolar import mppinverter
+from mppsolar import mppretry
+
+
+class test_mppsimulator(unittest.TestCase):
+    def test_respond(self):
+        """ simulator should answer queries, setters and bad commands """
+        simulator = mppsimulator.mppSimulator()
+        self.assertEqual(simulator.respond(mppsimulator.buildFrame(b'QPI')), b'(PI30\x9a\x0b\r')
+        self.assertEqual(simulator.respond(mppsimulator.buildFrame(b'PCP01')), b'(ACK9 \r')
+        self.assertEqual(simulator.respond(mppsimulator.buildFrame(b'BOGUS')), b'(NAKss\r')
+        self.assertEqual(simulator.respond(b'QPI\x00\x00\r'), b'(NAKss\r')
+        self.assertEqual(simulator.requests, 4)
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'counts the open file descriptors in /proc')
+    def test_bad_link(self):
+        """ a link that cannot be made should not leave the pty open """
+        fds = len(os.listdir('/proc/self/fd'))
+        link = os.path.join(tempfile.mkdtemp(), 'missing', 'hidraw0')
+        simulator = mppsimulator.mppSimulator(link=link)
+        self.assertRaises(OSError, simulator.start)
+        self.assertIsNone(simulator._master)
+        self.assertEqual(len(os.listdir('/proc/self/fd')), fds)
+
+    def test_serial(self):
+        """ serial transport against the simulated inverter """
+        with mppsimulator.mppSimulator() as simulator:
+            with mppinverter.mppInverter(simulator.device) as inverter:
+                command = inverter.execute('QPIGS')
+        self.assertTrue(command.valid_response)
+        self.assertEqual(command.getResponseDict()['battery_voltage'][0], '57.50')
+
+    def test_socket(self):
+        """ serial transport over a socket:// URL against the simulated inverter """
+        with mppsimulator.mppSimulator(port=0) as simulator:
+            with mppinverter.mppInverter('socket://127.0.0.1:{}'.format(simulator.port)) as inverter:
+                command = inverter.execute('QID')
+        self.assertTrue(command.valid_response)
+
+    def test_hidraw(self):
+        """ direct USB transport against the simulated inverter (via a hidraw named link) """
+        link = os.path.join(tempfile.mkdtemp(), 'hidraw0')
+        with mppsimulator.mppSimulator(link=link):
+            with mppinverter.mppInverter(link, pacing='adaptive') as inverter:
+                self.assertTrue(inverter._direct_usb)
+                command = inverter.execute('QPIGS')
+        self.assertTrue(command.valid_response)
+
+    def test_baud_rate(self):
+        """ the answer should take about as long as it would at the emulated baud rate """
+        with mppsimulator.mppSimulator(baud_rate=2400) as simulator:
+            with mppinverter.mppInverter(simulator.device) as inverter:
+                start = time.time()
+                command = inverter.execute('QPIGS')
+                elapsed = time.time() - start
+        self.assertTrue(command.valid_response)
+        self.assertGreater(elapsed, len(command.getResponse()) * 10.0 / 2400)
+
+    def test_corruption(self):
+        """ corrupted answers should fail validation (and be retried) """
+        policy = mppretry.mppRetryPolicy(max_attempts=2, initial_delay=0)
+        with mppsimulator.mppSimulator(corrupt_rate=1, seed=1) as simulator:
+            with mppinverter.mppInverter(simulator.device, retry_policy=policy) as inverter:
+                command = inverter.execute('QPIGS')
+        self.assertFalse(command.valid_response)
+        self.assertEqual(simulator.requests, 2)
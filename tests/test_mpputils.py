@@ -1,6 +1,7 @@
 import unittest
 from mppsolar import mpputils
 from mppsolar import mppinverter
+from mppsolar import mppsimulator
 
 
 class test_mpputils(unittest.TestCase):
@@ -42,3 +43,39 @@ class test_mpputils(unittest.TestCase):
         response = utils.getSettings()
         print(response)
         self.assertIsInstance(response, dict)
+
+    def test_execute_many(self):
+        """ test executeMany response from mppUtils """
+        utils = mpputils.mppUtils('TEST')
+        response = utils.executeMany(['QID', 'QPI'])
+        self.assertEqual(response['QID']['serial_number'][0], '9293333010501')
+        self.assertEqual(response['QPI']['protocol_id'][0], 'PI30')
+
+    def test_execute_many_typed(self):
+        """ typed responses should hold native values """
+        utils = mpputils.mppUtils('TEST')
+        response = utils.executeMany(['QID', 'QPIGS'], typed=True)
+        self.assertEqual(response['QID']['serial_number'][0], '9293333010501')
+        self.assertIsInstance(response['QPIGS']['ac_input_voltage'][0], float)
+        self.assertIsInstance(response['QPIGS']['is_load_on'][0], bool)
+
+    def test_samples(self):
+        """ samples should give the same status as the response dicts """
+        utils = mpputils.mppUtils('TEST')
+        samples = utils.getSamples(['Q1', 'QPIGS'], typed=True)
+        self.assertIsInstance(samples['QPIGS']['ac_input_voltage'], float)
+        data = {}
+        for response in utils.executeMany(['Q1', 'QPIGS'], typed=True).values():
+            data.update(response)
+        status = dict((key, {'value': value, 'unit': unit}) for key, (value, unit) in data.items())
+        self.assertDictEqual(utils.getFullStatus(typed=True), status)
+
+    def test_full_status_unlisted_value(self):
+        """ a value the definition does not list should not lose the rest of the status """
+        with mppsimulator.mppSimulator() as simulator:
+            utils = mpputils.mppUtils(simulator.device)
+            status = utils.getFullStatus(queries='QMOD,QPIGS', typed=True)
+            utils.inverter.close()
+        # the QMOD test response is 'Se5', which is not one of its keys
+        self.assertEqual(status['device_mode']['value'], 'Se5')
+        self.assertIn('ac_input_voltage', status)